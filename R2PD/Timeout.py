@@ -1,42 +1,161 @@
 """
-Custom Timeout class
+Thread-safe timeouts and deadlines for downloads
 """
-import signal
+import asyncio
+import builtins
+import time
+import warnings
 
 
-class TimeoutError(Exception):
+class TimeoutError(builtins.TimeoutError):
     """
     Custom Error for Timeout
     """
-    pass
+    def __init__(self, msg, report=None):
+        """
+        Initialize TimeoutError
 
+        Parameters
+        ----------
+        msg : 'str'
+            Error message
+        report : 'DownloadReport'
+            Report of the downloads completed before the timeout
+        """
+        super(TimeoutError, self).__init__(msg)
+        self.report = report
 
-class Timeout(object):
+
+class Deadline(object):
     """
-    Timeout wrapper for signal.alarm
-    Currently only compatible with linux systems, need to update for windows
+    Point in time after which outstanding work should be abandoned. Unlike
+    signal.alarm a Deadline can be shared by any number of threads and
+    coroutines, which poll it or bound their waits by its remaining time.
+    """
+    def __init__(self, sec=None):
+        """
+        Initialize Deadline
+
+        Parameters
+        ----------
+        sec : 'float'
+            seconds from now until the deadline, None for no deadline
+        """
+        self.sec = sec
+        if sec is None:
+            self._end = None
+        else:
+            self._end = time.monotonic() + sec
+
+    def __repr__(self):
+        """
+        Print the type of deadline and the time remaining
+
+        Returns
+        ---------
+        'str'
+            type of deadline and seconds remaining
+        """
+        if self._end is None:
+            return '{} never'.format(self.__class__.__name__)
+
+        return '{n} in {r:.1f}s'.format(n=self.__class__.__name__,
+                                        r=self.remaining)
+
+    @property
+    def remaining(self):
+        """
+        Seconds until the deadline
+
+        Returns
+        ---------
+        'float'
+            Seconds remaining, 0 once expired and None if there is no
+            deadline
+        """
+        if self._end is None:
+            return None
+
+        return max(self._end - time.monotonic(), 0)
+
+    @property
+    def expired(self):
+        """
+        Whether the deadline has passed
+
+        Returns
+        ---------
+        'bool'
+            True if no time remains
+        """
+        return self._end is not None and time.monotonic() >= self._end
+
+    def timeout(self, timeout=None):
+        """
+        Bound timeout by the time remaining
+
+        Parameters
+        ----------
+        timeout : 'float'
+            Seconds to wait, None to wait until the deadline
+
+        Returns
+        ---------
+        'float'
+            Smaller of timeout and the time remaining, None if both are None
+        """
+        remaining = self.remaining
+        if remaining is None:
+            return timeout
+        elif timeout is None:
+            return remaining
+
+        return min(timeout, remaining)
+
+    def check(self):
+        """
+        Raise TimeoutError if the deadline has passed
+        """
+        if self.expired:
+            raise TimeoutError('Deadline of {} seconds exceeded!'
+                               .format(self.sec))
+
+
+class Timeout(Deadline):
+    """
+    Deprecated context manager kept for compatibility with the SIGALRM
+    based Timeout it replaces. The block is no longer interrupted, which
+    only worked in the main thread: TimeoutError is raised when the block
+    exits after the deadline. Use Deadline instead.
     """
     def __init__(self, sec):
         """
-        Initialize timeout
+        Initialize Timeout
 
         Parameters
         ----------
         sec : 'float'
             seconds before raising TimeoutError
         """
-        self.sec = sec
+        warnings.warn('Timeout is deprecated, use Deadline instead',
+                      DeprecationWarning, stacklevel=2)
+        super(Timeout, self).__init__(sec)
 
     def __enter__(self):
         """
-        Enter method to allow use of with
+        Enter method to allow use of with, starting the deadline
+
+        Returns
+        ---------
+        'Timeout'
+            This deadline, for the block to poll or bound its waits by
         """
-        signal.signal(signal.SIGALRM, self.raise_timeout)
-        signal.alarm(self.sec)
+        self._end = time.monotonic() + self.sec
+        return self
 
     def __exit__(self, type, value, traceback):
         """
-        Closes event_loop on exit from with
+        Raise TimeoutError if the block exits after the deadline
 
         Parameters
         ----------
@@ -47,20 +166,32 @@ class Timeout(object):
         traceback : 'str'
             error traceback
         """
-        # Reset alarm
-        signal.alarm(0)
+        if type is None:
+            self.check()
 
-        if type is not None:
-            raise
 
-    def raise_timeout(self, *args):
-        """
-        Closes event_loop on exit from with
+async def wait_for(aw, timeout, msg):
+    """
+    Await aw, raising TimeoutError if it takes longer than timeout
 
-        Parameters
-        ----------
-        *args : 'signal.signal handler args'
-            signal number and frame
-        """
-        raise TimeoutError("Connection timed out after {:} seconds!"
-                           .format(self.sec))
+    Parameters
+    ----------
+    aw : 'awaitable'
+        Coroutine or future to await
+    timeout : 'float'
+        Seconds to wait, None to wait indefinitely
+    msg : 'str'
+        Message of the TimeoutError
+
+    Returns
+    ---------
+    'object'
+        Result of aw
+    """
+    if timeout is None:
+        return await aw
+
+    try:
+        return await asyncio.wait_for(aw, timeout)
+    except asyncio.TimeoutError:
+        raise TimeoutError(msg)
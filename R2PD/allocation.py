@@ -0,0 +1,221 @@
+"""
+This module represents the matching of generator nodes to resource sites as
+a sparse nodes by sites matrix of the fraction of each site applied to each
+node. Aggregating the data of every node is then a single sparse matrix
+product with a time by site block of site data, and the matching can be
+saved and reloaded without running it again.
+"""
+import logging
+
+import numpy as np
+import pandas as pds
+from scipy import sparse
+
+logger = logging.getLogger(__name__)
+
+
+class AllocationMatrix(object):
+    """
+    Sparse (node, site) matrix of site fractions, with the node id of each
+    row and the site id of each column. Columns are sorted by site_id.
+    """
+    def __init__(self, weights, node_ids, site_ids):
+        """
+        Initialize AllocationMatrix
+
+        Parameters
+        ----------
+        weights : 'scipy.sparse.spmatrix'
+            (n_nodes, n_sites) matrix of the fraction of each site applied
+            to each node
+        node_ids : 'list'|'numpy.ndarray'
+            Node id of each row
+        site_ids : 'list'|'numpy.ndarray'
+            Sorted site id of each column
+        """
+        self.weights = sparse.csr_matrix(weights, dtype=float)
+        self.node_ids = np.asarray(node_ids)
+        self.site_ids = np.asarray(site_ids, dtype=np.int64)
+        if self.weights.shape != (len(self.node_ids), len(self.site_ids)):
+            raise ValueError('Weights of shape {} do not match {} nodes and '
+                             '{} sites'.format(self.weights.shape,
+                                               len(self.node_ids),
+                                               len(self.site_ids)))
+
+    def __repr__(self):
+        """
+        Print the type of matrix and its number of nodes, sites and
+        allocations
+
+        Returns
+        ---------
+        'str'
+            type of matrix, number of nodes, sites and allocations
+        """
+        return ('{n} of {r} nodes by {c} sites with {a} allocations'
+                .format(n=self.__class__.__name__, r=len(self.node_ids),
+                        c=len(self.site_ids), a=self.weights.nnz))
+
+    @property
+    def shape(self):
+        """
+        Number of nodes and sites
+
+        Returns
+        ---------
+        'tuple'
+            (n_nodes, n_sites)
+        """
+        return self.weights.shape
+
+    @classmethod
+    def from_allocations(cls, node_ids, nodes, site_ids, fracs):
+        """
+        Build matrix from a list of allocations
+
+        Parameters
+        ----------
+        node_ids : 'list'|'numpy.ndarray'
+            Id of every node, including those without allocations
+        nodes : 'numpy.ndarray'
+            Position in node_ids of the node of each allocation
+        site_ids : 'numpy.ndarray'
+            Site id of each allocation
+        fracs : 'numpy.ndarray'
+            Fraction of the site of each allocation
+
+        Returns
+        ---------
+        'AllocationMatrix'
+            Matrix of allocations, fractions of repeated (node, site) pairs
+            are summed
+        """
+        columns, cols = np.unique(np.asarray(site_ids, dtype=np.int64),
+                                  return_inverse=True)
+        weights = sparse.coo_matrix((np.asarray(fracs, dtype=float),
+                                     (np.asarray(nodes), cols)),
+                                    shape=(len(node_ids), len(columns)))
+
+        return cls(weights.tocsr(), node_ids, columns)
+
+    @classmethod
+    def from_lists(cls, node_ids, site_lists, frac_lists):
+        """
+        Build matrix from the site ids and fractions of each node, i.e. the
+        site_id and site_fracs columns of nearest_power_nodes
+
+        Parameters
+        ----------
+        node_ids : 'list'
+            Id of each node
+        site_lists : 'list'
+            List of site ids of each node
+        frac_lists : 'list'
+            List of site fractions of each node
+
+        Returns
+        ---------
+        'AllocationMatrix'
+            Matrix of allocations
+        """
+        nodes = []
+        site_ids = []
+        fracs = []
+        for i, (sites, site_fracs) in enumerate(zip(site_lists, frac_lists)):
+            if np.all(pds.isnull(sites)):
+                continue
+
+            nodes.extend([i] * len(sites))
+            site_ids.extend(sites)
+            fracs.extend(site_fracs)
+
+        return cls.from_allocations(node_ids, nodes, site_ids, fracs)
+
+    def get_sites(self, node_id):
+        """
+        Sites allocated to a node
+
+        Parameters
+        ----------
+        node_id : 'int'|'str'
+            Node id
+
+        Returns
+        ---------
+        site_ids : 'numpy.ndarray'
+            Site id of each site allocated to node, sorted
+        fracs : 'numpy.ndarray'
+            Fraction of each site allocated to node
+        """
+        rows = np.flatnonzero(self.node_ids == node_id)
+        if not len(rows):
+            raise KeyError('Node {} is not in {}'.format(node_id, self))
+
+        row = self.weights.getrow(rows[0])
+        return self.site_ids[row.indices], row.data
+
+    def aggregate(self, data):
+        """
+        Aggregate site data into node data with a single sparse product
+
+        Parameters
+        ----------
+        data : 'pandas.DataFrame'|'numpy.ndarray'
+            Time by site DataFrame whose columns include every site id, or
+            array whose columns are aligned with site_ids
+
+        Returns
+        ---------
+        'pandas.DataFrame'|'numpy.ndarray'
+            Time by node data, a DataFrame indexed like data with node id
+            columns if data is a DataFrame
+        """
+        if isinstance(data, pds.DataFrame):
+            values = data[self.site_ids].values
+        else:
+            values = np.asarray(data)
+
+        agg = np.asarray((self.weights @ values.T).T)
+        if isinstance(data, pds.DataFrame):
+            agg = pds.DataFrame(agg, index=data.index, columns=self.node_ids)
+
+        return agg
+
+    def save(self, path):
+        """
+        Save matrix to a .npz file
+
+        Parameters
+        ----------
+        path : 'str'
+            Path to .npz file
+        """
+        node_ids = self.node_ids
+        if node_ids.dtype == object:
+            # Save string ids without pickling
+            node_ids = node_ids.astype(str)
+
+        np.savez(path, data=self.weights.data, indices=self.weights.indices,
+                 indptr=self.weights.indptr, shape=self.weights.shape,
+                 node_ids=node_ids, site_ids=self.site_ids)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load matrix saved by save
+
+        Parameters
+        ----------
+        path : 'str'
+            Path to .npz file
+
+        Returns
+        ---------
+        'AllocationMatrix'
+            Saved matrix
+        """
+        with np.load(path, allow_pickle=False) as arrays:
+            weights = sparse.csr_matrix((arrays['data'], arrays['indices'],
+                                         arrays['indptr']),
+                                        shape=tuple(arrays['shape']))
+            return cls(weights, arrays['node_ids'], arrays['site_ids'])
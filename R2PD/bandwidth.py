@@ -0,0 +1,167 @@
+"""
+This module provides a thread-safe token-bucket limiter used to cap the
+bandwidth of all downloads in a process.
+"""
+import asyncio
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket refilled at rate bytes/sec up to burst bytes.
+    Consumers may overdraw the bucket, i.e. a chunk larger than burst, and
+    then wait until it has been repaid, so the long run rate never exceeds
+    rate.
+    """
+    _global = None
+    _global_lock = threading.Lock()
+
+    def __init__(self, rate, burst=None):
+        """
+        Initialize TokenBucket
+
+        Parameters
+        ----------
+        rate : 'float'
+            Bandwidth budget in bytes/sec
+        burst : 'float'
+            Maximum number of bytes that can be consumed without waiting,
+            default is one second of rate
+        """
+        self._lock = threading.Lock()
+        self.configure(rate, burst=burst)
+        self._tokens = self._burst
+        self._last = time.monotonic()
+
+    def __repr__(self):
+        """
+        Print the type of bucket, its rate and burst
+
+        Returns
+        ---------
+        'str'
+            type of bucket, rate and burst
+        """
+        return '{n} at {r:.0f} bytes/sec (burst {b:.0f})'.format(
+            n=self.__class__.__name__, r=self._rate, b=self._burst)
+
+    @classmethod
+    def shared(cls, rate=None, burst=None):
+        """
+        Get the process-wide bucket shared by all downloads, creating it
+        with rate and burst. An existing bucket keeps its rate and burst,
+        conflicting values are logged and ignored; call configure on the
+        shared bucket to change them.
+
+        Parameters
+        ----------
+        rate : 'float'
+            Bandwidth budget in bytes/sec of a new bucket, None to only get
+            an existing bucket
+        burst : 'float'
+            Maximum number of bytes that can be consumed without waiting,
+            default is one second of rate
+
+        Returns
+        ---------
+        'TokenBucket'
+            Global TokenBucket, None if there is none and rate is None
+        """
+        with cls._global_lock:
+            if cls._global is None:
+                if rate is not None:
+                    cls._global = cls(rate, burst=burst)
+            elif rate is not None:
+                if burst is None:
+                    burst = rate
+
+                bucket = cls._global
+                with bucket._lock:
+                    current = (bucket._rate, bucket._burst)
+
+                if current != (float(rate), float(burst)):
+                    logger.warning('Ignoring bandwidth of {r:.0f} bytes/sec '
+                                   '(burst {b:.0f}), downloads are already '
+                                   'limited by {c}'
+                                   .format(r=rate, b=burst, c=bucket))
+
+            return cls._global
+
+    def configure(self, rate, burst=None):
+        """
+        Change the rate and burst of the bucket
+
+        Parameters
+        ----------
+        rate : 'float'
+            Bandwidth budget in bytes/sec
+        burst : 'float'
+            Maximum number of bytes that can be consumed without waiting,
+            default is one second of rate
+        """
+        if rate <= 0:
+            raise ValueError('Bandwidth must be positive, not {}'
+                             .format(rate))
+
+        if burst is None:
+            burst = rate
+
+        with self._lock:
+            self._rate = float(rate)
+            self._burst = float(burst)
+
+    def reserve(self, size):
+        """
+        Take size tokens from the bucket
+
+        Parameters
+        ----------
+        size : 'int'
+            Number of bytes to be consumed
+
+        Returns
+        ---------
+        'float'
+            Seconds the caller must wait before consuming the bytes
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._burst,
+                               self._tokens + (now - self._last) * self._rate)
+            self._last = now
+            self._tokens -= size
+            if self._tokens >= 0:
+                return 0
+
+            return -self._tokens / self._rate
+
+    def consume(self, size):
+        """
+        Block until size bytes can be consumed
+
+        Parameters
+        ----------
+        size : 'int'
+            Number of bytes to be consumed
+        """
+        wait = self.reserve(size)
+        if wait:
+            time.sleep(wait)
+
+    async def consume_async(self, size):
+        """
+        Wait without blocking the event loop until size bytes can be
+        consumed
+
+        Parameters
+        ----------
+        size : 'int'
+            Number of bytes to be consumed
+        """
+        wait = self.reserve(size)
+        if wait:
+            await asyncio.sleep(wait)
@@ -0,0 +1,559 @@
+"""
+This module provides a persistent SQLite index of the files in the local
+cache, so that the cache does not need to be scanned to find out what it
+contains.
+"""
+import logging
+import sqlite3
+import threading
+import time
+
+import pandas as pds
+
+logger = logging.getLogger(__name__)
+
+
+class CacheIndex(object):
+    """
+    Transactional index of cached resource files recording the site,
+    resource type, path, size, modification time and access history of
+    each file, the size and modification time it had when it was last
+    validated, and of the files pinned against eviction. The index is shared
+    by all threads and processes using the same cache.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS files (
+            dataset TEXT NOT NULL,
+            resource_type TEXT NOT NULL,
+            site_id INTEGER NOT NULL,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime REAL NOT NULL,
+            last_access REAL,
+            access_count INTEGER NOT NULL DEFAULT 0,
+            valid_size INTEGER,
+            valid_mtime REAL,
+            PRIMARY KEY (dataset, resource_type, site_id)
+        )"""
+    # Columns added to the files table since it was created, with their
+    # types, added to older databases when they are opened
+    ADDED_COLUMNS = {'valid_size': 'INTEGER', 'valid_mtime': 'REAL'}
+    # Files pinned in the cache, which may not have been downloaded yet
+    PINS_SCHEMA = """
+        CREATE TABLE IF NOT EXISTS pins (
+            dataset TEXT NOT NULL,
+            resource_type TEXT NOT NULL,
+            site_id INTEGER NOT NULL,
+            pinned_at REAL NOT NULL,
+            PRIMARY KEY (dataset, resource_type, site_id)
+        )"""
+    # Number of changes to the files in the index, which access times and
+    # validations do not count as
+    VERSION_SCHEMA = """
+        CREATE TABLE IF NOT EXISTS version (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            changes INTEGER NOT NULL
+        )"""
+    COLUMNS = ['dataset', 'resource_type', 'site_id', 'path', 'size',
+               'mtime', 'last_access', 'access_count', 'valid_size',
+               'valid_mtime']
+    # Seconds to wait for a lock held by another process
+    TIMEOUT = 60
+    # Order in which files are evicted by each eviction policy, files that
+    # have never been accessed are treated as accessed when written
+    EVICTION_ORDER = {
+        'lru': 'COALESCE(last_access, mtime)',
+        'lfu': 'access_count, COALESCE(last_access, mtime)'}
+
+    def __init__(self, db_path):
+        """
+        Initialize CacheIndex, creating the database if needed
+
+        Parameters
+        ----------
+        db_path : 'str'
+            Path to SQLite database
+        """
+        self._path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=self.TIMEOUT,
+                                     check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(self.SCHEMA)
+            self._conn.execute(self.PINS_SCHEMA)
+            self._conn.execute(self.VERSION_SCHEMA)
+            self._conn.execute('INSERT OR IGNORE INTO version VALUES (0, 0)')
+            existing = {row[1] for row in
+                        self._conn.execute('PRAGMA table_info(files)')}
+            for column, dtype in self.ADDED_COLUMNS.items():
+                if column not in existing:
+                    self._conn.execute('ALTER TABLE files ADD COLUMN {} {}'
+                                       .format(column, dtype))
+
+    def __repr__(self):
+        """
+        Print the type of index and its database
+
+        Returns
+        ---------
+        'str'
+            type of index and path to database
+        """
+        return '{n} at {p}'.format(n=self.__class__.__name__, p=self._path)
+
+    def __len__(self):
+        """
+        Return number of files in index
+
+        Returns
+        ---------
+        'int'
+            Number of indexed files
+        """
+        return self._query('SELECT COUNT(*) FROM files')[0][0]
+
+    def _query(self, sql, params=()):
+        """
+        Run a read-only query
+
+        Parameters
+        ----------
+        sql : 'str'
+            SQL query
+        params : 'tuple'
+            Query parameters
+
+        Returns
+        ---------
+        'list'
+            Rows returned by query
+        """
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _execute(self, sql, params=(), many=False, versioned=False):
+        """
+        Run a statement in its own transaction
+
+        Parameters
+        ----------
+        sql : 'str'
+            SQL statement
+        params : 'tuple'|'list'
+            Statement parameters, or list of parameters if many
+        many : 'bool'
+            Run statement for each set of parameters
+        versioned : 'bool'
+            Whether the statement changes which files are indexed or their
+            size or modification time, bumping version if it modifies any
+            rows
+
+        Returns
+        ---------
+        'int'
+            Number of rows modified
+        """
+        with self._lock, self._conn:
+            if many:
+                cursor = self._conn.executemany(sql, params)
+            else:
+                cursor = self._conn.execute(sql, params)
+
+            rowcount = cursor.rowcount
+            if versioned and rowcount:
+                self._conn.execute('UPDATE version SET changes = changes + 1')
+
+        return rowcount
+
+    @property
+    def version(self):
+        """
+        Version of the indexed files, which changes whenever files are
+        added, updated or removed by any connection but not when they are
+        accessed, pinned or validated
+
+        Returns
+        ---------
+        'int'
+            Number of changes to the indexed files
+        """
+        return self._query('SELECT changes FROM version')[0][0]
+
+    @property
+    def scanned(self):
+        """
+        Whether the cache directories have been scanned into the index
+
+        Returns
+        ---------
+        'bool'
+            True once replace has been called for a dataset
+        """
+        return bool(self._query('PRAGMA user_version')[0][0])
+
+    def add(self, dataset, resource_type, site_id, path, size, mtime):
+        """
+        Add or update a file, keeping its access history
+
+        Parameters
+        ----------
+        dataset : 'str'
+            'wind' or 'solar'
+        resource_type : 'str'
+            power or met or fcst
+        site_id : 'int'
+            Site id number
+        path : 'str'
+            Path to file
+        size : 'int'
+            Size of file in bytes
+        mtime : 'float'
+            Modification time of file
+        """
+        self.add_many([(dataset, resource_type, site_id, path, size, mtime)])
+
+    def add_many(self, files):
+        """
+        Add or update files in a single transaction, keeping their access
+        history
+
+        Parameters
+        ----------
+        files : 'list'
+            List of (dataset, resource_type, site_id, path, size, mtime)
+        """
+        sql = ('INSERT INTO files (dataset, resource_type, site_id, path, '
+               'size, mtime) VALUES (?, ?, ?, ?, ?, ?) '
+               'ON CONFLICT (dataset, resource_type, site_id) DO UPDATE SET '
+               'path = excluded.path, size = excluded.size, '
+               'mtime = excluded.mtime')
+        self._execute(sql, [tuple(f) for f in files], many=True,
+                      versioned=True)
+
+    def remove(self, dataset, resource_type, site_id):
+        """
+        Remove a file
+
+        Parameters
+        ----------
+        dataset : 'str'
+            'wind' or 'solar'
+        resource_type : 'str'
+            power or met or fcst
+        site_id : 'int'
+            Site id number
+        """
+        sql = ('DELETE FROM files WHERE dataset = ? AND resource_type = ? '
+               'AND site_id = ?')
+        self._execute(sql, (dataset, resource_type, int(site_id)),
+                      versioned=True)
+
+    def replace(self, dataset, files):
+        """
+        Replace all files of dataset in a single transaction, keeping the
+        access history and validation of files that remain
+
+        Parameters
+        ----------
+        dataset : 'str'
+            'wind' or 'solar'
+        files : 'list'
+            List of (dataset, resource_type, site_id, path, size, mtime)
+        """
+        with self._lock, self._conn:
+            history = {row[:2]: row[2:] for row in self._conn.execute(
+                'SELECT resource_type, site_id, last_access, access_count, '
+                'valid_size, valid_mtime FROM files WHERE dataset = ?',
+                (dataset, ))}
+            self._conn.execute('DELETE FROM files WHERE dataset = ?',
+                               (dataset, ))
+            rows = [tuple(f) + history.get((f[1], f[2]),
+                                           (None, 0, None, None))
+                    for f in files]
+            self._conn.executemany(
+                'INSERT INTO files ({}) VALUES ({})'
+                .format(', '.join(self.COLUMNS),
+                        ', '.join('?' * len(self.COLUMNS))), rows)
+            self._conn.execute('PRAGMA user_version = 1')
+            self._conn.execute('UPDATE version SET changes = changes + 1')
+
+    def get(self, dataset, resource_type, site_id):
+        """
+        Look up a file
+
+        Parameters
+        ----------
+        dataset : 'str'
+            'wind' or 'solar'
+        resource_type : 'str'
+            power or met or fcst
+        site_id : 'int'
+            Site id number
+
+        Returns
+        ---------
+        'dict'
+            Indexed columns of file, None if it is not in the index
+        """
+        rows = self._query('SELECT * FROM files WHERE dataset = ? AND '
+                           'resource_type = ? AND site_id = ?',
+                           (dataset, resource_type, int(site_id)))
+        if not rows:
+            return None
+
+        return dict(zip(self.COLUMNS, rows[0]))
+
+    def contains(self, dataset, site_id, resource_type=None):
+        """
+        Check whether a site has any file, or a file of resource_type
+
+        Parameters
+        ----------
+        dataset : 'str'
+            'wind' or 'solar'
+        site_id : 'int'
+            Site id number
+        resource_type : 'str'
+            power or met or fcst, None for any resource type
+
+        Returns
+        ---------
+        'bool'
+            True if file is in index
+        """
+        if resource_type is not None:
+            return self.get(dataset, resource_type, site_id) is not None
+
+        rows = self._query('SELECT 1 FROM files WHERE dataset = ? AND '
+                           'site_id = ? LIMIT 1', (dataset, int(site_id)))
+        return bool(rows)
+
+    def touch(self, dataset, resource_type, site_ids, when=None):
+        """
+        Record an access of files
+
+        Parameters
+        ----------
+        dataset : 'str'
+            'wind' or 'solar'
+        resource_type : 'str'
+            power or met or fcst
+        site_ids : 'list'
+            Site id numbers of accessed files
+        when : 'float'
+            Time of access, default is now
+        """
+        if when is None:
+            when = time.time()
+
+        sql = ('UPDATE files SET last_access = ?, '
+               'access_count = access_count + 1 WHERE dataset = ? AND '
+               'resource_type = ? AND site_id = ?')
+        self._execute(sql, [(when, dataset, resource_type, int(site_id))
+                            for site_id in site_ids], many=True)
+
+    def set_valid(self, dataset, resource_type, site_id, size, mtime):
+        """
+        Record that a file was validated, so that it is not validated again
+        by any process until it changes
+
+        Parameters
+        ----------
+        dataset : 'str'
+            'wind' or 'solar'
+        resource_type : 'str'
+            power or met or fcst
+        site_id : 'int'
+            Site id number
+        size : 'int'
+            Size of file in bytes when it was validated
+        mtime : 'float'
+            Modification time of file when it was validated
+        """
+        sql = ('UPDATE files SET valid_size = ?, valid_mtime = ? WHERE '
+               'dataset = ? AND resource_type = ? AND site_id = ?')
+        self._execute(sql, (int(size), mtime, dataset, resource_type,
+                            int(site_id)))
+
+    def total_size(self, dataset=None):
+        """
+        Total size of indexed files
+
+        Parameters
+        ----------
+        dataset : 'str'
+            'wind' or 'solar', None for all files
+
+        Returns
+        ---------
+        'int'
+            Total bytes
+        """
+        if dataset is None:
+            rows = self._query('SELECT SUM(size) FROM files')
+        else:
+            rows = self._query('SELECT SUM(size) FROM files WHERE '
+                               'dataset = ?', (dataset, ))
+
+        return rows[0][0] or 0
+
+    def summary(self):
+        """
+        Number and total size of indexed files of each dataset and resource
+        type
+
+        Returns
+        ---------
+        'pandas.DataFrame'
+            Table of [dataset, resource_type](index), files, bytes
+        """
+        rows = self._query('SELECT dataset, resource_type, COUNT(*), '
+                           'SUM(size) FROM files GROUP BY dataset, '
+                           'resource_type')
+        summary = pds.DataFrame(rows, columns=['dataset', 'resource_type',
+                                               'files', 'bytes'])
+
+        return summary.set_index(['dataset', 'resource_type'])
+
+    def eviction_candidates(self, policy='lru'):
+        """
+        Indexed files that are not pinned, in the order they should be
+        evicted
+
+        Parameters
+        ----------
+        policy : 'str'
+            'lru' to evict the least recently used files first, 'lfu' to
+            evict the least frequently used files first
+
+        Returns
+        ---------
+        'list'
+            List of (dataset, resource_type, site_id, path, size)
+        """
+        try:
+            order = self.EVICTION_ORDER[policy]
+        except KeyError:
+            raise ValueError('Invalid eviction policy {}, must be one of {}'
+                             .format(policy, list(self.EVICTION_ORDER)))
+
+        return self._query('SELECT dataset, resource_type, site_id, path, '
+                           'size FROM files WHERE NOT EXISTS (SELECT 1 FROM '
+                           'pins WHERE pins.dataset = files.dataset AND '
+                           'pins.resource_type = files.resource_type AND '
+                           'pins.site_id = files.site_id) ORDER BY {}'
+                           .format(order))
+
+    def pin(self, dataset, resource_type, site_ids, when=None):
+        """
+        Pin files against eviction, whether or not they are cached yet
+
+        Parameters
+        ----------
+        dataset : 'str'
+            'wind' or 'solar'
+        resource_type : 'str'
+            power or met or fcst
+        site_ids : 'list'
+            Site id numbers of files to pin
+        when : 'float'
+            Time of pinning, default is now
+        """
+        if when is None:
+            when = time.time()
+
+        sql = 'INSERT OR REPLACE INTO pins VALUES (?, ?, ?, ?)'
+        self._execute(sql, [(dataset, resource_type, int(site_id), when)
+                            for site_id in site_ids], many=True)
+
+    def unpin(self, dataset=None, resource_type=None, site_ids=None):
+        """
+        Remove pins
+
+        Parameters
+        ----------
+        dataset : 'str'
+            'wind' or 'solar', None for all datasets
+        resource_type : 'str'
+            power or met or fcst, None for all resource types
+        site_ids : 'list'
+            Site id numbers to unpin, None for all sites
+
+        Returns
+        ---------
+        'int'
+            Number of pins removed
+        """
+        conditions = []
+        params = []
+        for column, value in (('dataset', dataset),
+                              ('resource_type', resource_type)):
+            if value is not None:
+                conditions.append('{} = ?'.format(column))
+                params.append(value)
+
+        if site_ids is not None:
+            conditions.append('site_id = ?')
+
+        sql = 'DELETE FROM pins'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+
+        if site_ids is None:
+            return self._execute(sql, tuple(params))
+
+        return self._execute(sql, [tuple(params) + (int(site_id), )
+                                   for site_id in site_ids], many=True)
+
+    def pins(self, dataset=None):
+        """
+        Table of pinned files
+
+        Parameters
+        ----------
+        dataset : 'str'
+            'wind' or 'solar', None for all files
+
+        Returns
+        ---------
+        'pandas.DataFrame'
+            Table of [dataset, resource_type, site_id, pinned_at]
+        """
+        if dataset is None:
+            rows = self._query('SELECT * FROM pins')
+        else:
+            rows = self._query('SELECT * FROM pins WHERE dataset = ?',
+                               (dataset, ))
+
+        return pds.DataFrame(rows, columns=['dataset', 'resource_type',
+                                            'site_id', 'pinned_at'])
+
+    def entries(self, dataset=None):
+        """
+        Table of indexed files
+
+        Parameters
+        ----------
+        dataset : 'str'
+            'wind' or 'solar', None for all files
+
+        Returns
+        ---------
+        'pandas.DataFrame'
+            Table of [dataset, resource_type, site_id, path, size, mtime,
+            last_access, access_count, valid_size, valid_mtime]
+        """
+        if dataset is None:
+            rows = self._query('SELECT * FROM files')
+        else:
+            rows = self._query('SELECT * FROM files WHERE dataset = ?',
+                               (dataset, ))
+
+        return pds.DataFrame(rows, columns=self.COLUMNS)
+
+    def close(self):
+        """
+        Close the database connection
+        """
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,275 @@
+"""
+This module defines the directory layout of resource files within a cache
+root. Flat caches keep all files of a dataset in one directory, sharded
+caches spread them over subdirectories keyed by site_id so that no
+directory holds more than shard_size files. The layout of a cache is
+recorded in its root so that every reader resolves paths the same way.
+"""
+import json
+import logging
+import os
+
+from R2PD.ingest import get_sidecar_path
+
+logger = logging.getLogger(__name__)
+
+
+class CacheLayout(object):
+    """
+    Maps resource files to paths within a cache root:
+    '{root}/{dataset}/{file}' when flat and
+    '{root}/{dataset}/{site_id // shard_size:04d}/{file}' when sharded.
+    Consecutive site ids share a shard, so nearby sites requested together
+    land in few directories.
+    """
+    LAYOUT_FILE = 'cache_layout.json'
+    DATASETS = ('wind', 'solar')
+
+    def __init__(self, shard_size=None):
+        """
+        Initialize CacheLayout
+
+        Parameters
+        ----------
+        shard_size : 'int'
+            Number of consecutive site ids per subdirectory, None for a flat
+            layout
+        """
+        if shard_size is not None:
+            shard_size = int(shard_size)
+            if shard_size < 1:
+                raise ValueError('shard_size must be at least 1, not {}'
+                                 .format(shard_size))
+
+        self.shard_size = shard_size
+
+    def __repr__(self):
+        """
+        Print the type of layout and its shard size
+
+        Returns
+        ---------
+        'str'
+            type of layout and shard size
+        """
+        if self.shard_size is None:
+            return '{} flat'.format(self.__class__.__name__)
+
+        return '{n} sharded by {s} sites'.format(n=self.__class__.__name__,
+                                                 s=self.shard_size)
+
+    def __eq__(self, other):
+        return (isinstance(other, CacheLayout)
+                and self.shard_size == other.shard_size)
+
+    def __ne__(self, other):
+        return not self == other
+
+    @property
+    def sharded(self):
+        """
+        Whether files are spread over subdirectories
+
+        Returns
+        ---------
+        'bool'
+            True if shard_size is set
+        """
+        return self.shard_size is not None
+
+    @classmethod
+    def load(cls, cache_root, default=None):
+        """
+        Load the layout recorded in cache_root
+
+        Parameters
+        ----------
+        cache_root : 'str'
+            Root directory of cache
+        default : 'CacheLayout'
+            Layout of caches without a layout file, default is flat as used
+            by caches created before sharding was introduced
+
+        Returns
+        ---------
+        'CacheLayout'
+            Layout of cache
+        """
+        layout_path = os.path.join(cache_root, cls.LAYOUT_FILE)
+        if not os.path.exists(layout_path):
+            return default if default is not None else cls()
+
+        with open(layout_path) as f:
+            layout = json.load(f)
+
+        return cls(shard_size=layout.get('shard_size'))
+
+    def save(self, cache_root):
+        """
+        Record layout in cache_root
+
+        Parameters
+        ----------
+        cache_root : 'str'
+            Root directory of cache
+        """
+        layout_path = os.path.join(cache_root, self.LAYOUT_FILE)
+        tmp_path = '{}.{}.tmp'.format(layout_path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump({'shard_size': self.shard_size}, f)
+
+        os.replace(tmp_path, layout_path)
+
+    @staticmethod
+    def get_file_name(dataset, resource_type, site_id):
+        """
+        Name of resource file
+
+        Parameters
+        ----------
+        dataset : 'str'
+            'wind' or 'solar'
+        resource_type : 'str'
+            power or met or fcst
+        site_id : 'int'
+            Site id number
+
+        Returns
+        ---------
+        'str'
+            '{dataset}_{resource_type}_{site_id}.hdf5'
+        """
+        return '{}_{}_{}.hdf5'.format(dataset, resource_type, site_id)
+
+    def get_dir(self, cache_root, dataset, site_id):
+        """
+        Directory holding the files of a site
+
+        Parameters
+        ----------
+        cache_root : 'str'
+            Root directory of cache
+        dataset : 'str'
+            'wind' or 'solar'
+        site_id : 'int'
+            Site id number
+
+        Returns
+        ---------
+        'str'
+            Path to dataset directory, or its shard for site_id
+        """
+        dataset_dir = os.path.join(cache_root, dataset)
+        if self.shard_size is None:
+            return dataset_dir
+
+        shard = '{:04d}'.format(int(site_id) // self.shard_size)
+        return os.path.join(dataset_dir, shard)
+
+    def get_path(self, cache_root, dataset, resource_type, site_id):
+        """
+        Path of resource file
+
+        Parameters
+        ----------
+        cache_root : 'str'
+            Root directory of cache
+        dataset : 'str'
+            'wind' or 'solar'
+        resource_type : 'str'
+            power or met or fcst
+        site_id : 'int'
+            Site id number
+
+        Returns
+        ---------
+        'str'
+            Path to resource file
+        """
+        return os.path.join(self.get_dir(cache_root, dataset, site_id),
+                            self.get_file_name(dataset, resource_type,
+                                               site_id))
+
+    @staticmethod
+    def iter_files(dataset_dir):
+        """
+        Iterate over the .hdf5 files of a dataset directory and its shards,
+        whatever layout they are in
+
+        Parameters
+        ----------
+        dataset_dir : 'str'
+            Dataset directory of cache, i.e. '{root}/wind'
+
+        Yields
+        ------
+        'os.DirEntry'
+            Entry of each .hdf5 file
+        """
+        if not os.path.exists(dataset_dir):
+            return
+
+        for entry in os.scandir(dataset_dir):
+            if entry.is_dir():
+                for sub_entry in os.scandir(entry.path):
+                    if (sub_entry.name.endswith('.hdf5')
+                            and sub_entry.is_file()):
+                        yield sub_entry
+            elif entry.name.endswith('.hdf5') and entry.is_file():
+                yield entry
+
+    def migrate(self, cache_root, parse_file_name):
+        """
+        Move the files of a cache into this layout in place and record it.
+        Files are moved with atomic renames and the layout is recorded last,
+        so an interrupted migration can simply be run again. The cache must
+        not be in use while it is migrated.
+
+        Parameters
+        ----------
+        cache_root : 'str'
+            Root directory of cache
+        parse_file_name : 'callable'
+            Function returning (dataset, resource_type, site_id) from a
+            file name, raising ValueError for unrecognized files
+
+        Returns
+        ---------
+        moved : 'int'
+            Number of files moved
+        """
+        moved = 0
+        for dataset in self.DATASETS:
+            dataset_dir = os.path.join(cache_root, dataset)
+            for entry in list(self.iter_files(dataset_dir)):
+                try:
+                    file_dataset, resource_type, site_id = \
+                        parse_file_name(entry.name)
+                except ValueError:
+                    logger.warning('Skipping unrecognized file {}'
+                                   .format(entry.path))
+                    continue
+
+                dst = self.get_path(cache_root, file_dataset, resource_type,
+                                    site_id)
+                if dst == entry.path:
+                    continue
+
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                os.replace(entry.path, dst)
+                sidecar_path = get_sidecar_path(entry.path)
+                if os.path.exists(sidecar_path):
+                    os.replace(sidecar_path, get_sidecar_path(dst))
+
+                moved += 1
+
+            # Remove shards left empty by the move
+            if os.path.exists(dataset_dir):
+                for entry in os.scandir(dataset_dir):
+                    if entry.is_dir() and not os.listdir(entry.path):
+                        os.rmdir(entry.path)
+
+        self.save(cache_root)
+        logger.info('Moved {} files into {}'.format(moved, self))
+
+        return moved
@@ -0,0 +1,249 @@
+"""
+This module provides locks used to coordinate downloads into a shared local
+cache between threads and processes, so that each resource file is only
+fetched once.
+"""
+import errno
+import logging
+import os
+import threading
+import time
+import weakref
+
+from filelock import FileLock, Timeout
+
+try:
+    import fcntl
+except ImportError:
+    # Windows, where FileLock removes its lock files itself
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class _ThreadLock(object):
+    """
+    threading.Lock that can be weakly referenced
+    """
+    def __init__(self):
+        """
+        Initialize _ThreadLock
+        """
+        self._lock = threading.Lock()
+
+    def acquire(self, blocking=True):
+        """
+        Acquire lock
+
+        Parameters
+        ----------
+        blocking : 'bool'
+            Whether to wait for the lock
+
+        Returns
+        ---------
+        'bool'
+            True if lock was acquired
+        """
+        return self._lock.acquire(blocking)
+
+    def release(self):
+        """
+        Release lock
+        """
+        self._lock.release()
+
+
+class CacheLock(object):
+    """
+    Lock on a single cache file held by at most one thread in one process.
+    Threads in the same process are coordinated with a threading.Lock,
+    shared by the CacheLocks on the same file while any exist, and
+    processes with an exclusive lock on '{lock_root}/{file_name}.lock'.
+    The lock file is removed on release, so that lock files do not
+    accumulate with the files they locked.
+    """
+    POLL_INTERVAL = 0.1
+    _thread_locks = weakref.WeakValueDictionary()
+    _registry_lock = threading.Lock()
+
+    def __init__(self, lock_root, file_name):
+        """
+        Initialize CacheLock
+
+        Parameters
+        ----------
+        lock_root : 'str'
+            Directory in which lock files are created
+        file_name : 'str'
+            Name of cache file to be locked
+        """
+        self._path = os.path.join(lock_root, file_name + '.lock')
+        with self._registry_lock:
+            self._thread_lock = self._thread_locks.get(self._path)
+            if self._thread_lock is None:
+                self._thread_lock = _ThreadLock()
+                self._thread_locks[self._path] = self._thread_lock
+
+        self._file_lock = None
+
+    def __repr__(self):
+        """
+        Print the type of lock and its lock file
+
+        Returns
+        ---------
+        'str'
+            type of lock and path to lock file
+        """
+        return '{n} on {p}'.format(n=self.__class__.__name__, p=self._path)
+
+    def __enter__(self):
+        """
+        Enter method to allow use of with
+        """
+        self.acquire()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        """
+        Release lock on exit from with
+        """
+        self.release()
+
+    @property
+    def locked(self):
+        """
+        Whether this lock is held
+
+        Returns
+        ---------
+        'bool'
+            True if lock has been acquired by this object
+        """
+        return self._file_lock is not None
+
+    def _lock_file(self):
+        """
+        Lock the lock file without blocking, creating it if needed. A lock
+        obtained on a lock file that its holder removed on release does not
+        count, and the new lock file is locked instead.
+
+        Returns
+        ---------
+        'int'|'FileLock'
+            Descriptor of the locked lock file, or FileLock where fcntl is
+            not available, None if the lock is held by another process
+        """
+        if fcntl is None:
+            file_lock = FileLock(self._path)
+            try:
+                file_lock.acquire(timeout=0)
+            except Timeout:
+                return None
+
+            return file_lock
+
+        while True:
+            fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError as ex:
+                os.close(fd)
+                if ex.errno in (errno.EAGAIN, errno.EWOULDBLOCK,
+                                errno.EACCES):
+                    return None
+
+                raise
+
+            try:
+                current = os.stat(self._path)
+            except FileNotFoundError:
+                current = None
+
+            locked = os.fstat(fd)
+            if (current is not None and current.st_dev == locked.st_dev
+                    and current.st_ino == locked.st_ino):
+                return fd
+
+            os.close(fd)
+
+    def _unlock_file(self, file_lock):
+        """
+        Remove and unlock the lock file
+
+        Parameters
+        ----------
+        file_lock : 'int'|'FileLock'
+            Descriptor of the locked lock file, or FileLock
+        """
+        if fcntl is None:
+            file_lock.release()
+            return
+
+        # Removed while still locked, processes waiting on it notice the
+        # lock file is gone once they acquire it
+        try:
+            os.remove(self._path)
+        except FileNotFoundError:
+            pass
+
+        os.close(file_lock)
+
+    def try_acquire(self):
+        """
+        Attempt to acquire lock without blocking
+
+        Returns
+        ---------
+        'bool'
+            True if lock was acquired
+        """
+        if not self._thread_lock.acquire(blocking=False):
+            return False
+
+        try:
+            file_lock = self._lock_file()
+        except Exception:
+            self._thread_lock.release()
+            raise
+
+        if file_lock is None:
+            self._thread_lock.release()
+            return False
+
+        self._file_lock = file_lock
+
+        return True
+
+    def acquire(self, timeout=None):
+        """
+        Acquire lock, polling until it is available
+
+        Parameters
+        ----------
+        timeout : 'float'
+            Seconds to wait for lock, None to wait indefinitely
+
+        Returns
+        ---------
+        'bool'
+            True if lock was acquired before timeout
+        """
+        start = time.monotonic()
+        while not self.try_acquire():
+            if timeout is not None and time.monotonic() - start > timeout:
+                return False
+
+            time.sleep(self.POLL_INTERVAL)
+
+        return True
+
+    def release(self):
+        """
+        Release lock
+        """
+        if self._file_lock is not None:
+            self._unlock_file(self._file_lock)
+            self._file_lock = None
+            self._thread_lock.release()
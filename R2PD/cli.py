@@ -7,7 +7,7 @@ import logging
 import os
 import pandas as pds
 
-from R2PD.datastore import DRPower
+from R2PD.datastore import DRPower, InternalDataStore
 from R2PD.powerdata import (NodeCollection, WindGeneratorNode,
                             SolarGeneratorNode, WindMetNode, SolarMetNode)
 from R2PD.tshelpers import TemporalParameters, ForecastParameters
@@ -231,5 +231,171 @@ def forecast(ctx, forecast_type, leadtimes, leadtime, frequency, lookahead,
     nodes.save_forecasts(ctx.obj['out_dir'], formatter=ctx.obj['formatter'])
 
 
+@click.group()
+@click.option('-ds', '--ds_config', default=None,
+              type=click.Path(exists=True),
+              help='Path to datastore configuration file.')
+@click.option('-d', '--debug', is_flag=True, default=False)
+@click.pass_context
+def cache(ctx, ds_config, debug):
+    """
+    Manage the local cache of resource data.
+    """
+    level = logging.DEBUG if debug else logging.WARNING
+    logging.basicConfig(level=level)
+
+    ctx.obj = {'ds_config': ds_config,
+               'cache': InternalDataStore.connect(config=ds_config)}
+
+
+@cache.command()
+@click.option('-s', '--shard_size', default=None, type=int,
+              help="""Number of consecutive site ids per subdirectory.
+              Default is a flat layout with all files of a dataset in
+              one directory.""")
+@click.pass_context
+def migrate(ctx, shard_size):
+    """
+    Move cached files into a new directory layout in place. The cache must
+    not be in use while it is migrated, an interrupted migration can be
+    run again.
+    """
+    local_cache = ctx.obj['cache']
+    moved = local_cache.migrate(shard_size=shard_size)
+    click.echo("Moved {n} files, local cache is {l}"
+               .format(n=moved, l=local_cache.layout))
+
+
+@cache.command()
+@click.option('-t', '--dataset', required=True,
+              type=click.Choice(['solar', 'wind']),
+              help="Dataset, 'solar' or 'wind'")
+@click.option('-r', '--resource_type', default='power',
+              type=click.Choice(['power', 'met', 'fcst', 'fcst-prob']),
+              help="Resource type to consolidate")
+@click.option('-s', '--sites', default=None, type=click.Path(exists=True),
+              help="""Path to csv file with a site_id column of the sites
+              to consolidate. Default is all cached sites.""")
+@click.pass_context
+def consolidate(ctx, dataset, resource_type, sites):
+    """
+    Pack cached files into a single time by site store, read instead of
+    the per-site files when all sites of a node are in it.
+    """
+    site_ids = None
+    if sites:
+        site_ids = pds.read_csv(sites)['site_id'].values
+
+    store = ctx.obj['cache'].consolidate(dataset, resource_type,
+                                         site_ids=site_ids)
+    click.echo("Consolidated {}".format(store))
+
+
+@cache.command()
+@click.option('-ns', '--nodes', required=True, type=click.Path(exists=True),
+              help="""Path to csv file describing nodes, each row
+              of the csv file should contain (node_id, latitude,
+              longitude) and optionally capacity in MW.""")
+@click.option('-t', '--resource_type', required=True,
+              type=click.Choice(['solar', 'wind']),
+              help="Resource type, 'solar' or 'wind'")
+@click.option('-c', '--capacity', default=None, type=float,
+              help="Capacity of generator(s) on each node in MW")
+@click.option('-w', '--weather', is_flag=True, default=False,
+              help="Fetch weather data instead of power data")
+@click.option('-f', '--forecasts', is_flag=True, default=False,
+              help="Fetch forecasts instead of power data")
+@click.option('--pin/--no-pin', default=True,
+              help="Pin fetched files until 'R2PD-cache unpin'")
+@click.option('-to', '--timeout', default=None, type=float,
+              help="Seconds allowed for all downloads")
+@click.pass_context
+def warm_up(ctx, nodes, resource_type, capacity, weather, forecasts, pin,
+            timeout):
+    """
+    Download everything a set of nodes needs into the local cache without
+    shaping any data, and pin it so it is not evicted mid-batch.
+    """
+    nodes_df = pds.read_csv(nodes)
+    if weather:
+        NodeClass = WindMetNode if resource_type == 'wind' else SolarMetNode
+        nodes_df = nodes_df[['node_id', 'latitude', 'longitude']]
+    else:
+        NodeClass = (WindGeneratorNode if resource_type == 'wind'
+                     else SolarGeneratorNode)
+        if 'capacity' not in nodes_df:
+            nodes_df['capacity'] = capacity
+
+        nodes_df = nodes_df[['node_id', 'latitude', 'longitude', 'capacity']]
+
+    node_list = [NodeClass(*tuple(node_info))
+                 for _, node_info in nodes_df.iterrows()]
+    node_collection = NodeCollection.factory(node_list)
+
+    repo = DRPower.connect(config=ctx.obj['ds_config'])
+    summary = repo.warm_up(node_collection, forecasts=forecasts, pin=pin,
+                           timeout=timeout)
+    click.echo("{sites} {dataset} {resource_type} sites: {hits} cache hits, "
+               "{downloaded} downloaded ({gb:.2f} GB), {failed} failed "
+               "in {elapsed:.1f}s".format(gb=summary['bytes'] / 1e9,
+                                          **summary))
+    if summary['failed']:
+        summary['report'].raise_for_failures()
+
+
+@cache.command()
+@click.option('-t', '--resource_type', default=None,
+              type=click.Choice(['solar', 'wind']),
+              help="Resource type to unpin, default is all")
+@click.pass_context
+def unpin(ctx, resource_type):
+    """
+    Unpin files pinned by warm_up so they can be evicted again.
+    """
+    unpinned = ctx.obj['cache'].unpin_sites(dataset=resource_type)
+    click.echo("Unpinned {} files".format(unpinned))
+
+
+@cache.command()
+@click.option('-p', '--processes', default=None, type=int,
+              help="Worker processes, default is the number of CPUs")
+@click.option('--full', is_flag=True, default=False,
+              help="Read every chunk of each file, not just the first and "
+                   "last records")
+@click.option('-r', '--repair', default='none',
+              type=click.Choice(['none', 'quarantine', 'download']),
+              help="""Quarantine invalid files, or quarantine and download
+              them again""")
+@click.option('-o', '--out', default=None, type=click.Path(),
+              help="Path to write the csv report to")
+@click.pass_context
+def verify(ctx, processes, full, repair, out):
+    """
+    Check that every cached file is readable using parallel worker
+    processes, optionally repairing invalid files.
+    """
+    local_cache = ctx.obj['cache']
+    report = local_cache.verify(processes=processes, full=full)
+    invalid = report.loc[~report['valid']]
+    click.echo("Verified {} files, {} invalid".format(len(report),
+                                                      len(invalid)))
+    for row in invalid.itertuples():
+        click.echo("{}: {}".format(row.path, row.error))
+
+    if out:
+        report.to_csv(out, index=False)
+        click.echo("Report written to {}".format(out))
+
+    if repair == 'quarantine' and len(invalid):
+        local_cache.repair(report)
+        click.echo("Quarantined {} files".format(len(invalid)))
+    elif repair == 'download' and len(invalid):
+        repo = DRPower.connect(config=ctx.obj['ds_config'])
+        download_report = repo.repair_cache(report)
+        click.echo("Downloaded {} of {} invalid files again"
+                   .format(len(download_report.succeeded), len(invalid)))
+        download_report.raise_for_failures()
+
+
 if __name__ == '__main__':
     main()
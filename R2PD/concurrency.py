@@ -0,0 +1,233 @@
+"""
+This module provides an adaptive (AIMD) controller for the number of
+concurrent downloads and an asyncio gate that enforces it.
+"""
+import asyncio
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ConcurrencyController(object):
+    """
+    Adjusts the number of in-flight requests between min_limit and max_limit
+    based on the throughput, latency and error rate measured over windows of
+    completed requests. The limit is increased additively while throughput
+    holds up and decreased multiplicatively on errors, rising latency or a
+    drop in throughput. Requests can be recorded from any thread.
+    """
+    # Multiplicative decrease factor
+    DECREASE = 0.5
+    # Fractional drop in throughput tolerated before decreasing the limit
+    TOLERANCE = 0.1
+    # Multiple of the best observed latency treated as congestion
+    LATENCY_FACTOR = 2.0
+    # Minimum duration of a measurement window in seconds
+    WINDOW = 1.0
+    # Weight of the latest window in the smoothed throughput
+    SMOOTHING = 0.5
+
+    def __init__(self, min_limit=1, max_limit=None, initial=None,
+                 max_error_rate=0.1):
+        """
+        Initialize ConcurrencyController
+
+        Parameters
+        ----------
+        min_limit : 'int'
+            Minimum number of in-flight requests
+        max_limit : 'int'
+            Maximum number of in-flight requests, default is min_limit which
+            fixes the limit
+        initial : 'int'
+            Initial number of in-flight requests, default is min_limit
+        max_error_rate : 'float'
+            Fraction of failed requests in a window above which the limit is
+            decreased
+        """
+        if max_limit is None:
+            max_limit = min_limit
+
+        if min_limit < 1 or max_limit < min_limit:
+            msg = ('Invalid concurrency bounds: min = {}, max = {}'
+                   .format(min_limit, max_limit))
+            raise ValueError(msg)
+
+        if initial is None:
+            initial = min_limit
+
+        self._min = min_limit
+        self._max = max_limit
+        self.limit = min(max(initial, min_limit), max_limit)
+        self._max_error_rate = max_error_rate
+
+        self._lock = threading.Lock()
+        # Smoothed throughput of previous windows in bytes/sec
+        self._throughput = None
+        self._best_latency = None
+        self.history = []
+        self._reset_window()
+
+    def __repr__(self):
+        """
+        Print the type of controller, its limit and bounds
+
+        Returns
+        ---------
+        'str'
+            type of controller, limit and bounds
+        """
+        return '{n} at {l} ({mn}-{mx})'.format(n=self.__class__.__name__,
+                                               l=self.limit, mn=self._min,
+                                               mx=self._max)
+
+    @property
+    def adaptive(self):
+        """
+        Whether the limit can change
+
+        Returns
+        ---------
+        'bool'
+            True if min and max limits differ
+        """
+        return self._max > self._min
+
+    def _reset_window(self):
+        """
+        Start a new measurement window
+        """
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self._window_errors = 0
+        self._window_bytes = 0
+        self._window_latency = 0
+
+    def record(self, size, latency, success):
+        """
+        Record a completed request, adjusting the limit at the end of each
+        window
+
+        Parameters
+        ----------
+        size : 'int'
+            Bytes transferred
+        latency : 'float'
+            Seconds taken by the request
+        success : 'bool'
+            Whether the request succeeded
+        """
+        if not self.adaptive:
+            return
+
+        with self._lock:
+            self._window_count += 1
+            self._window_bytes += size
+            self._window_latency += latency or 0
+            if not success:
+                self._window_errors += 1
+
+            # Each in-flight slot contributes at least two samples to a
+            # window
+            elapsed = time.monotonic() - self._window_start
+            if (self._window_count >= 2 * self.limit
+                    and elapsed >= self.WINDOW):
+                self._adjust()
+                self._reset_window()
+
+    def _adjust(self):
+        """
+        Apply AIMD update to the limit based on the current window, with the
+        lock held
+        """
+        elapsed = max(time.monotonic() - self._window_start, 1e-6)
+        throughput = self._window_bytes / elapsed
+        latency = self._window_latency / self._window_count
+        error_rate = self._window_errors / self._window_count
+        decrease = max(self._min, int(self.limit * self.DECREASE))
+
+        if error_rate > self._max_error_rate:
+            limit, reason = decrease, 'error rate'
+        elif (self._best_latency is not None
+              and latency > self._best_latency * self.LATENCY_FACTOR
+              and throughput < self._throughput * (1 + self.TOLERANCE)):
+            # Requests are queueing without improving throughput
+            limit, reason = decrease, 'latency'
+        elif (self._throughput is not None
+              and throughput < self._throughput * (1 - self.TOLERANCE)):
+            limit, reason = decrease, 'throughput drop'
+        else:
+            limit, reason = min(self._max, self.limit + 1), 'throughput'
+
+        if error_rate <= self._max_error_rate:
+            if self._best_latency is None or latency < self._best_latency:
+                self._best_latency = latency
+
+        logger.debug('Concurrency {} -> {} ({}): {:.2f} MB/s, {:.3f}s mean '
+                     'latency, {:.0%} errors'.format(self.limit, limit,
+                                                     reason, throughput / 1e6,
+                                                     latency, error_rate))
+        self.history.append({'time': time.time(), 'limit': self.limit,
+                             'new_limit': limit, 'reason': reason,
+                             'throughput': throughput, 'latency': latency,
+                             'error_rate': error_rate})
+        if self._throughput is None:
+            self._throughput = throughput
+        else:
+            self._throughput = (self.SMOOTHING * throughput
+                                + (1 - self.SMOOTHING) * self._throughput)
+
+        self.limit = limit
+
+
+class ConcurrencyLimiter(object):
+    """
+    asyncio gate admitting at most controller.limit tasks at a time, used as
+    an adaptive replacement for asyncio.Semaphore
+    """
+    def __init__(self, controller):
+        """
+        Initialize ConcurrencyLimiter
+
+        Parameters
+        ----------
+        controller : 'ConcurrencyController'
+            Controller setting the number of tasks admitted
+        """
+        self._controller = controller
+        self._in_flight = 0
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        """
+        Wait for a free slot
+        """
+        async with self._condition:
+            await self._condition.wait_for(
+                lambda: self._in_flight < self._controller.limit)
+            self._in_flight += 1
+
+    async def __aexit__(self, type, value, traceback):
+        """
+        Release slot and wake waiting tasks
+        """
+        async with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def record(self, size, latency, success):
+        """
+        Record a completed request with the controller
+
+        Parameters
+        ----------
+        size : 'int'
+            Bytes transferred
+        latency : 'float'
+            Seconds taken by the request
+        success : 'bool'
+            Whether the request succeeded
+        """
+        self._controller.record(size, latency, success)
@@ -0,0 +1,471 @@
+"""
+This module packs the cached files of many resource sites into a single
+time by site store, so that regional studies reading thousands of sites
+open one file and decode one time index instead of one per site. Each data
+column is a chunked 2D (time, site) dataset, sites are mapped to columns
+by a site_id dataset, and all sites share one int64 time index. The size
+and modification time each site's file had in the cache index when it was
+packed are recorded with it, so that sites whose files have since been
+replaced, quarantined or evicted are no longer read from the store.
+"""
+import logging
+import os
+
+import h5py
+import numpy as np
+import pandas as pds
+
+from R2PD.ingest import read_time_series
+
+logger = logging.getLogger(__name__)
+
+
+class ConsolidatedStore(object):
+    """
+    Time by site store of one dataset and resource type. Columns of
+    requested sites are read with as few hyperslab reads as possible, and
+    the sites of many nodes are aggregated with one read in batches that
+    fit in memory.
+    """
+    # Chunk shape of each (time, site) dataset
+    TIME_CHUNK = 2 ** 16
+    SITE_CHUNK = 8
+    # Sites read from per-site files and written to the store at a time
+    WRITE_BLOCK = 256
+    # Unrequested columns read to merge neighbouring hyperslabs
+    MAX_GAP = SITE_CHUNK
+    # Bytes of site data read for a batch of nodes at a time
+    BATCH_BYTES = 2 ** 30
+
+    def __init__(self, path):
+        """
+        Initialize ConsolidatedStore
+
+        Parameters
+        ----------
+        path : 'str'
+            Path to consolidated .h5 store
+        """
+        self._path = path
+        with h5py.File(path, 'r') as h5_file:
+            self.data_type = h5_file.attrs['data_type']
+            self.columns = [str(col) for col in h5_file.attrs['columns']]
+            # Data columns keep the dtype of the per-site files
+            self.dtypes = {col: h5_file[col].dtype for col in self.columns}
+            self._site_ids = h5_file['site_id'][...]
+            self._time_index = pds.DatetimeIndex(
+                h5_file['time'][...].view('datetime64[ns]'),
+                name=h5_file.attrs['index'])
+
+            if 'source_size' in h5_file:
+                self._source_size = h5_file['source_size'][...]
+                self._source_mtime = h5_file['source_mtime'][...]
+            else:
+                # Stores written before sources were recorded cannot be
+                # checked against the cache
+                self._source_size = np.full(len(self._site_ids), -1)
+                self._source_mtime = np.full(len(self._site_ids), np.nan)
+
+        self._positions = pds.Series(np.arange(len(self._site_ids)),
+                                     index=self._site_ids)
+        # Whether the file of each site is unchanged since it was packed
+        self._current = np.ones(len(self._site_ids), dtype=bool)
+
+    def __repr__(self):
+        """
+        Print the type of store, its data type and number of sites
+
+        Returns
+        ---------
+        'str'
+            type of store, data type and number of sites
+        """
+        return '{n} of {d} for {s} sites'.format(n=self.__class__.__name__,
+                                                 d=self.data_type,
+                                                 s=len(self))
+
+    def __len__(self):
+        """
+        Return number of sites in store
+
+        Returns
+        ---------
+        'int'
+            Number of sites
+        """
+        return len(self._site_ids)
+
+    def __contains__(self, site_id):
+        """
+        Check whether a site is in the store
+
+        Parameters
+        ----------
+        site_id : 'int'
+            Site id number
+
+        Returns
+        ---------
+        'bool'
+            True if site is in store
+        """
+        return int(site_id) in self._positions.index \
+            and bool(self._current[self._positions[int(site_id)]])
+
+    @property
+    def site_ids(self):
+        """
+        Site ids in column order
+
+        Returns
+        ---------
+        'numpy.ndarray'
+            Site id of each column
+        """
+        return self._site_ids
+
+    @property
+    def time_index(self):
+        """
+        Time index shared by all sites
+
+        Returns
+        ---------
+        'pandas.DatetimeIndex'
+            Time index
+        """
+        return self._time_index
+
+    def contains_all(self, site_ids):
+        """
+        Check whether all sites are in the store and their files are
+        unchanged since they were packed
+
+        Parameters
+        ----------
+        site_ids : 'list'
+            Site id numbers
+
+        Returns
+        ---------
+        'bool'
+            True if every site is in store and current
+        """
+        return bool(np.all(np.isin(np.asarray(site_ids, dtype=int),
+                                   self._site_ids[self._current])))
+
+    def refresh(self, entries):
+        """
+        Compare the recorded size and modification time of each site's file
+        with the cache index, marking sites whose files have changed or
+        left the cache as stale
+
+        Parameters
+        ----------
+        entries : 'pandas.DataFrame'
+            Cache index entries of the dataset and resource type of the
+            store, with site_id, size and mtime columns
+
+        Returns
+        ---------
+        'int'
+            Number of stale sites
+        """
+        entries = entries.set_index('site_id')
+        entries = entries.reindex(self._site_ids)
+        self._current = ((entries['size'].values == self._source_size)
+                         & (entries['mtime'].values == self._source_mtime))
+        stale = int((~self._current).sum())
+        if stale:
+            logger.debug('{} of {} sites of {} are stale'
+                         .format(stale, len(self), self._path))
+
+        return stale
+
+    def invalidate(self, site_ids):
+        """
+        Mark sites as stale, i.e. once their files are removed from the
+        cache
+
+        Parameters
+        ----------
+        site_ids : 'list'
+            Site id numbers
+        """
+        site_ids = np.asarray(site_ids, dtype=int)
+        self._current[np.isin(self._site_ids, site_ids)] = False
+
+    @classmethod
+    def get_runs(cls, positions):
+        """
+        Group sorted column positions into hyperslabs, merging runs
+        separated by no more than MAX_GAP columns
+
+        Parameters
+        ----------
+        positions : 'numpy.ndarray'
+            Sorted unique column positions
+
+        Returns
+        ---------
+        runs : 'list'
+            List of [start, stop) column ranges
+        """
+        runs = []
+        if not len(positions):
+            return runs
+
+        breaks = np.where(np.diff(positions) > cls.MAX_GAP + 1)[0]
+        starts = np.concatenate([[0], breaks + 1])
+        stops = np.concatenate([breaks, [len(positions) - 1]])
+        for start, stop in zip(starts, stops):
+            runs.append((int(positions[start]), int(positions[stop]) + 1))
+
+        return runs
+
+    def read(self, site_ids):
+        """
+        Read the data of sites
+
+        Parameters
+        ----------
+        site_ids : 'list'
+            Site id numbers, all of which must be in the store
+
+        Returns
+        ---------
+        data : 'dict'
+            DataFrame of [time(index), site_ids...] for each data column
+        """
+        site_ids = np.asarray(site_ids, dtype=int)
+        positions = self._positions.loc[site_ids].values
+        unique = np.unique(positions)
+        runs = self.get_runs(unique)
+        data = {}
+        with h5py.File(self._path, 'r') as h5_file:
+            for col in self.columns:
+                ds = h5_file[col]
+                values = np.concatenate([ds[:, start:stop]
+                                         for start, stop in runs], axis=1)
+                # Column of each unique position within the merged runs
+                offsets = np.concatenate([np.arange(start, stop)
+                                          for start, stop in runs])
+                values = values[:, np.searchsorted(offsets, unique)]
+                frame = pds.DataFrame(values, index=self._time_index,
+                                      columns=self._site_ids[unique])
+                data[col] = frame[site_ids]
+
+        logger.debug('Read {} sites of {} in {} hyperslabs'
+                     .format(len(unique), self.data_type, len(runs)))
+
+        return data
+
+    def get_agg_dtype(self, col):
+        """
+        dtype of the weighted sums of a data column. Float columns keep
+        their dtype in the per-site files, integer columns are summed with
+        fractional weights so their sums are float64.
+
+        Parameters
+        ----------
+        col : 'str'
+            Data column
+
+        Returns
+        ---------
+        'numpy.dtype'
+            dtype of aggregated column
+        """
+        dtype = self.dtypes[col]
+        if np.issubdtype(dtype, np.floating):
+            return dtype
+
+        return np.dtype('float64')
+
+    def aggregate(self, site_ids, fracs=None):
+        """
+        Sum the data of sites, each weighted by its fraction
+
+        Parameters
+        ----------
+        site_ids : 'list'
+            Site id numbers, all of which must be in the store
+        fracs : 'list'
+            Fraction of each site to use, None to use all of each site
+
+        Returns
+        ---------
+        'pandas.DataFrame'
+            Time series DataFrame of aggregated data columns, see
+            get_agg_dtype
+        """
+        data = self.read(site_ids)
+        if fracs is None:
+            fracs = np.ones(len(site_ids))
+
+        fracs = np.asarray(fracs, dtype=float)
+        agg = {col: frame.values @ fracs for col, frame in data.items()}
+        agg = pds.DataFrame(agg, index=self._time_index,
+                            columns=self.columns)
+
+        return agg.astype({col: self.get_agg_dtype(col)
+                           for col in self.columns})
+
+    def aggregate_nodes(self, allocation):
+        """
+        Sum the data of the sites of many nodes with one read of all their
+        sites and one sparse matrix product per data column
+
+        Parameters
+        ----------
+        allocation : 'AllocationMatrix'
+            Fractions of sites applied to each node, all of whose sites must
+            be in the store
+
+        Returns
+        ---------
+        'dict'
+            Time series DataFrame of [time(index), node_ids...] for each data
+            column, see get_agg_dtype
+        """
+        data = self.read(allocation.site_ids)
+        return {col: allocation.aggregate(frame)
+                .astype(self.get_agg_dtype(col))
+                for col, frame in data.items()}
+
+    def read_batches(self, site_lists):
+        """
+        Split lists of sites into batches whose combined data fits in
+        BATCH_BYTES
+
+        Parameters
+        ----------
+        site_lists : 'list'
+            List of site id lists, i.e. the sites of each node
+
+        Returns
+        ---------
+        batches : 'list'
+            List of lists of indices into site_lists
+        """
+        site_bytes = len(self._time_index) * sum(dtype.itemsize for dtype
+                                                 in self.dtypes.values())
+        max_sites = max(self.BATCH_BYTES // max(site_bytes, 1), 1)
+        batches = []
+        batch = []
+        sites = set()
+        for i, site_ids in enumerate(site_lists):
+            new_sites = sites.union(int(site) for site in site_ids)
+            if batch and len(new_sites) > max_sites:
+                batches.append(batch)
+                batch = []
+                new_sites = set(int(site) for site in site_ids)
+
+            batch.append(i)
+            sites = new_sites
+
+        if batch:
+            batches.append(batch)
+
+        return batches
+
+    @classmethod
+    def build(cls, path, file_paths, data_type, sources=None, **filters):
+        """
+        Pack per-site resource files into a store, keeping the dtype of
+        each data column. Sites whose time index, columns or dtypes differ
+        from those of the first site are left out.
+
+        Parameters
+        ----------
+        path : 'str'
+            Path of consolidated .h5 store to write
+        file_paths : 'dict'
+            Path to the resource file of each site id
+        data_type : 'str'
+            Dataset to consolidate, i.e. 'power_data'
+        sources : 'dict'
+            (size, mtime) of the resource file of each site id as recorded
+            in the cache index, None to take them from the files
+        **filters
+            compression, compression_opts and shuffle of the store, see
+            ingest.get_filters
+
+        Returns
+        ---------
+        'ConsolidatedStore'
+            Store of the consolidated sites
+        """
+        site_ids = sorted(int(site) for site in file_paths)
+        if not site_ids:
+            raise ValueError('No files to consolidate')
+
+        first = read_time_series(file_paths[site_ids[0]], data_type)
+        time_index = first.index
+        columns = [str(col) for col in first.columns]
+        dtypes = [first[col].dtype for col in first.columns]
+        n_time = len(time_index)
+        chunks = (min(cls.TIME_CHUNK, n_time),
+                  min(cls.SITE_CHUNK, len(site_ids)))
+
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        consolidated = []
+        with h5py.File(tmp_path, 'w') as h5_file:
+            datasets = {col: h5_file.create_dataset(
+                col, shape=(n_time, len(site_ids)),
+                maxshape=(n_time, None), dtype=dtype, chunks=chunks,
+                **filters) for col, dtype in zip(columns, dtypes)}
+            for start in range(0, len(site_ids), cls.WRITE_BLOCK):
+                block = {col: [] for col in columns}
+                for site_id in site_ids[start:start + cls.WRITE_BLOCK]:
+                    data = read_time_series(file_paths[site_id], data_type)
+                    if not data.index.equals(time_index) or \
+                            [str(col) for col in data.columns] != columns \
+                            or list(data.dtypes) != dtypes:
+                        logger.warning('Skipping site {} whose data does not '
+                                       'match site {}'
+                                       .format(site_id, site_ids[0]))
+                        continue
+
+                    for col in columns:
+                        block[col].append(data[col].values)
+
+                    consolidated.append(site_id)
+
+                stop = len(consolidated)
+                first_col = stop - len(block[columns[0]])
+                if stop > first_col:
+                    for col in columns:
+                        datasets[col][:, first_col:stop] = \
+                            np.stack(block[col], axis=1)
+
+            # Drop the columns of skipped sites
+            for col in columns:
+                datasets[col].resize(len(consolidated), axis=1)
+
+            if sources is None:
+                sources = {}
+                for site_id in consolidated:
+                    stat = os.stat(file_paths[site_id])
+                    sources[site_id] = (stat.st_size, stat.st_mtime)
+
+            h5_file.create_dataset('site_id', data=np.array(consolidated))
+            h5_file.create_dataset(
+                'source_size', data=np.array([sources[site][0] for site
+                                              in consolidated], dtype='i8'))
+            h5_file.create_dataset(
+                'source_mtime', data=np.array([sources[site][1] for site
+                                               in consolidated], dtype='f8'))
+            # Timestamps are stored as ns whatever the resolution of the index
+            h5_file.create_dataset(
+                'time', data=time_index.values.astype('datetime64[ns]')
+                .view('i8'))
+            h5_file.attrs['data_type'] = data_type
+            h5_file.attrs['index'] = time_index.name
+            h5_file.attrs['columns'] = columns
+
+        os.replace(tmp_path, path)
+        logger.info('Consolidated {} of {} sites into {}'
+                    .format(len(consolidated), len(site_ids), path))
+
+        return cls(path)
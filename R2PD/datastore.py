@@ -2,30 +2,78 @@
 This module provides classes for accessing site-level wind and solar data
 from internal and external data stores.
 """
+import collections
 import concurrent.futures as cf
+import contextlib
+import functools
+import hashlib
 import logging
 import multiprocessing
 import os
-from urllib.request import urlretrieve
+import shutil
+import threading
+import time
 
 from configparser import ConfigParser
+import h5py
 import numpy as np
 import pandas as pds
 
+from R2PD.allocation import AllocationMatrix
+from R2PD.cacheindex import CacheIndex
+from R2PD.cachelayout import CacheLayout
+from R2PD.cachelock import CacheLock
+from R2PD.consolidate import ConsolidatedStore
+from R2PD import ingest
+from R2PD.downloader import AsyncDownloader, DownloadReport, DownloadResult
+from R2PD.planner import DownloadPlan, DownloadPlanner
 from R2PD.powerdata import GeneratorNodeCollection
-from R2PD.nearestnodes import nearest_power_nodes, nearest_met_nodes
+from R2PD.nearestnodes import (allocate_power_nodes, nearest_power_nodes,
+                               nearest_met_nodes)
 from R2PD.resourcedata import WindResource, SolarResource, ResourceList
+from R2PD.retry import CircuitBreaker, CircuitOpenError, RetryPolicy
+from R2PD.siteindex import SiteIndex
+from R2PD.Timeout import Deadline, TimeoutError
 
 logger = logging.getLogger(__name__)
 
 
+def _verify_file(task):
+    """
+    Validate a cached file in a worker process
+
+    Parameters
+    ----------
+    task : 'tuple'
+        (file_path, resource_type, full), see InternalDataStore.validate_file
+
+    Returns
+    ---------
+    'str'
+        Error message, None if file is valid
+    """
+    file_path, resource_type, full = task
+    if not os.path.exists(file_path):
+        return 'File is missing'
+
+    try:
+        InternalDataStore.validate_file(file_path, resource_type, full=full)
+    except IOError as ex:
+        return str(ex)
+
+    return None
+
+
 class DataStore(object):
     """
     Abstract class to define interface for accessing stores of resource data.
     """
     META_ROOT = os.path.dirname(os.path.realpath(__file__))
     META_ROOT = os.path.join(META_ROOT, 'library')
-    # Average File size in MB currently estimates
+    # Directory holding site indices of the meta data, None to keep them
+    # next to the meta data .csv files
+    SITE_INDEX_ROOT = None
+    # Average file sizes in MB, used to estimate downloads of unknown size
     WIND_FILE_SIZES = {'met': 12.1, 'power': 3.7, 'fcst': 1, 'fcst-prob': 1.8}
     SOLAR_FILE_SIZES = {'met': 5.2, 'power': 3.3, 'fcst': 0}
 
@@ -44,24 +92,22 @@ class DataStore(object):
         """
         return self.__class__.__name__
 
-    @staticmethod
-    def load_meta(meta_path):
+    @classmethod
+    def load_meta(cls, meta_path):
         """
-        Load meta data
+        Load meta data, from its memory-mapped site index
 
         Parameters
         ----------
         meta_path : 'str'
-            Path to meta data .json
+            Path to meta data .csv
 
         Returns
         ---------
-        meta : 'pandas.DataFrame'
-            DataFrame of resource meta data
+        meta : 'SiteIndex'
+            Index of resource meta data
         """
-        meta = pds.read_csv(meta_path).set_index('site_id')
-        meta = meta.sort_index()
-        return meta
+        return SiteIndex.load(meta_path, index_dir=cls.SITE_INDEX_ROOT)
 
     @property
     def wind_meta(self):
@@ -70,8 +116,8 @@ class DataStore(object):
 
         Returns
         ---------
-        self._wind_meta : 'pandas.DataFrame'
-            DataFrame of wind resource meta data
+        self._wind_meta : 'SiteIndex'
+            Index of wind resource meta data
         """
         if self._wind_meta is None:
             path = os.path.join(self.META_ROOT, 'wind_site_meta.csv')
@@ -86,8 +132,8 @@ class DataStore(object):
 
         Returns
         ---------
-        self._wind_meta : 'pandas.DataFrame'
-            DataFrame of solar resource meta data
+        self._solar_meta : 'SiteIndex'
+            Index of solar resource meta data
         """
         if self._solar_meta is None:
             path = os.path.join(self.META_ROOT, 'solar_site_meta.csv')
@@ -131,8 +177,15 @@ class InternalDataStore(DataStore):
     """
     PKG_DIR = os.path.dirname(os.path.realpath(__file__))
     PKG_DIR = os.path.dirname(PKG_DIR)
-
-    def __init__(self, cache_root=None, size=1):
+    INDEX_FILE = 'cache_index.db'
+    CONSOLIDATED_DIR = 'consolidated'
+    CACHE_COLUMNS = {'wind': ['met', 'power', 'fcst', 'fcst-prob'],
+                     'solar': ['met', 'power']}
+
+    def __init__(self, cache_root=None, size=1, validate=True,
+                 eviction='lru', tiers=None, promote=False, shard_size=None,
+                 sidecars=False, compression=None, compression_opts=None,
+                 shuffle=False):
         """
         Initialize InternalDataStore object
 
@@ -143,6 +196,34 @@ class InternalDataStore(DataStore):
             Default is ./R2PD/R2PD_Cache
         size : 'float'
             Maximum local cache size in GB
+        validate : 'bool'
+            Validate cached files the first time they are looked up,
+            quarantining any that are corrupt
+        eviction : 'str'
+            Policy used to free space for downloads once the cache is full,
+            'lru' evicts the least recently used files and 'lfu' the least
+            frequently used. None raises an error instead.
+        tiers : 'list'
+            Read-only cache roots, i.e. a shared copy of the data, searched
+            in order for files that are not in the local cache
+        promote : 'bool'
+            Copy files requested from the read-only tiers into the local
+            cache, so that later requests read them from local disk
+        shard_size : 'int'
+            Number of consecutive site ids per subdirectory of a new cache,
+            None to keep all files of a dataset in one directory. Existing
+            caches keep their layout until migrated.
+        sidecars : 'bool'
+            Write a read-optimized sidecar of each file added to the cache,
+            which Resource reads instead of the file
+        compression : 'str'
+            'gzip' or 'lzf' to recompress files and their sidecars as they
+            are added to the cache, trading read time for cache capacity.
+            None keeps files as downloaded.
+        compression_opts : 'int'
+            gzip level from 0 to 9
+        shuffle : 'bool'
+            Apply the byte shuffle filter before compressing
         """
         super(InternalDataStore, self).__init__()
 
@@ -151,18 +232,71 @@ class InternalDataStore(DataStore):
 
         self._cache_root = cache_root
         self._wind_root = os.path.join(self._cache_root, 'wind')
-        if not os.path.exists(self._wind_root):
-            os.makedirs(self._wind_root)
+        os.makedirs(self._wind_root, exist_ok=True)
 
         self._solar_root = os.path.join(self._cache_root, 'solar')
-        if not os.path.exists(self._solar_root):
-            os.makedirs(self._solar_root)
+        os.makedirs(self._solar_root, exist_ok=True)
+
+        self._quarantine_root = os.path.join(self._cache_root, 'quarantine')
+        self._lock_root = os.path.join(self._cache_root, '.locks')
+        os.makedirs(self._lock_root, exist_ok=True)
+
+        if eviction is not None:
+            eviction = eviction.lower()
+            if eviction not in CacheIndex.EVICTION_ORDER:
+                msg = ("eviction must be one of {} or None, but is {!r}"
+                       .format(list(CacheIndex.EVICTION_ORDER), eviction))
+                raise ValueError(msg)
 
         self._size = size
+        self._validate = validate
+        self._eviction = eviction
+        self._tiers = list(tiers) if tiers is not None else []
+        self._promote = promote
+        self._sidecars = sidecars
+        if compression is not None:
+            compression = compression.lower()
+
+        self._filters = ingest.get_filters(compression=compression,
+                                           compression_opts=compression_opts,
+                                           shuffle=shuffle)
+        # Files found in the read-only tiers, which are never modified
+        self._tier_files = {}
+        # Number of pins held on each file path in this process
+        self._pins = collections.Counter()
+        self._pins_lock = threading.Lock()
+        # Downloads validated before they were moved into the cache mapped
+        # to their (size, mtime), recorded in the index by add_files
+        self._validated = {}
+
+        self._index = CacheIndex(os.path.join(self._cache_root,
+                                              self.INDEX_FILE))
+        # Cache meta of each dataset and the index version it was built from
+        self._cache_meta = {}
+        # Consolidated stores with the mtime of the file they were loaded
+        # from and the index version they were last refreshed against
+        self._stores = {}
+        if not self._index.scanned:
+            # Index existing caches once, afterwards the index is updated
+            # as files are added and removed
+            self.update_cache_meta()
+
+        layout = CacheLayout(shard_size=shard_size)
+        if os.path.exists(os.path.join(self._cache_root,
+                                       CacheLayout.LAYOUT_FILE)):
+            self._layout = CacheLayout.load(self._cache_root)
+        elif len(self._index):
+            # Caches created before sharding are flat
+            self._layout = CacheLayout()
+        else:
+            self._layout = layout
+            self._layout.save(self._cache_root)
 
-        self._wind_cache = None
-        self._solar_cache = None
-        self.update_cache_meta()
+        if shard_size is not None and self._layout != layout:
+            logger.warning('Local cache is {}, migrate it to use {}'
+                           .format(self._layout, layout))
+
+        self._tier_layouts = [CacheLayout.load(tier) for tier in self._tiers]
 
     def __repr__(self):
         """
@@ -193,82 +327,123 @@ class InternalDataStore(DataStore):
         'InternalDataStore'
             Initialized InternalDataStore object
         """
+        validate = True
+        eviction = 'lru'
+        tiers = None
+        promote = False
+        shard_size = None
+        sidecars = False
+        compression = None
+        compression_opts = None
+        shuffle = False
         if config is None:
             size = None
             root_path = os.path.join(cls.PKG_DIR, 'R2PD_Cache')
         else:
-            config_parser = ConfigParser()
+            config_parser = ConfigParser(inline_comment_prefixes=('#',))
             config_parser.read(config)
             root_path = config_parser.get('local_cache', 'root_path')
             root_path = cls.decode_config_entry(root_path)
             size = cls.decode_config_entry(config_parser.get('local_cache',
                                                              'size'))
+            validate = config_parser.getboolean('local_cache', 'validate',
+                                                fallback=True)
+            eviction = cls.decode_config_entry(
+                config_parser.get('local_cache', 'eviction',
+                                  fallback='lru'))
+            shard_size = cls.decode_config_entry(
+                config_parser.get('local_cache', 'shard_size',
+                                  fallback='None'))
+            tiers = cls.decode_config_entry(
+                config_parser.get('local_cache', 'tiers', fallback='None'))
+            if tiers is not None:
+                tiers = [tier.strip() for tier in tiers.split(',')
+                         if tier.strip()]
+
+            promote = config_parser.getboolean('local_cache', 'promote',
+                                               fallback=False)
+            sidecars = config_parser.getboolean('local_cache', 'sidecars',
+                                                fallback=False)
+            compression = cls.decode_config_entry(
+                config_parser.get('local_cache', 'compression',
+                                  fallback='None'))
+            compression_opts = cls.decode_config_entry(
+                config_parser.get('local_cache', 'compression_opts',
+                                  fallback='None'))
+            if compression_opts is not None:
+                compression_opts = int(compression_opts)
+
+            shuffle = config_parser.getboolean('local_cache', 'shuffle',
+                                               fallback=False)
         if size is not None:
             size = float(size)
         else:
             size = 1
 
-        return cls(cache_root=root_path, size=size)
+        return cls(cache_root=root_path, size=size, validate=validate,
+                   eviction=eviction, tiers=tiers, promote=promote,
+                   shard_size=shard_size, sidecars=sidecars,
+                   compression=compression, compression_opts=compression_opts,
+                   shuffle=shuffle)
 
-    @staticmethod
-    def get_cache_size(cache_meta, file_sizes):
+    @property
+    def tiers(self):
         """
-        Searches all sub directories in path for .hdf5 files
-        computes total size in GB
-
-        Parameters
-        ----------
-        cache_path : 'str'
-            Path to cache directory
+        Cache roots searched for resource files, in order
 
         Returns
         ---------
-        repo_size : 'float'
-            Returns total size of .hdf5 files in cache in GB
+        'list'
+            Local cache root followed by the read-only tiers
         """
-        repo_size = 0
-        for resource_type, col in cache_meta.iteritems():
-            repo_size += file_sizes[resource_type] * col.sum()
+        return [self._cache_root] + self._tiers
 
-        return repo_size / 1000
+    @property
+    def layout(self):
+        """
+        Directory layout of local cache
 
-    @staticmethod
-    def get_cache_summary(cache_meta):
+        Returns
+        ---------
+        'CacheLayout'
+            Flat or sharded layout
+        """
+        return self._layout
+
+    def get_roots(self, dataset, site_id):
         """
-        Summarize the data available in the local cache
+        Directories holding the files of a site in each cache tier, in
+        search order
 
         Parameters
         ----------
-        path : 'str'
-            Path to cache meta .csv
+        dataset : 'str'
+            'wind' or 'solar'
+        site_id : 'int'
+            Site id number
 
         Returns
         ---------
-        summary : 'pandas.Series'
-            Summary table of number of sites, and corresponding resource types
-            in local cache
+        'list'
+            Local cache directory followed by read-only tier directories
         """
-        summary = pds.Series()
-        summary['sites'] = len(cache_meta)
-        for col in cache_meta.columns:
-            summary[col] = cache_meta[col].sum()
-
-        return summary
+        layouts = [self._layout] + self._tier_layouts
+        return [layout.get_dir(root, dataset, site_id)
+                for root, layout in zip(self.tiers, layouts)]
 
     @property
     def cache_size(self):
         """
-        Calculate size of local cache and dataset caches in GB
+        Size of local cache and dataset caches in GB, from the size of each
+        file recorded in the cache index
 
         Returns
         ---------
         'tuple'
             total, wind, and solar cache sizes in GB (floats)
         """
-        wind_cache = self.get_cache_size(self.wind_cache,
-                                         self.WIND_FILE_SIZES)
-        solar_cache = self.get_cache_size(self.solar_cache,
-                                          self.SOLAR_FILE_SIZES)
+        wind_cache = self._index.total_size('wind') / 1e9
+        solar_cache = self._index.total_size('solar') / 1e9
         total_cache = wind_cache + solar_cache
 
         return total_cache, wind_cache, solar_cache
@@ -276,418 +451,1527 @@ class InternalDataStore(DataStore):
     @property
     def cache_summary(self):
         """
-        Summarize sites and resource types in cache
+        Summarize files and bytes of each dataset and resource type in cache
 
         Returns
         ---------
         'pandas.DataFrame'
-            Summary of Wind and Solar caches
+            Table of [dataset, resource_type](index), files, bytes
         """
-        wind_summary = self.get_cache_summary(self.wind_cache)
-        wind_summary.name = 'wind'
-
-        solar_summary = self.get_cache_summary(self.solar_cache)
-        solar_summary.name = 'solar'
-
-        return pds.concat((wind_summary, solar_summary), axis=1).T
+        return self._index.summary()
 
     @property
     def wind_cache(self):
         """
-        Scan wind cache and update cache meta
+        Wind cache meta from the cache index
 
         Returns
         ---------
-        _wind_cache : 'pandas.DataFrame'
+        'pandas.DataFrame'
             DataFrame of files in wind cache
         """
-        if self._wind_cache is None:
-            columns = ['met', 'power', 'fcst', 'fcst-prob']
-            cache_meta = pds.DataFrame(columns=columns)
-            cache_meta.index.name = 'site_id'
-            self._wind_cache = self.scan_cache(self._wind_root, cache_meta)
-
-        return self._wind_cache
+        return self.get_cache_meta('wind')
 
     @property
     def solar_cache(self):
         """
-        Scan solar cache and update cache meta
+        Solar cache meta from the cache index
 
         Returns
         ---------
-        _solar_cache : 'pandas.DataFrame'
+        'pandas.DataFrame'
             DataFrame of files in solar cache
         """
-        if self._solar_cache is None:
-            columns = ['met', 'power']
-            cache_meta = pds.DataFrame(columns=columns)
-            cache_meta.index.name = 'site_id'
-            self._solar_cache = self.scan_cache(self._solar_root, cache_meta)
-
-        return self._solar_cache
+        return self.get_cache_meta('solar')
 
-    @staticmethod
-    def scan_cache(cache_path, cache_meta):
+    def get_cache_meta(self, dataset):
         """
-        Scan cache_path and update cache_meta
+        Table of the resource types cached for each site, rebuilt from the
+        cache index only when the index has changed
 
         Parameters
         ----------
-        cache_path : 'str'
-            Root directory to be scanned for .hdf5 files
-        cache_meta : 'pandas.DataFrame'
-            DataFrame of resource files in cache
+        dataset : 'str'
+            'wind' or 'solar'
 
         Returns
         ---------
         cache_meta : 'pandas.DataFrame'
-            Updated DataFrame of resource files in cache
+            DataFrame of [site_id(index), resource types...] flags
         """
-        cache_sites = cache_meta.index
-
-        for file in os.listdir(cache_path):
-            if file.endswith('.hdf5'):
-                name = os.path.splitext(os.path.basename(file))[0]
-                _, resource, site_id = name.split('_')
-                site_id = int(site_id)
+        if dataset not in self.CACHE_COLUMNS:
+            msg = "Invalid dataset type, must be 'wind' or 'solar'"
+            raise ValueError(msg)
 
-                if site_id not in cache_sites:
-                    cache_meta.loc[site_id] = False
+        version = self._index.version
+        cached = self._cache_meta.get(dataset)
+        if cached is not None and cached[0] == version:
+            return cached[1]
 
-                cache_meta.loc[site_id, resource] = True
+        entries = self._index.entries(dataset)
+        site_ids = pds.Index(np.unique(entries['site_id'].values),
+                             name='site_id')
+        columns = self.CACHE_COLUMNS[dataset]
+        flags = np.zeros((len(site_ids), len(columns)), dtype=bool)
+        for i, resource_type in enumerate(columns):
+            files = entries.loc[entries['resource_type'] == resource_type]
+            flags[site_ids.get_indexer(files['site_id'].values), i] = True
 
-        cache_sites = cache_meta.index
+        cache_meta = pds.DataFrame(flags, index=site_ids, columns=columns)
+        self._cache_meta[dataset] = (version, cache_meta)
 
         return cache_meta
 
-    def update_cache_meta(self, dataset=None):
+    @staticmethod
+    def scan_cache(cache_path):
         """
-        Refresh cache metadata by rescanning cache directory
+        Scan cache_path for resource files
 
         Parameters
         ----------
-        dataset : 'str'
-            'wind' or 'solar'
+        cache_path : 'str'
+            Dataset directory to be scanned, with its shards, for .hdf5
+            files
+
+        Returns
+        ---------
+        files : 'list'
+            List of (dataset, resource_type, site_id, path, size, mtime) for
+            each resource file in cache_path
         """
-        if dataset is None:
-            self._wind_cache = self.scan_cache(self._wind_root,
-                                               self.wind_cache)
-            self._solar_cache = self.scan_cache(self._solar_root,
-                                                self.solar_cache)
-        elif dataset == 'wind':
-            self._wind_cache = self.scan_cache(self._wind_root,
-                                               self.wind_cache)
-        elif dataset == 'solar':
-            self._solar_cache = self.scan_cache(self._solar_root,
-                                                self.solar_cache)
-        else:
-            msg = "Invalid dataset type, must be 'wind' or 'solar'"
-            raise ValueError(msg)
+        files = []
+        for entry in CacheLayout.iter_files(cache_path):
+            try:
+                dataset, resource, site_id = \
+                    InternalDataStore.parse_file_name(entry.name)
+            except ValueError:
+                logger.warning('Skipping unrecognized file {} in cache'
+                               .format(entry.name))
+                continue
+
+            stat = entry.stat()
+            if not stat.st_size:
+                logger.warning('Skipping empty file {} in cache'
+                               .format(entry.name))
+                continue
+
+            files.append((dataset, resource, site_id, entry.path,
+                          InternalDataStore.get_disk_size(entry.path),
+                          stat.st_mtime))
+
+        return files
 
-    def check_cache(self, dataset, site_id, resource_type=None):
+    def update_cache_meta(self, dataset=None):
         """
-        Check cache for presence of resource.
-        If resource_type is None check for any resource_type of site_id
-        else check for specific resource_type for site_id
+        Rebuild the cache index by rescanning cache directories. The index
+        is kept up to date as files are downloaded, so this is only needed
+        if files were added to or removed from the cache by hand.
 
         Parameters
         ----------
         dataset : 'str'
-            'wind' or 'solar'
-        site_id : 'int'
-            Site id number
-        resource_type : 'str'
-            type of resource
-            wind -> ('power', 'fcst', 'met')
-            solar -> ('power', 'fcst', 'met', 'irradiance')
-
-        Returns
-        ---------
-        'bool'
-            Is site/resource present in cache
+            'wind' or 'solar', None for both
         """
-        # Check for DR Power sites directly
-        if resource_type is not None:
-            file_name = '{}_{}_{}.hdf5'.format(dataset, resource_type, site_id)
-            file_path = os.path.join(self._cache_root, dataset, file_name)
-            return os.path.exists(file_path)
-
-        if dataset == 'wind':
-            cache_meta = self.wind_cache
-        elif dataset == 'solar':
-            cache_meta = self.solar_cache
+        if dataset is None:
+            datasets = ['wind', 'solar']
+        elif dataset in ('wind', 'solar'):
+            datasets = [dataset]
         else:
             msg = "Invalid dataset type, must be 'wind' or 'solar'"
             raise ValueError(msg)
-        cache_sites = cache_meta.index
-
-        if site_id in cache_sites:
-            if resource_type is not None:
-                cached = bool(cache_meta.loc[site_id, resource_type])
-            else:
-                cached = True
-        else:
-            cached = False
 
-        return cached
+        for dataset in datasets:
+            cache_path = os.path.join(self._cache_root, dataset)
+            files = self.scan_cache(cache_path)
+            logger.debug('Indexed {} files in {}'.format(len(files),
+                                                         cache_path))
+            self._index.replace(dataset, files)
 
-    def test_cache_size(self, download_size):
+    @staticmethod
+    def get_disk_size(file_path):
         """
-        Test to see if download will fit in cache
+        Bytes used by a resource file and its sidecar
 
         Parameters
         ----------
-        download_size : 'float'
-            Size of requested download in GB
+        file_path : 'str'
+            Path to resource file in cache
+
+        Returns
+        ---------
+        size : 'int'
+            Size of file plus size of its sidecar if present
         """
-        if self._size is not None:
-            cache_size, wind_size, solar_size = self.cache_size
-            open_cache = self._size - cache_size
-            if open_cache < download_size:
-                msg = ('Not enough space available in local cache:',
-                       '\nDownload size = {:.2f}GB'.format(download_size),
-                       '\nLocal cache = {:.2f}GB of'.format(cache_size),
-                       ' {:.2f}GB in use'.format(self._size),
-                       '\n\tCached wind data = {:.2f}GB'.format(wind_size),
-                       '\n\tCached solar data = {:.2f}GB'.format(solar_size))
-                raise RuntimeError(''.join(msg))
+        size = os.path.getsize(file_path)
+        sidecar_path = ingest.get_sidecar_path(file_path)
+        if os.path.exists(sidecar_path):
+            size += os.path.getsize(sidecar_path)
 
+        return size
 
-class ExternalDataStore(DataStore):
-    """
-    Abstract class to define interface for accessing external stores
-    of resource data.
-    """
-    def __init__(self, local_cache=None, threads=None):
+    @staticmethod
+    def remove_sidecar(file_path):
         """
-        Initialize ExternalDataStore object
+        Remove the sidecar of a resource file if present
 
         Parameters
         ----------
-        local_cache : 'InternalDataStore'
-            InternalDataStore object represening internal data cache
-        threads : 'int'
-            Number of threads to use during downloads
+        file_path : 'str'
+            Path to resource file in cache
         """
-        super(ExternalDataStore, self).__init__()
-
-        if local_cache is None:
-            local_cache = InternalDataStore.connect()
-        elif not isinstance(local_cache, InternalDataStore):
-            msg = ("Expecting local_cache to be instance of",
-                   "InternalDataStore,",
-                   "but is {:}.".format(type(local_cache)))
-            raise RuntimeError(' '.join(msg))
-
-        self._local_cache = local_cache
-
-        if threads:
-            if not isinstance(threads, int):
-                threads = multiprocessing.cpu_count() // 2
-        else:
-            threads = None
-
-        self._threads = threads
+        sidecar_path = ingest.get_sidecar_path(file_path)
+        if os.path.exists(sidecar_path):
+            os.remove(sidecar_path)
 
-    @classmethod
-    def connect(cls, config=None):
+    def get_consolidated_path(self, dataset, resource_type):
         """
-        Reads the configuration. From configuration and defaults,
-        determines initializes ExternalDataStore object.
+        Path of the consolidated store of a dataset and resource type
 
         Parameters
         ----------
-        config : 'str'
-            Path to .ini configuration file.
-            See library/config.ini for an example
+        dataset : 'str'
+            'wind' or 'solar'
+        resource_type : 'str'
+            power or met or fcst
 
         Returns
         ---------
-        'ExternalDataStore'
-            Initialized ExternalDataStore object
+        'str'
+            Path to consolidated .h5 store
         """
-        if config is None:
-            threads = None
-            local_cache = None
-        else:
-            config_parser = ConfigParser()
-            config_parser.read(config)
-
-            if config_parser.has_section('local_cache'):
-                local_cache = InternalDataStore.connect(config=config)
-            else:
-                local_cache = None
-
-            threads = config_parser.get('local_cache', 'threads',
-                                        fallback=None)
+        return os.path.join(self._cache_root, self.CONSOLIDATED_DIR,
+                            '{}_{}.h5'.format(dataset, resource_type))
 
-        return cls(local_cache=local_cache, threads=threads)
-
-    def get_meta(self, dataset):
+    def consolidate(self, dataset, resource_type, site_ids=None):
         """
-        Get meta associated with given dataset
+        Pack the cached files of a dataset and resource type into a single
+        time by site store, replacing any previous store
 
         Parameters
         ----------
         dataset : 'str'
             'wind' or 'solar'
+        resource_type : 'str'
+            power or met or fcst
+        site_ids : 'list'
+            Sites to consolidate, None for all cached sites
 
         Returns
         ---------
-        meta : 'pandas.DataFrame'
-            DataFrame of resource meta
+        'ConsolidatedStore'
+            Store of the consolidated sites
         """
-        if dataset == 'wind':
-            meta = self.wind_meta
-        elif dataset == 'solar':
-            meta = self.solar_meta
-        else:
-            raise ValueError("Invalid dataset type, must be 'wind' or 'solar'")
-
-        return meta
-
-    def get_download_size(self, dataset, numb_sites, resource_type):
+        entries = self._index.entries(dataset)
+        entries = entries.loc[entries['resource_type'] == resource_type]
+        if site_ids is not None:
+            entries = entries.loc[entries['site_id'].isin(site_ids)]
+
+        file_paths = dict(zip(entries['site_id'], entries['path']))
+        sources = dict(zip(entries['site_id'],
+                           zip(entries['size'], entries['mtime'])))
+        path = self.get_consolidated_path(dataset, resource_type)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data_type = '{}_data'.format(resource_type)
+        filters = self._filters if self._filters['compression'] else {}
+
+        return ConsolidatedStore.build(path, file_paths, data_type,
+                                       sources=sources, **filters)
+
+    def get_consolidated(self, dataset):
         """
-        Estimate download size
+        Consolidated stores of a dataset, reloaded when they are rebuilt.
+        Sites whose files have changed or left the cache since they were
+        packed are marked stale, so they are read from their files instead.
 
         Parameters
         ----------
         dataset : 'str'
             'wind' or 'solar'
-        num_sites : 'int'
-            Number of sites to be downloaded
-        resource_type : 'str'
-            type of resource
-            wind -> ('power', 'fcst', 'met')
-            solar -> ('power', 'fcst', 'met', 'irradiance')
-        forecasts : 'bool'
-            Boolean flag as to whether forecasts will be included in the
-            download or not
 
         Returns
         ---------
-        download_size : 'float'
-            Estimated download size in GB
+        stores : 'dict'
+            ConsolidatedStore of each resource type that has one
         """
-        if dataset == 'wind':
-            download_size = numb_sites * self.WIND_FILE_SIZES[resource_type]
-        elif dataset == 'solar':
-            download_size = numb_sites * self.SOLAR_FILE_SIZES[resource_type]
+        stores = {}
+        version = self._index.version
+        entries = None
+        for resource_type in self.CACHE_COLUMNS[dataset]:
+            path = self.get_consolidated_path(dataset, resource_type)
+            if not os.path.exists(path):
+                continue
 
-        return download_size / 1000
+            mtime = os.path.getmtime(path)
+            cached = self._stores.get(path)
+            if cached is None or cached[0] != mtime:
+                cached = (mtime, None, ConsolidatedStore(path))
+
+            if cached[1] != version:
+                if entries is None:
+                    entries = self._index.entries(dataset)
 
-    def download(self, src, dst):
+                cached[2].refresh(entries.loc[entries['resource_type']
+                                              == resource_type])
+                cached = (mtime, version, cached[2])
+
+            self._stores[path] = cached
+            stores[resource_type] = cached[2]
+
+        return stores
+
+    def invalidate_consolidated(self, dataset, resource_type, site_ids):
         """
-        Abstract method to download src to dst
+        Mark sites of the loaded consolidated store of a dataset and
+        resource type as stale, i.e. when their files leave the cache
 
         Parameters
         ----------
-        src : 'str'
-            Path or URL to src file
-        dst : 'str'
-            Path to which file should be downloaded
+        dataset : 'str'
+            'wind' or 'solar'
+        resource_type : 'str'
+            power or met or fcst
+        site_ids : 'list'
+            Site id numbers
         """
-        pass
+        path = self.get_consolidated_path(dataset, resource_type)
+        cached = self._stores.get(path)
+        if cached is not None:
+            cached[2].invalidate(site_ids)
 
-    def nearest_neighbors(self, node_collection):
+    def add_files(self, file_paths):
         """
-        Find the nearest neighbor resource sites for all nodes in
-        Node_collection
+        Add files in the cache to the cache index with their size on disk,
+        including their sidecars, and modification time. Files are ingested
+        by ingest_file before they are moved into the cache.
 
         Parameters
         ----------
-        node_collection : 'NodeCollection'
-            Collection of nodes for which resource sites are to be identified
-
-        Returns
-        ---------
-        nearest_nodes : 'pandas.DataFrame'
-            Dataframe with the nearest neighbor resource sites for each node
+        file_paths : 'list'
+            Paths to resource files in cache
         """
-        dataset = node_collection._dataset
-        resource_meta = self.get_meta(dataset)
-
-        if isinstance(node_collection, GeneratorNodeCollection):
-            nearest_nodes = nearest_power_nodes(node_collection,
-                                                resource_meta)
-        else:
-            nearest_nodes = nearest_met_nodes(node_collection,
-                                              resource_meta)
-
-        return nearest_nodes
-
-    def download_resource(self, dataset, site_id, resource_type):
+        files = []
+        valid = []
+        for file_path in file_paths:
+            dataset, resource_type, site_id = self.parse_file_name(file_path)
+            stat = os.stat(file_path)
+            files.append((dataset, resource_type, site_id, file_path,
+                          self.get_disk_size(file_path), stat.st_mtime))
+            if self._validated.pop(file_path, None) == (stat.st_size,
+                                                        stat.st_mtime):
+                valid.append((dataset, resource_type, site_id,
+                              stat.st_size, stat.st_mtime))
+
+        if files:
+            self._index.add_many(files)
+
+        for args in valid:
+            self._index.set_valid(*args)
+
+    def touch(self, dataset, resource_type, site_ids):
         """
-        Download the resource site file from repository
+        Record an access of cached files, used to decide which files to
+        keep in the cache
 
         Parameters
         ----------
         dataset : 'str'
             'wind' or 'solar'
-        site_ids : 'list'
-            List of site ids to be downloaded
         resource_type : 'str'
             power or met or fcst
+        site_ids : 'list'
+            Site id numbers of accessed files
         """
-        pass
+        self._index.touch(dataset, resource_type, site_ids)
 
-    def download_resource_data(self, dataset, site_ids, resource_type):
+    def get_file_path(self, dataset, resource_type, site_id):
         """
-        Download resource files from repository
+        Path of resource file in local cache
 
         Parameters
         ----------
         dataset : 'str'
             'wind' or 'solar'
-        site_ids : 'list'
-            List of site ids to be downloaded
         resource_type : 'str'
-            power or met
-        threads : 'int'
-            Number of threads to use for downloading
-        """
-        download_size = self.get_download_size(dataset, len(site_ids),
-                                               resource_type)
-        self._local_cache.test_cache_size(download_size)
+            power or met or fcst
+        site_id : 'int'
+            Site id number
 
-        if self._threads is None:
-            logger.debug("Downloading sequentially")
-            for site in site_ids:
-                self.download_resource(dataset, site, resource_type)
-        else:
-            logger.debug("Downloading using {} threads".format(self._threads))
-            with cf.ThreadPoolExecutor(max_workers=self._threads) as executor:
-                for site in site_ids:
-                    executor.submit(self.download_resource,
-                                    dataset, site, resource_type)
+        Returns
+        ---------
+        'str'
+            Path to resource file in local cache
+        """
+        return self._layout.get_path(self._cache_root, dataset,
+                                     resource_type, site_id)
 
-    def get_node_resource(self, dataset, site_id, frac=None):
+    def migrate(self, shard_size=None):
         """
-        Initialize and return Resource class object for specified resource site
+        Move the files of the local cache into a new layout in place and
+        reindex them. The cache must not be in use by other processes.
 
         Parameters
         ----------
-        dataset : 'str'
-            'wind' or 'solar'
-        site_id : int
-            Resource site_id
-        frac : 'float'
-            Fraction of resource to use from resource site
+        shard_size : 'int'
+            Number of consecutive site ids per subdirectory, None to move
+            all files back into their dataset directory
 
         Returns
         ---------
-        'Resource'
+        moved : 'int'
+            Number of files moved
+        """
+        layout = CacheLayout(shard_size=shard_size)
+        moved = layout.migrate(self._cache_root, self.parse_file_name)
+        self._layout = layout
+        self.update_cache_meta()
+
+        return moved
+
+    def find_tier_file(self, dataset, resource_type, site_id):
+        """
+        Search the read-only tiers, in order, for a resource file. Files
+        found in a tier are remembered, files that are missing are looked
+        up again on every call as the tiers may be updated.
+
+        Parameters
+        ----------
+        dataset : 'str'
+            'wind' or 'solar'
+        resource_type : 'str'
+            power or met or fcst
+        site_id : 'int'
+            Site id number
+
+        Returns
+        ---------
+        'str'
+            Path to resource file in the first tier containing a valid
+            copy, None if no tier does
+        """
+        key = (dataset, resource_type, int(site_id))
+        file_path = self._tier_files.get(key)
+        if file_path is not None:
+            return file_path
+
+        for tier, layout in zip(self._tiers, self._tier_layouts):
+            file_path = layout.get_path(tier, dataset, resource_type,
+                                        site_id)
+            if not os.path.exists(file_path):
+                continue
+
+            if self._validate:
+                try:
+                    self.validate_file(file_path, resource_type)
+                except IOError as ex:
+                    # Tiers are read-only so corrupt files cannot be
+                    # quarantined, the next tier is searched instead
+                    logger.warning('Invalid file in cache tier: {}'
+                                   .format(ex))
+                    continue
+
+            self._tier_files[key] = file_path
+            return file_path
+
+        return None
+
+    def promote(self, dataset, resource_type, site_ids):
+        """
+        Copy files from the read-only tiers into the local cache. Files
+        already in the local cache are skipped, and promotion stops once
+        the local cache is full.
+
+        Parameters
+        ----------
+        dataset : 'str'
+            'wind' or 'solar'
+        resource_type : 'str'
+            power or met or fcst
+        site_ids : 'list'
+            Site id numbers of files to promote
+
+        Returns
+        ---------
+        promoted : 'list'
+            Paths of files copied into the local cache
+        """
+        promoted = []
+        for site_id in site_ids:
+            if self._index.contains(dataset, site_id, resource_type):
+                continue
+
+            src = self.find_tier_file(dataset, resource_type, site_id)
+            if src is None:
+                continue
+
+            try:
+                self.test_cache_size(os.path.getsize(src) / 1e9)
+            except RuntimeError as ex:
+                logger.info('Stopped promoting files to local cache: {}'
+                            .format(ex))
+                break
+
+            dst = self.get_file_path(dataset, resource_type, site_id)
+            with self.lock(dst):
+                if not os.path.exists(dst):
+                    os.makedirs(os.path.dirname(dst), exist_ok=True)
+                    tmp_path = dst + '.part'
+                    shutil.copyfile(src, tmp_path)
+                    self.ingest_file(tmp_path, dst)
+                    os.replace(tmp_path, dst)
+                    promoted.append(dst)
+
+                self.add_files([dst])
+
+        if promoted:
+            logger.debug('Promoted {} {} {} files to local cache'
+                         .format(len(promoted), dataset, resource_type))
+
+        return promoted
+
+    @staticmethod
+    def parse_file_name(file_name):
+        """
+        Parse resource file name '{dataset}_{resource_type}_{site_id}.hdf5'
+
+        Parameters
+        ----------
+        file_name : 'str'
+            Name or path of resource file
+
+        Returns
+        ---------
+        dataset : 'str'
+            'wind' or 'solar'
+        resource_type : 'str'
+            power or met or fcst
+        site_id : 'int'
+            Site id number
+        """
+        name = os.path.splitext(os.path.basename(file_name))[0]
+        try:
+            dataset, resource_type, site_id = name.split('_')
+            site_id = int(site_id)
+        except ValueError:
+            raise ValueError('Invalid resource file name: {}'
+                             .format(file_name))
+
+        return dataset, resource_type, site_id
+
+    @staticmethod
+    def validate_file(file_path, resource_type, size=None, checksum=None,
+                      full=False):
+        """
+        Check that a resource file is complete and readable, raising IOError
+        if it is not
+
+        Parameters
+        ----------
+        file_path : 'str'
+            Path to resource .hdf5 file
+        resource_type : 'str'
+            power or met or fcst, file must contain '{resource_type}_data'
+        size : 'int'
+            Expected size of file in bytes
+        checksum : 'str'
+            Expected checksum of file as '{algorithm}:{hexdigest}',
+            i.e. 'md5:...' or 'sha256:...'
+        full : 'bool'
+            Read every chunk of the dataset rather than the first and last
+            records only, catching corruption anywhere in the file
+        """
+        if size is not None and os.path.getsize(file_path) != size:
+            raise IOError('{} is {} bytes, expected {}'
+                          .format(file_path, os.path.getsize(file_path),
+                                  size))
+
+        if checksum is not None:
+            algorithm, expected = checksum.split(':', 1)
+            file_hash = hashlib.new(algorithm)
+            with open(file_path, 'rb') as f:
+                for block in iter(lambda: f.read(2 ** 20), b''):
+                    file_hash.update(block)
+
+            if file_hash.hexdigest() != expected.lower():
+                raise IOError('{} checksum {} does not match {}'
+                              .format(file_path, file_hash.hexdigest(),
+                                      expected))
+
+        ds_name = '{}_data'.format(resource_type)
+        try:
+            with h5py.File(file_path, 'r') as h5_file:
+                if ds_name not in h5_file:
+                    raise KeyError('{} not found'.format(ds_name))
+
+                ds = h5_file[ds_name]
+                if not ds.shape or not ds.shape[0]:
+                    raise ValueError('{} is empty'.format(ds_name))
+
+                # Reading the first and last records touches the first and
+                # last chunks, catching truncated files
+                ds[0]
+                ds[-1]
+                if full:
+                    step = ds.chunks[0] if ds.chunks else ds.shape[0]
+                    step *= max(2 ** 20 // (step * ds.dtype.itemsize), 1)
+                    for start in range(0, ds.shape[0], step):
+                        ds[start:start + step]
+        except Exception as ex:
+            raise IOError('Unable to read {}: {}'.format(file_path, ex))
+
+    def validate_download(self, file_path, dst, size=None):
+        """
+        Validate a downloaded file and ingest it before it is moved into
+        the cache, while its cache lock is held
+
+        Parameters
+        ----------
+        file_path : 'str'
+            Path to downloaded file
+        dst : 'str'
+            Path file will be moved to in cache
+        size : 'int'
+            Expected size of file in bytes
+        """
+        _, resource_type, _ = self.parse_file_name(dst)
+        self.validate_file(file_path, resource_type, size=size)
+        try:
+            self.ingest_file(file_path, dst)
+        except Exception:
+            # The download is discarded, and with it the sidecar written
+            # from it next to dst
+            self.remove_sidecar(dst)
+            raise
+
+        # Moving the file into the cache keeps its size and mtime
+        stat = os.stat(file_path)
+        self._validated[dst] = (stat.st_size, stat.st_mtime)
+
+    def ingest_file(self, file_path, dst):
+        """
+        Recompress a validated file and write its sidecar, if enabled,
+        before it is moved into the cache. A file that cannot be ingested
+        is left as it was, so that it is cached as downloaded.
+
+        Parameters
+        ----------
+        file_path : 'str'
+            Path to validated file, i.e. a completed .part file
+        dst : 'str'
+            Path file will be moved to in cache
+        """
+        if not (self._sidecars or self._filters['compression']):
+            return
+
+        _, resource_type, _ = self.parse_file_name(dst)
+        try:
+            written = ingest.ingest(file_path, sidecar=self._sidecars,
+                                    dst=dst, **self._filters)
+        except Exception as ex:
+            logger.warning('Unable to ingest {}, caching it as downloaded: '
+                           '{}'.format(dst, ex))
+            self.remove_sidecar(dst)
+            # The file may have been recompressed before the failure
+            written = bool(self._filters['compression'])
+
+        if written:
+            # A recompressed file must be as readable as the download
+            self.validate_file(file_path, resource_type)
+
+    def lock(self, file_path):
+        """
+        Lock on a cache file, shared by all threads and processes using
+        this cache, to be held while the file is downloaded
+
+        Parameters
+        ----------
+        file_path : 'str'
+            Path to resource file in cache
+
+        Returns
+        ---------
+        'CacheLock'
+            Unacquired lock on file_path
+        """
+        return CacheLock(self._lock_root, os.path.basename(file_path))
+
+    def quarantine(self, file_path):
+        """
+        Move corrupt file out of the cache into the quarantine directory
+
+        Parameters
+        ----------
+        file_path : 'str'
+            Path to resource file in cache
+
+        Returns
+        ---------
+        dst : 'str'
+            Path of quarantined file
+        """
+        os.makedirs(self._quarantine_root, exist_ok=True)
+
+        dst = os.path.join(self._quarantine_root, '{}.{}'.format(
+            os.path.basename(file_path), time.strftime('%Y%m%d%H%M%S')))
+        shutil.move(file_path, dst)
+        self.remove_sidecar(file_path)
+        logger.warning('Quarantined {} to {}'.format(file_path, dst))
+
+        dataset, resource_type, site_id = self.parse_file_name(file_path)
+        self._index.remove(dataset, resource_type, site_id)
+        self.invalidate_consolidated(dataset, resource_type, [site_id])
+
+        return dst
+
+    def is_valid(self, file_path, resource_type, entry=None):
+        """
+        Check whether file_path is a valid resource file, quarantining it if
+        it is not. Results are recorded in the cache index, so that no
+        process validates the file again until it changes.
+
+        Parameters
+        ----------
+        file_path : 'str'
+            Path to resource file in cache
+        resource_type : 'str'
+            power or met or fcst
+        entry : 'dict'
+            Cache index entry of file, looked up if None
+
+        Returns
+        ---------
+        'bool'
+            True if file is valid
+        """
+        dataset, _, site_id = self.parse_file_name(file_path)
+        if entry is None:
+            entry = self._index.get(dataset, resource_type, site_id)
+
+        stat = os.stat(file_path)
+        if entry is not None and (entry['valid_size'], entry['valid_mtime']) \
+                == (stat.st_size, stat.st_mtime):
+            return True
+
+        try:
+            self.validate_file(file_path, resource_type)
+        except IOError as ex:
+            logger.warning('Invalid cache file: {}'.format(ex))
+            self.quarantine(file_path)
+            return False
+
+        self._index.set_valid(dataset, resource_type, site_id, stat.st_size,
+                              stat.st_mtime)
+
+        return True
+
+    def verify(self, processes=None, full=False, dataset=None):
+        """
+        Validate every indexed file of the cache in parallel worker
+        processes
+
+        Parameters
+        ----------
+        processes : 'int'
+            Number of worker processes, default is the number of CPUs
+        full : 'bool'
+            Read every chunk of each file rather than the first and last
+            records only
+        dataset : 'str'
+            'wind' or 'solar', None for both
+
+        Returns
+        ---------
+        report : 'pandas.DataFrame'
+            Table of [dataset, resource_type, site_id, path, size, valid,
+            error] for each file
+        """
+        entries = self._index.entries(dataset)
+        report = entries[['dataset', 'resource_type', 'site_id', 'path',
+                          'size']].copy()
+        tasks = [(path, resource_type, full) for path, resource_type
+                 in zip(report['path'], report['resource_type'])]
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+
+        start = time.monotonic()
+        if processes > 1 and len(tasks) > 1:
+            # Large chunks amortize the cost of sending tasks to workers
+            chunksize = max(len(tasks) // (processes * 4), 1)
+            with cf.ProcessPoolExecutor(max_workers=processes) as executor:
+                errors = list(executor.map(_verify_file, tasks,
+                                           chunksize=chunksize))
+        else:
+            errors = [_verify_file(task) for task in tasks]
+
+        report['valid'] = [error is None for error in errors]
+        report['error'] = errors
+        logger.info('Verified {} files in {:.1f}s, {} invalid'
+                    .format(len(report), time.monotonic() - start,
+                            (~report['valid']).sum()))
+
+        return report
+
+    def repair(self, report):
+        """
+        Quarantine the invalid files of a verify report and remove missing
+        files from the index
+
+        Parameters
+        ----------
+        report : 'pandas.DataFrame'
+            Report returned by verify
+
+        Returns
+        ---------
+        repaired : 'pandas.DataFrame'
+            Invalid rows of report with the path each file was quarantined
+            to, None for missing files
+        """
+        repaired = report.loc[~report['valid']].copy()
+        quarantined = []
+        for row in repaired.itertuples():
+            lock = self.lock(row.path)
+            with lock:
+                if os.path.exists(row.path):
+                    quarantined.append(self.quarantine(row.path))
+                else:
+                    self._index.remove(row.dataset, row.resource_type,
+                                       row.site_id)
+                    self.invalidate_consolidated(row.dataset,
+                                                 row.resource_type,
+                                                 [row.site_id])
+                    quarantined.append(None)
+
+        repaired['quarantined'] = quarantined
+
+        return repaired
+
+    def check_cache(self, dataset, site_id, resource_type=None):
+        """
+        Check cache for presence of resource, searching the local cache and
+        then the read-only tiers.
+        If resource_type is None check for any resource_type of site_id
+        else check for specific resource_type for site_id
+
+        Parameters
+        ----------
+        dataset : 'str'
+            'wind' or 'solar'
+        site_id : 'int'
+            Site id number
+        resource_type : 'str'
+            type of resource
+            wind -> ('power', 'fcst', 'met')
+            solar -> ('power', 'fcst', 'met', 'irradiance')
+
+        Returns
+        ---------
+        'bool'
+            Is site/resource present in cache
+        """
+        if dataset not in self.CACHE_COLUMNS:
+            msg = "Invalid dataset type, must be 'wind' or 'solar'"
+            raise ValueError(msg)
+
+        if resource_type is None:
+            if self._index.contains(dataset, site_id):
+                return True
+
+            return any(self.find_tier_file(dataset, resource, site_id)
+                       is not None
+                       for resource in self.CACHE_COLUMNS[dataset])
+
+        if self._check_local(dataset, site_id, resource_type):
+            return True
+
+        return self.find_tier_file(dataset, resource_type,
+                                   site_id) is not None
+
+    def _check_local(self, dataset, site_id, resource_type):
+        """
+        Check the local cache for a resource file
+
+        Parameters
+        ----------
+        dataset : 'str'
+            'wind' or 'solar'
+        site_id : 'int'
+            Site id number
+        resource_type : 'str'
+            power or met or fcst
+
+        Returns
+        ---------
+        'bool'
+            Is a valid copy of the file in the local cache
+        """
+        entry = self._index.get(dataset, resource_type, site_id)
+        if entry is None:
+            return False
+
+        if self._validate:
+            file_path = entry['path']
+            if not os.path.exists(file_path):
+                logger.warning('{} was removed from cache'.format(file_path))
+                self._index.remove(dataset, resource_type, site_id)
+                return False
+
+            return self.is_valid(file_path, resource_type, entry=entry)
+
+        return True
+
+    @contextlib.contextmanager
+    def pin(self, file_paths):
+        """
+        Protect files from eviction while in use, i.e. by the current
+        request
+
+        Parameters
+        ----------
+        file_paths : 'list'
+            Paths to resource files in cache
+        """
+        file_paths = list(file_paths)
+        with self._pins_lock:
+            self._pins.update(file_paths)
+
+        try:
+            yield
+        finally:
+            with self._pins_lock:
+                self._pins.subtract(file_paths)
+                self._pins += collections.Counter()
+
+    def pin_sites(self, dataset, resource_type, site_ids):
+        """
+        Pin files in the cache, whether or not they have been downloaded, so
+        that no process evicts them until they are unpinned
+
+        Parameters
+        ----------
+        dataset : 'str'
+            'wind' or 'solar'
+        resource_type : 'str'
+            power or met or fcst
+        site_ids : 'list'
+            Site id numbers of files to pin
+        """
+        self._index.pin(dataset, resource_type, site_ids)
+
+    def unpin_sites(self, dataset=None, resource_type=None, site_ids=None):
+        """
+        Unpin files pinned by pin_sites
+
+        Parameters
+        ----------
+        dataset : 'str'
+            'wind' or 'solar', None for all datasets
+        resource_type : 'str'
+            power or met or fcst, None for all resource types
+        site_ids : 'list'
+            Site id numbers to unpin, None for all sites
+
+        Returns
+        ---------
+        'int'
+            Number of files unpinned
+        """
+        return self._index.unpin(dataset=dataset, resource_type=resource_type,
+                                 site_ids=site_ids)
+
+    @property
+    def pinned_sites(self):
+        """
+        Files pinned by pin_sites
+
+        Returns
+        ---------
+        'pandas.DataFrame'
+            Table of [dataset, resource_type, site_id, pinned_at]
+        """
+        return self._index.pins()
+
+    def evict(self, nbytes):
+        """
+        Remove unpinned files from the cache in order of the eviction policy
+        until nbytes have been freed. Files pinned by this process with pin
+        or by any process with pin_sites are kept.
+
+        Parameters
+        ----------
+        nbytes : 'int'
+            Number of bytes to free
+
+        Returns
+        ---------
+        freed : 'int'
+            Number of bytes freed
+        """
+        freed = 0
+        evicted = 0
+        with self._pins_lock:
+            pinned = set(self._pins)
+
+        for dataset, resource_type, site_id, path, size in \
+                self._index.eviction_candidates(self._eviction):
+            if freed >= nbytes:
+                break
+
+            if path in pinned:
+                continue
+
+            lock = self.lock(path)
+            if not lock.try_acquire():
+                # File is being downloaded or evicted by another process
+                continue
+
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+
+                self.remove_sidecar(path)
+                self._index.remove(dataset, resource_type, site_id)
+                self.invalidate_consolidated(dataset, resource_type,
+                                             [site_id])
+            finally:
+                lock.release()
+
+            freed += size
+            evicted += 1
+
+        logger.info('Evicted {} files ({:.2f}GB) from local cache'
+                    .format(evicted, freed / 1e9))
+
+        return freed
+
+    def test_cache_size(self, download_size):
+        """
+        Test to see if download will fit in cache, evicting files if needed
+
+        Parameters
+        ----------
+        download_size : 'float'
+            Size of requested download in GB
+        """
+        if self._size is not None:
+            cache_size = self.cache_size[0]
+            needed = cache_size + download_size - self._size
+            if needed > 0 and self._eviction is not None:
+                self.evict(needed * 1e9)
+
+            cache_size, wind_size, solar_size = self.cache_size
+            if self._size - cache_size < download_size:
+                msg = ('Not enough space available in local cache:',
+                       '\nDownload size = {:.2f}GB'.format(download_size),
+                       '\nLocal cache = {:.2f}GB of'.format(cache_size),
+                       ' {:.2f}GB in use'.format(self._size),
+                       '\n\tCached wind data = {:.2f}GB'.format(wind_size),
+                       '\n\tCached solar data = {:.2f}GB'.format(solar_size))
+                raise RuntimeError(''.join(msg))
+
+
+class ExternalDataStore(DataStore):
+    """
+    Abstract class to define interface for accessing external stores
+    of resource data.
+    """
+    # [download] config entries passed to the download engine
+    DOWNLOAD_OPTIONS = {'chunk_size': int, 'connections_per_host': int,
+                        'segments': int, 'segment_size': int,
+                        'min_concurrency': int, 'max_concurrency': int,
+                        'bandwidth': int, 'burst': int,
+                        'connect_timeout': float, 'read_timeout': float}
+    # [retry] config entries passed to RetryPolicy
+    RETRY_OPTIONS = {'attempts': int, 'backoff': float, 'max_backoff': float,
+                     'jitter': float}
+    # [circuit_breaker] config entries passed to CircuitBreaker
+    BREAKER_OPTIONS = {'failure_rate': float, 'window': int,
+                       'min_requests': int, 'reset_timeout': float}
+
+    def __init__(self, local_cache=None, threads=None, retry=None,
+                 breaker=None, **download_kwargs):
+        """
+        Initialize ExternalDataStore object
+
+        Parameters
+        ----------
+        local_cache : 'InternalDataStore'
+            InternalDataStore object represening internal data cache
+        threads : 'int'|'str'
+            Number of threads to use during downloads, 'auto' for half the
+            number of CPUs, None to download sequentially
+        retry : 'RetryPolicy'
+            Policy for retrying transient download failures, default is
+            RetryPolicy()
+        breaker : 'CircuitBreaker'
+            Circuit breaker shared by all downloads from this store, default
+            is CircuitBreaker()
+        **download_kwargs
+            Options for the download engine, see DOWNLOAD_OPTIONS
+        """
+        super(ExternalDataStore, self).__init__()
+
+        if local_cache is None:
+            local_cache = InternalDataStore.connect()
+        elif not isinstance(local_cache, InternalDataStore):
+            msg = ("Expecting local_cache to be instance of",
+                   "InternalDataStore,",
+                   "but is {:}.".format(type(local_cache)))
+            raise RuntimeError(' '.join(msg))
+
+        self._local_cache = local_cache
+
+        if threads == 'auto':
+            threads = max(multiprocessing.cpu_count() // 2, 1)
+        elif threads is not None:
+            try:
+                threads = int(threads)
+            except (TypeError, ValueError):
+                msg = ("threads must be an integer or 'auto', but is {!r}"
+                       .format(threads))
+                raise ValueError(msg)
+
+        if not threads:
+            threads = None
+
+        self._threads = threads
+        self._download_kwargs = download_kwargs
+
+        if retry is None:
+            retry = RetryPolicy()
+
+        if breaker is None:
+            breaker = CircuitBreaker()
+
+        self._retry = retry
+        self._breaker = breaker
+
+    @property
+    def metrics(self):
+        """
+        Current state of the circuit breaker
+
+        Returns
+        ---------
+        'dict'
+            breaker state, number of times it opened and number of
+            downloads it rejected
+        """
+        return {'breaker_state': self._breaker.state,
+                'breaker_opened': self._breaker.opened,
+                'breaker_rejected': self._breaker.rejected}
+
+    @classmethod
+    def connect(cls, config=None):
+        """
+        Reads the configuration. From configuration and defaults,
+        determines initializes ExternalDataStore object.
+
+        Parameters
+        ----------
+        config : 'str'
+            Path to .ini configuration file.
+            See library/config.ini for an example
+
+        Returns
+        ---------
+        'ExternalDataStore'
+            Initialized ExternalDataStore object
+        """
+        download_kwargs = {}
+        retry_kwargs = {}
+        breaker_kwargs = {}
+        if config is None:
+            threads = None
+            local_cache = None
+        else:
+            config_parser = ConfigParser(inline_comment_prefixes=('#',))
+            config_parser.read(config)
+
+            if config_parser.has_section('local_cache'):
+                local_cache = InternalDataStore.connect(config=config)
+            else:
+                local_cache = None
+
+            threads = cls.decode_config_entry(
+                config_parser.get('local_cache', 'threads', fallback=None))
+            for section, options, kwargs in (
+                    ('download', cls.DOWNLOAD_OPTIONS, download_kwargs),
+                    ('retry', cls.RETRY_OPTIONS, retry_kwargs),
+                    ('circuit_breaker', cls.BREAKER_OPTIONS, breaker_kwargs)):
+                for option, dtype in options.items():
+                    value = cls.decode_config_entry(
+                        config_parser.get(section, option, fallback=None))
+                    if value is not None:
+                        kwargs[option] = dtype(value)
+
+        return cls(local_cache=local_cache, threads=threads,
+                   retry=RetryPolicy(**retry_kwargs),
+                   breaker=CircuitBreaker(**breaker_kwargs),
+                   **download_kwargs)
+
+    def get_meta(self, dataset):
+        """
+        Get meta associated with given dataset
+
+        Parameters
+        ----------
+        dataset : 'str'
+            'wind' or 'solar'
+
+        Returns
+        ---------
+        meta : 'SiteIndex'
+            Index of resource meta
+        """
+        if dataset == 'wind':
+            meta = self.wind_meta
+        elif dataset == 'solar':
+            meta = self.solar_meta
+        else:
+            raise ValueError("Invalid dataset type, must be 'wind' or 'solar'")
+
+        return meta
+
+    def get_download_size(self, dataset, numb_sites, resource_type):
+        """
+        Estimate download size
+
+        Parameters
+        ----------
+        dataset : 'str'
+            'wind' or 'solar'
+        num_sites : 'int'
+            Number of sites to be downloaded
+        resource_type : 'str'
+            type of resource
+            wind -> ('power', 'fcst', 'met')
+            solar -> ('power', 'fcst', 'met', 'irradiance')
+        forecasts : 'bool'
+            Boolean flag as to whether forecasts will be included in the
+            download or not
+
+        Returns
+        ---------
+        download_size : 'float'
+            Estimated download size in GB
+        """
+        if dataset == 'wind':
+            download_size = numb_sites * self.WIND_FILE_SIZES[resource_type]
+        elif dataset == 'solar':
+            download_size = numb_sites * self.SOLAR_FILE_SIZES[resource_type]
+
+        return download_size / 1000
+
+    def plan_download(self, dataset, site_ids, resource_type):
+        """
+        Plan download of resource files assuming average file sizes
+
+        Parameters
+        ----------
+        dataset : 'str'
+            'wind' or 'solar'
+        site_ids : 'list'
+            List of site ids to be downloaded
+        resource_type : 'str'
+            power or met or fcst
+
+        Returns
+        ---------
+        'DownloadPlan'
+            Plan with the size and duration of the download
+        """
+        size = self.get_download_size(dataset, 1, resource_type) * 1e9
+        items = [(site_id, None,
+                  self._local_cache.get_file_path(dataset, resource_type,
+                                                  site_id), size, True)
+                 for site_id in site_ids]
+
+        return DownloadPlan(items, DownloadPlanner.DEFAULT_THROUGHPUT)
+
+    def download(self, src, dst, deadline=None):
+        """
+        Abstract method to download src to dst
+
+        Parameters
+        ----------
+        src : 'str'
+            Path or URL to src file
+        dst : 'str'
+            Path to which file should be downloaded
+        deadline : 'Deadline'
+            Deadline after which the download is abandoned
+        """
+        pass
+
+    def nearest_neighbors(self, node_collection):
+        """
+        Find the nearest neighbor resource sites for all nodes in
+        Node_collection
+
+        Parameters
+        ----------
+        node_collection : 'NodeCollection'
+            Collection of nodes for which resource sites are to be identified
+
+        Returns
+        ---------
+        nearest_nodes : 'pandas.DataFrame'
+            Dataframe with the nearest neighbor resource sites for each node
+        """
+        dataset = node_collection._dataset
+        resource_meta = self.get_meta(dataset)
+
+        if isinstance(node_collection, GeneratorNodeCollection):
+            nearest_nodes = nearest_power_nodes(node_collection,
+                                                resource_meta)
+        else:
+            nearest_nodes = nearest_met_nodes(node_collection,
+                                              resource_meta)
+
+        return nearest_nodes
+
+    def allocation_matrix(self, node_collection, dataset=None, path=None):
+        """
+        Match generator nodes to resource sites as a sparse nodes by sites
+        matrix, reusing the matrix saved at path if it is for the same nodes
+
+        Parameters
+        ----------
+        node_collection : 'GeneratorNodeCollection'|'pandas.DataFrame'
+            Collection of generator nodes, or DataFrame of:
+                [node_id(index), latitude, longitude, capacity]
+        dataset : 'str'
+            'wind' or 'solar', required if node_collection is a DataFrame
+        path : 'str'
+            Path to .npz file to save the matrix to, None to not save it
+
+        Returns
+        ---------
+        allocation : 'AllocationMatrix'
+            Fraction of each resource site applied to each node
+        """
+        if isinstance(node_collection, GeneratorNodeCollection):
+            dataset = node_collection._dataset
+            node_ids = node_collection.node_data.index.values
+        else:
+            node_ids = node_collection.index.values
+
+        if dataset is None:
+            raise ValueError("dataset must be 'wind' or 'solar' when nodes "
+                             "are given as a DataFrame")
+
+        if path is not None and os.path.exists(path):
+            allocation = AllocationMatrix.load(path)
+            if np.array_equal(allocation.node_ids.astype(str),
+                              node_ids.astype(str)):
+                return allocation
+
+            logger.info('Nodes do not match allocation matrix {}, matching '
+                        'them again'.format(path))
+
+        _, allocation = allocate_power_nodes(node_collection,
+                                             self.get_meta(dataset))
+        if path is not None:
+            allocation.save(path)
+
+        return allocation
+
+    def download_resource(self, dataset, site_id, resource_type,
+                          deadline=None):
+        """
+        Download the resource site file from repository
+
+        Parameters
+        ----------
+        dataset : 'str'
+            'wind' or 'solar'
+        site_ids : 'list'
+            List of site ids to be downloaded
+        resource_type : 'str'
+            power or met or fcst
+        deadline : 'Deadline'
+            Deadline after which the download is abandoned
+        """
+        pass
+
+    def _download_site(self, dataset, site_id, resource_type, deadline):
+        """
+        Download a single resource site file while holding its cache lock,
+        unless another thread or process downloaded it first, and record
+        the outcome. The deadline is checked while waiting for the lock and
+        before each attempt, and is passed on to download_resource, so that
+        downloads running when it expires stop instead of finishing in the
+        background.
+
+        Parameters
+        ----------
+        dataset : 'str'
+            'wind' or 'solar'
+        site_id : 'int'
+            Site id to be downloaded
+        resource_type : 'str'
+            power or met or fcst
+        deadline : 'Deadline'
+            Deadline after which the download is abandoned
+
+        Returns
+        ---------
+        'DownloadResult'
+            Result of download
+        """
+        dst = self._local_cache.get_file_path(dataset, resource_type, site_id)
+        start = time.monotonic()
+        lock = self._local_cache.lock(dst)
+        if not lock.acquire(timeout=deadline.remaining):
+            return self._timed_out(dataset, site_id, resource_type, deadline)
+
+        try:
+            if os.path.exists(dst):
+                self._local_cache.add_files([dst])
+                return DownloadResult(site_id, None, dst, success=True,
+                                      size=os.path.getsize(dst),
+                                      latency=time.monotonic() - start,
+                                      cached=True)
+
+            _, error, attempts = self._retry.call(
+                functools.partial(self.download_resource, dataset, site_id,
+                                  resource_type, deadline=deadline),
+                breaker=self._breaker, deadline=deadline,
+                name='{} site {}'.format(dataset, site_id))
+            if error is not None:
+                if not isinstance(error, (CircuitOpenError, TimeoutError)):
+                    logger.warning('Unable to download {} site {}: {}'
+                                   .format(dataset, site_id, error))
+
+                return DownloadResult(site_id, None, dst, error=error,
+                                      latency=time.monotonic() - start,
+                                      attempts=attempts)
+
+            self._local_cache.add_files([dst])
+        finally:
+            lock.release()
+
+        size = os.path.getsize(dst) if os.path.exists(dst) else 0
+        return DownloadResult(site_id, None, dst, success=True, size=size,
+                              latency=time.monotonic() - start,
+                              attempts=attempts)
+
+    def download_resource_data(self, dataset, site_ids, resource_type,
+                               deadline=None, plan=None):
+        """
+        Download resource files from repository
+
+        Parameters
+        ----------
+        dataset : 'str'
+            'wind' or 'solar'
+        site_ids : 'list'
+            List of site ids to be downloaded
+        resource_type : 'str'
+            power or met
+        deadline : 'Deadline'
+            Deadline after which sites not yet downloaded are reported as
+            failed
+        plan : 'DownloadPlan'
+            Plan of the download of site_ids, planned if None
+
+        Returns
+        ---------
+        report : 'DownloadReport'
+            Report of the download result for each site
+        """
+        if plan is None:
+            plan = self.plan_download(dataset, site_ids, resource_type)
+
+        self._local_cache.test_cache_size(plan.size)
+        site_ids = [site for site, _, _ in plan.downloads]
+
+        if deadline is None:
+            deadline = Deadline()
+
+        report = DownloadReport()
+        if self._threads is None:
+            logger.debug("Downloading sequentially")
+            for site in site_ids:
+                if deadline.expired:
+                    report.add(self._timed_out(dataset, site, resource_type,
+                                               deadline))
+                else:
+                    report.add(self._download_site(dataset, site,
+                                                   resource_type, deadline))
+        else:
+            logger.debug("Downloading using {} threads".format(self._threads))
+            with cf.ThreadPoolExecutor(max_workers=self._threads) as executor:
+                futures = {executor.submit(self._download_site, dataset,
+                                           site, resource_type, deadline):
+                           site for site in site_ids}
+                done, pending = cf.wait(futures, timeout=deadline.remaining)
+                # Running downloads see the deadline has passed and stop,
+                # those not yet started are dropped
+                for future in pending:
+                    future.cancel()
+
+            for future, site in futures.items():
+                if future in done or not future.cancelled():
+                    report.add(future.result())
+                else:
+                    report.add(self._timed_out(dataset, site, resource_type,
+                                               deadline))
+
+        return report
+
+    def _timed_out(self, dataset, site_id, resource_type, deadline):
+        """
+        Record a site that was not downloaded before the deadline
+
+        Parameters
+        ----------
+        dataset : 'str'
+            'wind' or 'solar'
+        site_id : 'int'
+            Site id that was not downloaded
+        resource_type : 'str'
+            power or met or fcst
+        deadline : 'Deadline'
+            Deadline that expired
+
+        Returns
+        ---------
+        'DownloadResult'
+            Failed result of download
+        """
+        dst = self._local_cache.get_file_path(dataset, resource_type, site_id)
+        error = TimeoutError('Deadline of {} seconds exceeded!'
+                             .format(deadline.sec))
+        return DownloadResult(site_id, None, dst, error=error)
+
+    def get_node_resource(self, dataset, site_id, frac=None):
+        """
+        Initialize and return Resource class object for specified resource site
+
+        Parameters
+        ----------
+        dataset : 'str'
+            'wind' or 'solar'
+        site_id : int
+            Resource site_id
+        frac : 'float'
+            Fraction of resource to use from resource site
+
+        Returns
+        ---------
+        'Resource'
             Wind or Solar Resource class instance
         """
         cache = self._local_cache.check_cache(dataset, site_id)
         if cache:
+            roots = self._local_cache.get_roots(dataset, site_id)
             if dataset == 'wind':
-                return WindResource(self.wind_meta.loc[site_id],
-                                    self._local_cache._wind_root, frac=frac)
+                return WindResource(self.wind_meta.get_site(site_id), roots,
+                                    frac=frac)
             elif dataset == 'solar':
-                return SolarResource(self.solar_meta.loc[site_id],
-                                     self._local_cache._solar_root, frac=frac)
+                return SolarResource(self.solar_meta.get_site(site_id),
+                                     roots, frac=frac)
             else:
                 msg = "Invalid dataset type, must be 'wind' or 'solar'"
                 raise ValueError(msg)
@@ -695,28 +1979,55 @@ class ExternalDataStore(DataStore):
             raise RuntimeError('{d} site {s} is not in local cache!'
                                .format(d=dataset, s=site_id))
 
-    def get_resource(self, node_collection, forecasts=False):
+    def repair_cache(self, report, deadline=None):
         """
-        Finds nearest nodes, caches files to local datastore and assigns
-        resource to node_collection
+        Quarantine the invalid files of a verify report and download them
+        again
 
         Parameters
         ----------
-        node_collection : 'NodeCollection'
-            Collection of either weather of generator nodes
-        forecasts : 'bool'
-            Whether to download forecasts along with power data
+        report : 'pandas.DataFrame'
+            Report returned by InternalDataStore.verify
+        deadline : 'Deadline'
+            Deadline after which outstanding downloads are abandoned
 
         Returns
         ---------
+        download_report : 'DownloadReport'
+            Report of the download result for each repaired file
+        """
+        repaired = self._local_cache.repair(report)
+        download_report = DownloadReport()
+        for (dataset, resource_type), files in \
+                repaired.groupby(['dataset', 'resource_type']):
+            download_report.update(self.download_resource_data(
+                dataset, files['site_id'].tolist(), resource_type,
+                deadline=deadline))
+
+        return download_report
+
+    @staticmethod
+    def get_site_ids(node_collection, nearest_nodes, forecasts=False):
+        """
+        Resource type and sites needed by a node collection
+
+        Parameters
+        ----------
         node_collection : 'NodeCollection'
-            Node collection with resources assigned to nodes
+            Collection of either weather of generator nodes
         nearest_nodes : 'pandas.DataFrame'
             DataFrame of the nearest neighbor matching between nodes
             and resources
-        """
-        nearest_nodes = self.nearest_neighbors(node_collection)
+        forecasts : 'bool'
+            Whether generator nodes need forecasts rather than power data
 
+        Returns
+        ---------
+        resource_type : 'str'
+            power or met or fcst
+        site_ids : 'numpy.ndarray'
+            Site ids needed by nodes
+        """
         if isinstance(node_collection, GeneratorNodeCollection):
             if forecasts:
                 resource_type = 'fcst'
@@ -729,22 +2040,178 @@ class ExternalDataStore(DataStore):
             resource_type = 'met'
             site_ids = nearest_nodes['site_id'].values
 
+        return resource_type, site_ids
+
+    def cache_sites(self, dataset, site_ids, resource_type,
+                    retry_failed=True, deadline=None):
+        """
+        Download the sites that are not already cached, protecting the
+        cached ones from eviction meanwhile, and record their access
+
+        Parameters
+        ----------
+        dataset : 'str'
+            'wind' or 'solar'
+        site_ids : 'list'
+            Site ids needed
+        resource_type : 'str'
+            power or met or fcst
+        retry_failed : 'bool'
+            Whether to retry failed downloads once
+        deadline : 'Deadline'
+            Deadline after which outstanding downloads are abandoned
+
+        Returns
+        ---------
+        report : 'DownloadReport'
+            Report of the download result for each site not already cached
+        hits : 'int'
+            Number of sites already cached
+        """
+        if deadline is None:
+            deadline = Deadline()
+
         # download sites not already in local cache
-        dataset = node_collection._dataset
         to_download = [site_id for site_id in site_ids if not self._local_cache.check_cache(dataset, site_id, resource_type=resource_type)]
         logger.debug("Trying to download {} of the {} sites requested for dataset {}, resource {}".format(
             len(to_download), len(site_ids), dataset, resource_type))
-        self.download_resource_data(dataset, to_download, resource_type)
+        # Files already cached for this request must not be evicted to make
+        # space for the rest
+        pinned = [self._local_cache.get_file_path(dataset, resource_type,
+                                                  site_id)
+                  for site_id in site_ids]
+        with self._local_cache.pin(pinned):
+            # Sizes are looked up once for the request, retries reuse them
+            plan = self.plan_download(dataset, to_download, resource_type)
+            report = self.download_resource_data(dataset, to_download,
+                                                 resource_type,
+                                                 deadline=deadline,
+                                                 plan=plan)
+            logger.debug('{} with {} retries, {}'
+                         .format(report, report.retries, self.metrics))
+            if report.failed and retry_failed and not deadline.expired:
+                logger.debug("Retrying {} failed downloads"
+                             .format(len(report.failed)))
+                report.update(self.download_resource_data(
+                    dataset, report.failed, resource_type,
+                    deadline=deadline, plan=plan.subset(report.failed)))
+
+            if self._local_cache._promote:
+                self._local_cache.promote(dataset, resource_type, site_ids)
+
+        self._local_cache.touch(dataset, resource_type, site_ids)
+
+        return report, len(site_ids) - len(to_download)
+
+    def warm_up(self, node_collection, forecasts=False, pin=True,
+                retry_failed=True, timeout=None):
+        """
+        Download everything node_collection needs into the local cache,
+        without extracting or shaping any data, so that later runs only
+        read from the cache
+
+        Parameters
+        ----------
+        node_collection : 'NodeCollection'
+            Collection of either weather of generator nodes
+        forecasts : 'bool'
+            Whether generator nodes need forecasts rather than power data
+        pin : 'bool'
+            Pin the files in the local cache so that they are not evicted
+            until unpinned, see InternalDataStore.unpin_sites
+        retry_failed : 'bool'
+            Whether to retry failed downloads once
+        timeout : 'float'
+            Seconds allowed for all downloads, None to wait indefinitely
+
+        Returns
+        ---------
+        summary : 'dict'
+            Number of sites needed, cache hits, sites downloaded and failed,
+            bytes fetched and elapsed seconds, with the DownloadReport
+        """
+        start = time.monotonic()
+        deadline = Deadline(timeout)
+        nearest_nodes = self.nearest_neighbors(node_collection)
+        resource_type, site_ids = self.get_site_ids(node_collection,
+                                                    nearest_nodes,
+                                                    forecasts=forecasts)
+        dataset = node_collection._dataset
+        if pin:
+            # Pinned before downloading so that files fetched early are not
+            # evicted to make space for the rest
+            self._local_cache.pin_sites(dataset, resource_type, site_ids)
+
+        report, hits = self.cache_sites(dataset, site_ids, resource_type,
+                                        retry_failed=retry_failed,
+                                        deadline=deadline)
+        summary = {'dataset': dataset, 'resource_type': resource_type,
+                   'sites': len(site_ids), 'hits': hits,
+                   'downloaded': len(report.succeeded),
+                   'failed': len(report.failed), 'bytes': report.bytes,
+                   'elapsed': time.monotonic() - start, 'report': report}
+        logger.info('Warmed up {} {} sites: {} cached, {} downloaded '
+                    '({:.2f}GB), {} failed in {:.1f}s'
+                    .format(summary['sites'], dataset, hits,
+                            summary['downloaded'], report.bytes / 1e9,
+                            summary['failed'], summary['elapsed']))
+
+        return summary
+
+    def get_resource(self, node_collection, forecasts=False,
+                     retry_failed=True, timeout=None):
+        """
+        Finds nearest nodes, caches files to local datastore and assigns
+        resource to node_collection
 
-        self._local_cache.update_cache_meta(dataset)
+        Parameters
+        ----------
+        node_collection : 'NodeCollection'
+            Collection of either weather of generator nodes
+        forecasts : 'bool'
+            Whether to download forecasts along with power data
+        retry_failed : 'bool'
+            Whether to retry failed downloads once before failing
+        timeout : 'float'
+            Seconds allowed for all downloads, after which outstanding
+            downloads are cancelled and a TimeoutError carrying the partial
+            DownloadReport is raised. None to wait indefinitely.
 
+        Returns
+        ---------
+        node_collection : 'NodeCollection'
+            Node collection with resources assigned to nodes
+        nearest_nodes : 'pandas.DataFrame'
+            DataFrame of the nearest neighbor matching between nodes
+            and resources
+        """
+        deadline = Deadline(timeout)
+        nearest_nodes = self.nearest_neighbors(node_collection)
+        resource_type, site_ids = self.get_site_ids(node_collection,
+                                                    nearest_nodes,
+                                                    forecasts=forecasts)
+        dataset = node_collection._dataset
+        report, _ = self.cache_sites(dataset, site_ids, resource_type,
+                                     retry_failed=retry_failed,
+                                     deadline=deadline)
+        if report.failed and deadline.expired:
+            msg = ('Deadline of {} seconds exceeded with {} of {} sites '
+                   'downloaded'.format(timeout, len(report.succeeded),
+                                       len(report)))
+            raise TimeoutError(msg, report=report)
+
+        report.raise_for_failures()
+
+        # Sites packed by InternalDataStore.consolidate are read together
+        stores = self._local_cache.get_consolidated(dataset)
         resources = []
         for _, meta in nearest_nodes.iterrows():
             site_id = meta['site_id']
             if isinstance(site_id, list):
                 fracs = meta['site_fracs']
                 r = ResourceList([self.get_node_resource(dataset, site, frac=f)
-                                  for site, f in zip(site_id, fracs)])
+                                  for site, f in zip(site_id, fracs)],
+                                 stores=stores)
             else:
                 r = self.get_node_resource(dataset, site_id)
 
@@ -763,8 +2230,90 @@ class DRPower(ExternalDataStore):
     Class object for External DataStore at DR Power (egrid.org)
     """
     DATA_ROOT = 'https://dtn2.pnl.gov/drpower'
+    # File in the local cache memoizing the size of DR Power files
+    SIZES_MEMO = 'drpower_sizes.json'
+
+    def __init__(self, local_cache=None, threads=None, retry=None,
+                 breaker=None, **download_kwargs):
+        """
+        Initialize DRPower object
+
+        Parameters
+        ----------
+        local_cache : 'InternalDataStore'
+            InternalDataStore object represening internal data cache
+        threads : 'int'|'str'
+            Number of concurrent downloads, 'auto' for half the number of
+            CPUs. This is the initial number if min_concurrency or
+            max_concurrency are set in download_kwargs.
+        retry : 'RetryPolicy'
+            Policy for retrying transient download failures
+        breaker : 'CircuitBreaker'
+            Circuit breaker stopping downloads while DR Power is failing
+        **download_kwargs
+            Options for AsyncDownloader, see DOWNLOAD_OPTIONS
+        """
+        super(DRPower, self).__init__(local_cache=local_cache,
+                                      threads=threads, retry=retry,
+                                      breaker=breaker, **download_kwargs)
+        self._downloader = AsyncDownloader(
+            concurrency=self._threads,
+            validator=self._local_cache.validate_download,
+            lock_factory=self._local_cache.lock,
+            retry=self._retry, breaker=self._breaker,
+            **self._download_kwargs)
+        memo_path = os.path.join(self._local_cache._cache_root,
+                                 self.SIZES_MEMO)
+        self._planner = DownloadPlanner(
+            memo_path=memo_path,
+            concurrency=self._download_kwargs.get('connections_per_host'),
+            bandwidth=self._download_kwargs.get('bandwidth'),
+            connect_timeout=self._download_kwargs.get('connect_timeout'),
+            read_timeout=self._download_kwargs.get('read_timeout'),
+            lock_factory=self._local_cache.lock)
+
+    @property
+    def metrics(self):
+        """
+        Current state of the download engine
+
+        Returns
+        ---------
+        'dict'
+            concurrency limit, breaker state, number of times it opened and
+            number of downloads it rejected
+        """
+        return self._downloader.metrics
+
+    def close(self):
+        """
+        Close the connections to DR Power held by the download engine
+        """
+        self._downloader.close()
+        self._planner.close()
+
+    def get_resource_url(self, dataset, site_id, resource_type):
+        """
+        URL of resource site file on DR Power
+
+        Parameters
+        ----------
+        dataset : 'str'
+            'wind' or 'solar'
+        site_id : 'int'
+            Site id number
+        resource_type : 'str'
+            power or met or fcst
+
+        Returns
+        ---------
+        'str'
+            URL of resource site file
+        """
+        file_name = '{}_{}_{}.hdf5'.format(dataset, resource_type, site_id)
+        return '/'.join([self.DATA_ROOT, dataset, str(site_id), file_name])
 
-    def download(self, src, dst):
+    def download(self, src, dst, deadline=None):
         """
         Download resource data from src URL to dst file path
 
@@ -774,14 +2323,43 @@ class DRPower(ExternalDataStore):
             URL of resource data to be downloaded
         dst : 'str'
             Destination path of resource data (including file name)
+        deadline : 'Deadline'
+            Deadline after which the download is cancelled, keeping the
+            partial file to be resumed
         """
-        logger.debug("Downloading to {} ...".format(dst))
-        urlretrieve(src, dst)
+        report = self._downloader.download([(dst, src, dst)],
+                                           deadline=deadline)
+        report.raise_for_failures()
 
-    def download_resource(self, dataset, site_id, resource_type):
+    def download_resource(self, dataset, site_id, resource_type,
+                          deadline=None):
         """
         Download the resource site file from repo and add site to cache meta
 
+        Parameters
+        ----------
+        dataset : 'str'
+            'wind' or 'solar'
+        site_id : 'int'
+            Site id to be downloaded
+        resource_type : 'str'
+            power or met or fcst
+        deadline : 'Deadline'
+            Deadline after which the download is cancelled
+        """
+        src = self.get_resource_url(dataset, site_id, resource_type)
+        dst = self._local_cache.get_file_path(dataset, resource_type, site_id)
+        logger.debug("Prepared to download {} from DR Power".format(src))
+
+        self.download(src, dst, deadline=deadline)
+        self._local_cache.add_files([dst])
+
+    def download_resource_data(self, dataset, site_ids, resource_type,
+                               deadline=None, plan=None):
+        """
+        Download resource files from DR Power using the asyncio download
+        engine
+
         Parameters
         ----------
         dataset : 'str'
@@ -790,10 +2368,58 @@ class DRPower(ExternalDataStore):
             List of site ids to be downloaded
         resource_type : 'str'
             power or met or fcst
+        deadline : 'Deadline'
+            Deadline after which outstanding downloads are cancelled
+        plan : 'DownloadPlan'
+            Plan of the download of site_ids, planned if None
+
+        Returns
+        ---------
+        'DownloadReport'
+            Report of the download result for each site
         """
-        file_name = '{}_{}_{}.hdf5'.format(dataset, resource_type, site_id)
-        src = '/'.join([self.DATA_ROOT, dataset, str(site_id), file_name])
-        dst = os.path.join(self._local_cache._cache_root, dataset, file_name)
-        logger.debug("Prepared to download {} from DR Power".format(src))
+        if plan is None:
+            plan = self.plan_download(dataset, site_ids, resource_type)
+
+        self._local_cache.test_cache_size(plan.size)
 
-        self.download(src, dst)
+        logger.debug("Downloading {} with {}".format(plan, self._downloader))
+        start = time.monotonic()
+        report = self._downloader.download(plan.downloads, deadline=deadline)
+        elapsed = time.monotonic() - start
+        self._local_cache.add_files([result.dst for result in report
+                                     if result.success])
+        self._planner.record(report, elapsed)
+        logger.debug("Downloaded {:.2f}GB in {:.0f}s"
+                     .format(report.bytes / 1e9, elapsed))
+
+        return report
+
+    def plan_download(self, dataset, site_ids, resource_type):
+        """
+        Plan download of resource files from their size on DR Power, looked
+        up with concurrent HEAD requests and memoized in the local cache
+
+        Parameters
+        ----------
+        dataset : 'str'
+            'wind' or 'solar'
+        site_ids : 'list'
+            List of site ids to be downloaded
+        resource_type : 'str'
+            power or met or fcst
+
+        Returns
+        ---------
+        'DownloadPlan'
+            Plan with the size and duration of the download, largest files
+            first
+        """
+        downloads = [(site_id,
+                      self.get_resource_url(dataset, site_id, resource_type),
+                      self._local_cache.get_file_path(dataset, resource_type,
+                                                      site_id))
+                     for site_id in site_ids]
+        default_size = self.get_download_size(dataset, 1, resource_type) * 1e9
+
+        return self._planner.plan(downloads, default_size=default_size)
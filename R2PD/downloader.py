@@ -0,0 +1,1073 @@
+"""
+This module provides an asyncio download engine with bounded concurrency
+and per-site reporting of download results. Files are downloaded to .part
+files with a journal of completed byte ranges so that interrupted downloads
+can be resumed with HTTP Range requests.
+"""
+import asyncio
+from collections import OrderedDict
+import functools
+import json
+import logging
+import os
+import re
+import threading
+import time
+import weakref
+
+import pandas as pds
+
+from R2PD.bandwidth import TokenBucket
+from R2PD import httpclient
+from R2PD.Timeout import TimeoutError
+from R2PD.concurrency import ConcurrencyController, ConcurrencyLimiter
+from R2PD.retry import CircuitOpenError, RetryPolicy
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadResult(object):
+    """
+    Outcome of downloading a single resource file
+    """
+    def __init__(self, key, src, dst, success=False, size=0, latency=None,
+                 error=None, cached=False, attempts=1):
+        """
+        Initialize DownloadResult
+
+        Parameters
+        ----------
+        key : 'int'|'str'
+            Identifier of the download, typically the site id
+        src : 'str'
+            URL of the file
+        dst : 'str'
+            Destination path of the file
+        success : 'bool'
+            Whether the download succeeded
+        size : 'int'
+            Number of bytes written to dst
+        latency : 'float'
+            Time in seconds taken by the download
+        error : 'Exception'
+            Error raised by a failed download
+        cached : 'bool'
+            Whether the file was downloaded by another thread or process
+            while waiting for its lock
+        attempts : 'int'
+            Number of attempts made
+        """
+        self.key = key
+        self.src = src
+        self.dst = dst
+        self.success = success
+        self.size = size
+        self.latency = latency
+        self.error = error
+        self.cached = cached
+        self.attempts = attempts
+
+    def __repr__(self):
+        """
+        Print the key and outcome of the download
+
+        Returns
+        ---------
+        'str'
+            key and outcome of download
+        """
+        if self.cached:
+            outcome = 'cached by another process'
+        elif self.success:
+            outcome = '{} bytes in {:.2f}s'.format(self.size, self.latency)
+        else:
+            outcome = 'failed: {}'.format(self.error)
+
+        return '{n} for {k} {o}'.format(n=self.__class__.__name__,
+                                        k=self.key, o=outcome)
+
+
+class DownloadReport(object):
+    """
+    Collection of DownloadResults for a batch of downloads
+    """
+    def __init__(self, results=None):
+        """
+        Initialize DownloadReport
+
+        Parameters
+        ----------
+        results : 'list'
+            List of DownloadResult objects
+        """
+        self._results = OrderedDict()
+        if results is not None:
+            for result in results:
+                self.add(result)
+
+    def __len__(self):
+        """
+        Return number of downloads in report
+
+        Returns
+        ---------
+        'int'
+            Number of downloads
+        """
+        return len(self._results)
+
+    def __iter__(self):
+        """
+        Iterate over DownloadResults in report
+        """
+        return iter(self._results.values())
+
+    def __getitem__(self, key):
+        """
+        Extract DownloadResult for key
+
+        Parameters
+        ----------
+        key : 'int'|'str'
+            Identifier of the download
+
+        Returns
+        ---------
+        'DownloadResult'
+            Result of download
+        """
+        return self._results[key]
+
+    def __repr__(self):
+        """
+        Print the number of successful and failed downloads
+
+        Returns
+        ---------
+        'str'
+            Summary of report
+        """
+        return '{n} with {s} succeeded and {f} failed'.format(
+            n=self.__class__.__name__, s=len(self.succeeded),
+            f=len(self.failed))
+
+    def add(self, result):
+        """
+        Add DownloadResult to report, replacing any previous result
+        with the same key
+
+        Parameters
+        ----------
+        result : 'DownloadResult'
+            Result of download
+        """
+        self._results[result.key] = result
+
+    def update(self, report):
+        """
+        Update report with the results of another report, i.e. a retry
+
+        Parameters
+        ----------
+        report : 'DownloadReport'
+            Report whose results should replace those in this report
+        """
+        for result in report:
+            self.add(result)
+
+    @property
+    def succeeded(self):
+        """
+        Keys of successful downloads
+
+        Returns
+        ---------
+        'list'
+            Keys of successful downloads
+        """
+        return [r.key for r in self if r.success]
+
+    @property
+    def failed(self):
+        """
+        Keys of failed downloads
+
+        Returns
+        ---------
+        'list'
+            Keys of failed downloads
+        """
+        return [r.key for r in self if not r.success]
+
+    @property
+    def cached(self):
+        """
+        Keys of files downloaded by another thread or process
+
+        Returns
+        ---------
+        'list'
+            Keys of files found in cache once their lock was acquired
+        """
+        return [r.key for r in self if r.cached]
+
+    @property
+    def bytes(self):
+        """
+        Total number of bytes downloaded
+
+        Returns
+        ---------
+        'int'
+            Total bytes downloaded
+        """
+        return sum(r.size for r in self if not r.cached)
+
+    @property
+    def retries(self):
+        """
+        Total number of retried attempts
+
+        Returns
+        ---------
+        'int'
+            Attempts beyond the first of each download
+        """
+        return sum(max(r.attempts - 1, 0) for r in self)
+
+    def to_frame(self):
+        """
+        Convert report to a DataFrame
+
+        Returns
+        ---------
+        'pandas.DataFrame'
+            Table of [key(index), success, cached, bytes, latency, attempts,
+            error, src, dst]
+        """
+        columns = ['success', 'cached', 'bytes', 'latency', 'attempts',
+                   'error', 'src', 'dst']
+        rows = [(r.key, r.success, r.cached, r.size, r.latency, r.attempts,
+                 None if r.error is None else str(r.error), r.src, r.dst)
+                for r in self]
+        report = pds.DataFrame(rows, columns=['key'] + columns)
+
+        return report.set_index('key')
+
+    def raise_for_failures(self):
+        """
+        Raise RuntimeError summarizing any failed downloads
+        """
+        failed = [r for r in self if not r.success]
+        if failed:
+            msg = ['{} of {} downloads failed:'.format(len(failed), len(self))]
+            msg += ['\n\t{}: {}'.format(r.src, r.error) for r in failed[:10]]
+            if len(failed) > 10:
+                msg.append('\n\t...')
+
+            raise RuntimeError(''.join(msg))
+
+
+class EventLoopThread(object):
+    """
+    Event loop running in a daemon thread, on which other threads run
+    coroutines. Unlike asyncio.run the loop outlives each coroutine, so the
+    connections pooled on it can be reused by later calls. The loop is
+    started on first use in each process, which also makes it safe to use
+    where an event loop is already running, i.e. in a Jupyter notebook.
+    """
+    def __init__(self, name='R2PD-event-loop'):
+        """
+        Initialize EventLoopThread
+
+        Parameters
+        ----------
+        name : 'str'
+            Name of the thread running the loop
+        """
+        self._name = name
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._pid = None
+
+    def __repr__(self):
+        """
+        Print the type of loop and its thread
+
+        Returns
+        ---------
+        'str'
+            type of loop and name of its thread
+        """
+        return '{n} {t}'.format(n=self.__class__.__name__, t=self._name)
+
+    def _start(self):
+        """
+        Start the loop unless it is running in this process
+
+        Returns
+        ---------
+        'asyncio.AbstractEventLoop'
+            Running event loop
+        """
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever,
+                                                name=self._name, daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+            return self._loop
+
+    def run(self, coro):
+        """
+        Run coroutine on the loop, blocking until it completes. The
+        coroutine is cancelled if the calling thread is interrupted.
+
+        Parameters
+        ----------
+        coro : 'coroutine'
+            Coroutine to run
+
+        Returns
+        ---------
+        'object'
+            Result of coroutine
+        """
+        loop = self._start()
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError('{} cannot block on a coroutine from its own '
+                               'thread'.format(self))
+
+        future = asyncio.run_coroutine_threadsafe(coro, loop)
+        try:
+            return future.result()
+        except BaseException:
+            future.cancel()
+            raise
+
+    def close(self, *callbacks):
+        """
+        Stop the loop once callbacks have run on it
+
+        Parameters
+        ----------
+        *callbacks
+            Functions called without arguments on the loop before it stops,
+            i.e. to close the connections opened on it
+        """
+        with self._lock:
+            loop, thread, pid = self._loop, self._thread, self._pid
+            self._loop = self._thread = self._pid = None
+
+        if loop is None or pid != os.getpid():
+            # Connections of a loop that never ran in this process are
+            # left to be garbage collected
+            return
+
+        for callback in callbacks:
+            loop.call_soon_threadsafe(callback)
+
+        loop.call_soon_threadsafe(loop.stop)
+        if thread is not threading.current_thread():
+            thread.join()
+            loop.close()
+
+
+class PartialDownload(object):
+    """
+    Partially downloaded file and its journal of completed byte ranges.
+    Data is written to '{dst}.part' and the journal to '{dst}.part.json'
+    """
+    # Bytes written between journal updates
+    JOURNAL_INTERVAL = 2 ** 20
+
+    def __init__(self, src, dst):
+        """
+        Initialize PartialDownload, loading the journal of a previous attempt
+        at downloading src to dst if present
+
+        Parameters
+        ----------
+        src : 'str'
+            URL of file being downloaded
+        dst : 'str'
+            Destination path of file
+        """
+        self.src = src
+        self.dst = dst
+        self.path = dst + '.part'
+        self._journal = self.path + '.json'
+        self.size = None
+        self.validator = None
+        self.ranges = []
+        self._unsaved = 0
+        self.load()
+
+    def __repr__(self):
+        """
+        Print destination and progress of download
+
+        Returns
+        ---------
+        'str'
+            destination and bytes completed
+        """
+        return '{n} of {d} ({c} of {s} bytes)'.format(
+            n=self.__class__.__name__, d=self.dst, c=self.completed,
+            s=self.size)
+
+    @property
+    def completed(self):
+        """
+        Number of bytes downloaded
+
+        Returns
+        ---------
+        'int'
+            Bytes in completed ranges
+        """
+        return sum(end - start for start, end in self.ranges)
+
+    @property
+    def missing_ranges(self):
+        """
+        Byte ranges still to be downloaded
+
+        Returns
+        ---------
+        missing : 'list'
+            List of [start, end) byte ranges, None if the size is unknown
+        """
+        if self.size is None:
+            return None
+
+        missing = []
+        pos = 0
+        for start, end in self.ranges:
+            if start > pos:
+                missing.append((pos, start))
+
+            pos = max(pos, end)
+
+        if pos < self.size:
+            missing.append((pos, self.size))
+
+        return missing
+
+    def load(self):
+        """
+        Load journal of a previous attempt, discarding it if it is for a
+        different src or the size of the file was not known
+        """
+        if os.path.exists(self._journal) and os.path.exists(self.path):
+            try:
+                with open(self._journal) as f:
+                    journal = json.load(f)
+            except ValueError:
+                journal = {}
+
+            if journal.get('src') == self.src and journal.get('size'):
+                self.size = journal['size']
+                self.validator = journal.get('validator')
+                self.ranges = [tuple(r) for r in journal['ranges']]
+                logger.debug('Resuming {}'.format(self))
+
+    def save(self):
+        """
+        Atomically write journal to disk
+        """
+        journal = {'src': self.src, 'size': self.size,
+                   'validator': self.validator,
+                   'ranges': [list(r) for r in self.ranges]}
+        tmp = self._journal + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(journal, f)
+
+        os.replace(tmp, self._journal)
+        self._unsaved = 0
+
+    def reset(self, size=None, validator=None):
+        """
+        Discard any downloaded data and start again
+
+        Parameters
+        ----------
+        size : 'int'
+            Size of file if known
+        validator : 'str'
+            ETag or Last-Modified header identifying the version of the file
+        """
+        self.size = size
+        self.validator = validator
+        self.ranges = []
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)),
+                    exist_ok=True)
+        with open(self.path, 'wb') as f:
+            if size is not None:
+                f.truncate(size)
+
+    def add_range(self, start, end):
+        """
+        Record that bytes [start, end) have been written to disk
+
+        Parameters
+        ----------
+        start : 'int'
+            First byte written
+        end : 'int'
+            One past the last byte written
+        """
+        ranges = []
+        for r_start, r_end in sorted(self.ranges + [(start, end)]):
+            if ranges and r_start <= ranges[-1][1]:
+                ranges[-1] = (ranges[-1][0], max(ranges[-1][1], r_end))
+            else:
+                ranges.append((r_start, r_end))
+
+        self.ranges = ranges
+        self._unsaved += end - start
+
+    @property
+    def needs_save(self):
+        """
+        Whether enough data has been written to update the journal
+
+        Returns
+        ---------
+        'bool'
+            True if JOURNAL_INTERVAL bytes have been written since last save
+        """
+        return self._unsaved >= self.JOURNAL_INTERVAL
+
+    def commit(self):
+        """
+        Atomically move completed .part file to dst and remove journal
+        """
+        os.replace(self.path, self.dst)
+        if os.path.exists(self._journal):
+            os.remove(self._journal)
+
+    def discard(self):
+        """
+        Remove .part file and journal
+        """
+        for path in (self.path, self._journal):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def parse_content_range(content_range):
+    """
+    Parse Content-Range header of a 206 response
+
+    Parameters
+    ----------
+    content_range : 'str'
+        Header value, i.e. 'bytes 0-99/1000'
+
+    Returns
+    ---------
+    start : 'int'
+        First byte of response body
+    end : 'int'
+        One past the last byte of response body
+    size : 'int'
+        Size of complete file, None if unknown
+    """
+    match = re.match(r'bytes (\d+)-(\d+)/(\d+|\*)', content_range)
+    if match is None:
+        raise ValueError('Invalid Content-Range: {}'.format(content_range))
+
+    start, end, size = match.groups()
+    size = None if size == '*' else int(size)
+
+    return int(start), int(end) + 1, size
+
+
+class AsyncDownloader(object):
+    """
+    asyncio download engine that streams files to disk with a bounded number
+    of concurrent requests. Downloads run on an event loop owned by the
+    downloader, whose pool of connections is kept for its lifetime, so
+    that later downloads reuse the connections of earlier ones. Call close
+    to close them once the downloader is no longer needed.
+    """
+    CHUNK_SIZE = 2 ** 16
+    SEGMENT_SIZE = 2 ** 22
+    LOCK_POLL_INTERVAL = 0.1
+
+    def __init__(self, concurrency=None, chunk_size=None,
+                 connections_per_host=None, keep_alive=True, segments=1,
+                 segment_size=None, validator=None, lock_factory=None,
+                 min_concurrency=None, max_concurrency=None, bandwidth=None,
+                 burst=None, connect_timeout=None, read_timeout=None,
+                 retry=None, breaker=None):
+        """
+        Initialize AsyncDownloader
+
+        Parameters
+        ----------
+        concurrency : 'int'
+            Number of concurrent downloads, default is 1. If min_concurrency
+            or max_concurrency are given this is the initial number of
+            concurrent downloads.
+        chunk_size : 'int'
+            Number of bytes to read from a response before writing to disk
+        connections_per_host : 'int'
+            Maximum number of pooled connections to each host
+        keep_alive : 'bool'
+            Whether to reuse connections between downloads
+        segments : 'int'
+            Number of ranged segments of a large file to download in
+            parallel, 1 downloads files sequentially
+        segment_size : 'int'
+            Size in bytes of ranged segments, files larger than this are
+            split into segments when segments > 1
+        validator : 'function'
+            Function called as validator(path, dst, size) on each completed
+            download before it is moved to dst, raising an error if the file
+            is invalid
+        lock_factory : 'function'
+            Function called as lock_factory(dst) returning a lock with
+            try_acquire() and release() methods. Files are only downloaded
+            while their lock is held and are skipped if they exist once
+            it is acquired.
+        min_concurrency : 'int'
+            Minimum number of concurrent downloads for adaptive concurrency
+        max_concurrency : 'int'
+            Maximum number of concurrent downloads for adaptive concurrency
+        bandwidth : 'int'
+            Maximum bytes/sec received by all downloads in the process, None
+            for no limit. Set by the first downloader with a bandwidth, see
+            TokenBucket.shared.
+        burst : 'int'
+            Bytes that can be received at full speed before bandwidth is
+            enforced, default is one second of bandwidth
+        connect_timeout : 'float'
+            Seconds to wait for a connection, None to wait indefinitely
+        read_timeout : 'float'
+            Seconds to wait for each read from a connection, None to wait
+            indefinitely
+        retry : 'RetryPolicy'
+            Policy for retrying transient failures, default is a single
+            attempt
+        breaker : 'CircuitBreaker'
+            Circuit breaker rejecting downloads while the external store is
+            failing, None to always attempt downloads
+        """
+        if concurrency is None:
+            concurrency = 1
+
+        if min_concurrency is None and max_concurrency is None:
+            min_concurrency = max_concurrency = concurrency
+        else:
+            if min_concurrency is None:
+                min_concurrency = 1
+
+            if max_concurrency is None:
+                max_concurrency = max(concurrency, min_concurrency)
+
+        if chunk_size is None:
+            chunk_size = self.CHUNK_SIZE
+
+        if segment_size is None:
+            segment_size = self.SEGMENT_SIZE
+
+        if retry is None:
+            retry = RetryPolicy(attempts=1)
+
+        self._controller = ConcurrencyController(min_limit=min_concurrency,
+                                                 max_limit=max_concurrency,
+                                                 initial=concurrency)
+        self._chunk_size = chunk_size
+        self._segments = segments
+        self._segment_size = segment_size
+        self._validator = validator
+        self._lock_factory = lock_factory
+        self._retry = retry
+        self._breaker = breaker
+        if bandwidth:
+            self._bucket = TokenBucket.shared(bandwidth, burst=burst)
+        else:
+            self._bucket = None
+
+        self._pool = httpclient.ConnectionPool(
+            max_per_host=connections_per_host, keep_alive=keep_alive,
+            connect_timeout=connect_timeout, read_timeout=read_timeout)
+        self._runner = EventLoopThread(name='R2PD-downloader')
+        # Closes the pool and stops its loop when the downloader is garbage
+        # collected or the interpreter exits, unless close was called
+        self._finalizer = weakref.finalize(self, self._runner.close,
+                                           self._pool.close)
+
+    def close(self):
+        """
+        Close the pooled connections and stop the event loop of the
+        downloader
+        """
+        self._finalizer()
+
+    @property
+    def controller(self):
+        """
+        Controller of the number of concurrent downloads
+
+        Returns
+        ---------
+        'ConcurrencyController'
+            Controller whose history records each adjustment
+        """
+        return self._controller
+
+    @property
+    def metrics(self):
+        """
+        Current state of the adaptive concurrency and circuit breaker
+
+        Returns
+        ---------
+        'dict'
+            concurrency limit, and breaker state, number of times it opened
+            and number of downloads it rejected
+        """
+        metrics = {'concurrency': self._controller.limit}
+        if self._breaker is not None:
+            metrics.update({'breaker_state': self._breaker.state,
+                            'breaker_opened': self._breaker.opened,
+                            'breaker_rejected': self._breaker.rejected})
+
+        return metrics
+
+    def __repr__(self):
+        """
+        Print the type of downloader and its concurrency
+
+        Returns
+        ---------
+        'str'
+            type of downloader and concurrency
+        """
+        return '{n} with concurrency {c}'.format(n=self.__class__.__name__,
+                                                 c=self._controller.limit)
+
+    async def _fetch_range(self, pool, part, start=0, end=None,
+                           require_partial=False):
+        """
+        Download bytes [start, end) of part.src into part.path
+
+        Parameters
+        ----------
+        pool : 'ConnectionPool'
+            Pool of connections shared by all downloads
+        part : 'PartialDownload'
+            Partial download to write to
+        start : 'int'
+            First byte to download
+        end : 'int'
+            One past the last byte to download, None for end of file
+        require_partial : 'bool'
+            Raise an error rather than restarting the download if the server
+            responds with the entire file
+        """
+        last = '' if end is None else end - 1
+        headers = {'Range': 'bytes={}-{}'.format(start, last)}
+        if part.validator is not None:
+            headers['If-Range'] = part.validator
+
+        try:
+            response = await pool.get(part.src, headers=headers)
+        except httpclient.HTTPError as ex:
+            if ex.status == 416:
+                # Journal does not match file on server
+                part.discard()
+
+            raise
+
+        try:
+            validator = (response.headers.get('etag')
+                         or response.headers.get('last-modified'))
+            if response.status == 206:
+                offset, _, size = parse_content_range(
+                    response.headers['content-range'])
+                if part.size is None:
+                    part.reset(size=size, validator=validator)
+                elif size is not None and size != part.size:
+                    part.reset()
+                    raise IOError('{} changed during download'
+                                  .format(part.src))
+            elif require_partial:
+                part.reset()
+                raise IOError('{} changed during download'.format(part.src))
+            else:
+                if part.ranges:
+                    logger.debug('Restarting download of {}'.format(part.src))
+
+                offset = 0
+                part.reset(size=response.content_length, validator=validator)
+
+            with open(part.path, 'r+b') as f:
+                f.seek(offset)
+                async for chunk in response.iter_chunks(self._chunk_size):
+                    if self._bucket is not None:
+                        await self._bucket.consume_async(len(chunk))
+
+                    f.write(chunk)
+                    part.add_range(offset, offset + len(chunk))
+                    offset += len(chunk)
+                    if part.needs_save:
+                        f.flush()
+                        part.save()
+        finally:
+            response.close()
+
+        if part.size is None:
+            # Size of a streamed response is only known at the end
+            part.size = offset
+
+    async def _fetch_segments(self, pool, part):
+        """
+        Download missing byte ranges of part in parallel segments
+
+        Parameters
+        ----------
+        pool : 'ConnectionPool'
+            Pool of connections shared by all downloads
+        part : 'PartialDownload'
+            Partial download to write to
+        """
+        segments = []
+        for start, end in part.missing_ranges:
+            for seg_start in range(start, end, self._segment_size):
+                segments.append((seg_start,
+                                 min(seg_start + self._segment_size, end)))
+
+        semaphore = asyncio.Semaphore(self._segments)
+
+        async def fetch_segment(start, end):
+            async with semaphore:
+                await self._fetch_range(pool, part, start, end,
+                                        require_partial=True)
+
+        results = await asyncio.gather(*[fetch_segment(start, end)
+                                         for start, end in segments],
+                                       return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    async def fetch(self, pool, src, dst):
+        """
+        Download src URL to dst file path, resuming any previous partial
+        download of src
+
+        Parameters
+        ----------
+        pool : 'ConnectionPool'
+            Pool of connections shared by all downloads
+        src : 'str'
+            URL of file to be downloaded
+        dst : 'str'
+            Destination path of file
+
+        Returns
+        ---------
+        'int'
+            Size of file in bytes
+        """
+        part = PartialDownload(src, dst)
+        try:
+            if part.size is None:
+                # First request determines size and support for ranges
+                end = self._segment_size if self._segments > 1 else None
+                await self._fetch_range(pool, part, 0, end)
+
+            if self._segments > 1:
+                await self._fetch_segments(pool, part)
+            else:
+                for start, end in part.missing_ranges:
+                    await self._fetch_range(pool, part, start, end)
+        except BaseException:
+            if part.ranges:
+                part.save()
+                logger.debug('Saved {}'.format(part))
+            else:
+                part.discard()
+
+            raise
+
+        if self._validator is not None:
+            loop = asyncio.get_running_loop()
+            try:
+                await loop.run_in_executor(None, self._validator, part.path,
+                                           dst, part.size)
+            except Exception:
+                part.discard()
+                raise
+
+        part.commit()
+
+        return part.size
+
+    async def _download(self, pool, limiter, key, src, dst):
+        """
+        Download a single file once a slot is available
+
+        Parameters
+        ----------
+        pool : 'ConnectionPool'
+            Pool of connections shared by all downloads
+        limiter : 'ConcurrencyLimiter'
+            Gate bounding the number of concurrent downloads
+        key : 'int'|'str'
+            Identifier of the download
+        src : 'str'
+            URL of file to be downloaded
+        dst : 'str'
+            Destination path of file
+
+        Returns
+        ---------
+        'DownloadResult'
+            Result of download
+        """
+        while True:
+            async with limiter:
+                lock = None
+                if self._lock_factory is not None:
+                    lock = self._lock_factory(dst)
+
+                if lock is None or lock.try_acquire():
+                    try:
+                        result = await self._download_locked(pool, key, src,
+                                                             dst, lock)
+                    finally:
+                        if lock is not None:
+                            lock.release()
+
+                    if not result.cached:
+                        limiter.record(result.size, result.latency,
+                                       result.success)
+
+                    return result
+
+            # Another thread or process is downloading dst, wait for it
+            # without holding a download slot
+            await asyncio.sleep(self.LOCK_POLL_INTERVAL)
+
+    async def _download_locked(self, pool, key, src, dst, lock):
+        """
+        Download a single file once its slot and lock have been acquired
+
+        Parameters
+        ----------
+        pool : 'ConnectionPool'
+            Pool of connections shared by all downloads
+        key : 'int'|'str'
+            Identifier of the download
+        src : 'str'
+            URL of file to be downloaded
+        dst : 'str'
+            Destination path of file
+        lock : 'CacheLock'
+            Lock held on dst, None if downloads are not locked
+
+        Returns
+        ---------
+        'DownloadResult'
+            Result of download
+        """
+        start = time.monotonic()
+        if lock is not None and os.path.exists(dst):
+            logger.debug("{} was downloaded by another process".format(dst))
+            return DownloadResult(key, src, dst, success=True,
+                                  size=os.path.getsize(dst),
+                                  latency=time.monotonic() - start,
+                                  cached=True)
+
+        logger.debug("Downloading to {} ...".format(dst))
+        size, error, attempts = await self._retry.call_async(
+            functools.partial(self.fetch, pool, src, dst),
+            breaker=self._breaker, name=src)
+        if error is not None:
+            if not isinstance(error, CircuitOpenError):
+                logger.warning('Unable to download {}: {}'.format(src, error))
+
+            return DownloadResult(key, src, dst, error=error,
+                                  latency=time.monotonic() - start,
+                                  attempts=attempts)
+
+        return DownloadResult(key, src, dst, success=True, size=size,
+                              latency=time.monotonic() - start,
+                              attempts=attempts)
+
+    async def download_all(self, downloads, deadline=None):
+        """
+        Download all files concurrently
+
+        Parameters
+        ----------
+        downloads : 'list'
+            List of (key, src, dst) tuples
+        deadline : 'Deadline'
+            Deadline after which outstanding downloads are cancelled and
+            reported as failed, partial files are kept to be resumed
+
+        Returns
+        ---------
+        report : 'DownloadReport'
+            Report of download results
+        """
+        limiter = ConcurrencyLimiter(self._controller)
+        pool = self._pool
+        opened = pool.opened
+        timeout = None if deadline is None else deadline.remaining
+        tasks = {asyncio.ensure_future(self._download(pool, limiter, key,
+                                                      src, dst)):
+                 (key, src, dst) for key, src, dst in downloads}
+        report = DownloadReport()
+        if tasks:
+            done, pending = await asyncio.wait(tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+
+            await asyncio.gather(*pending, return_exceptions=True)
+            for task, (key, src, dst) in tasks.items():
+                if task in done:
+                    report.add(task.result())
+                else:
+                    error = TimeoutError('Deadline of {} seconds '
+                                         'exceeded!'.format(deadline.sec))
+                    report.add(DownloadResult(key, src, dst, error=error))
+
+            if pending:
+                logger.warning('Cancelled {} downloads at deadline'
+                               .format(len(pending)))
+
+        logger.debug('{} ({} bytes over {} new connections, {} retries, {})'
+                     .format(report, report.bytes, pool.opened - opened,
+                             report.retries, self.metrics))
+
+        return report
+
+    def download(self, downloads, deadline=None):
+        """
+        Download all files, blocking until complete
+
+        Parameters
+        ----------
+        downloads : 'list'
+            List of (key, src, dst) tuples
+        deadline : 'Deadline'
+            Deadline after which outstanding downloads are cancelled
+
+        Returns
+        ---------
+        'DownloadReport'
+            Report of download results
+        """
+        return self._runner.run(self.download_all(downloads,
+                                                  deadline=deadline))
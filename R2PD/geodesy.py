@@ -0,0 +1,107 @@
+"""
+This module converts coordinates to points on the unit sphere so that
+nearest resource sites can be found with a KD-tree. The straight-line
+(chord) distance between two unit vectors increases monotonically with the
+great-circle distance between them, so the nearest neighbours in 3D are
+exactly the geodesically nearest sites, at any latitude and across the
+antimeridian, unlike neighbours found on raw (latitude, longitude) degrees.
+"""
+import numpy as np
+
+# Mean radius of the Earth in km
+EARTH_RADIUS = 6371.0088
+
+
+def to_unit_vectors(lat_lon):
+    """
+    Convert coordinates to unit vectors
+
+    Parameters
+    ----------
+    lat_lon : 'numpy.ndarray'
+        (n, 2) array of [latitude, longitude] in degrees
+
+    Returns
+    ---------
+    'numpy.ndarray'
+        (n, 3) array of [x, y, z] on the unit sphere
+    """
+    lat_lon = np.radians(np.asarray(lat_lon, dtype=float).reshape(-1, 2))
+    lat = lat_lon[:, 0]
+    lon = lat_lon[:, 1]
+    cos_lat = np.cos(lat)
+
+    return np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon),
+                            np.sin(lat)))
+
+
+def chord_to_km(chord):
+    """
+    Convert chord lengths between unit vectors to great-circle distances
+
+    Parameters
+    ----------
+    chord : 'numpy.ndarray'|'float'
+        Chord lengths, inf is preserved
+
+    Returns
+    ---------
+    'numpy.ndarray'|'float'
+        Great-circle distances in km
+    """
+    chord = np.asarray(chord, dtype=float)
+    km = 2 * EARTH_RADIUS * np.arcsin(np.clip(chord / 2, 0, 1))
+    km = np.where(np.isinf(chord), np.inf, km)
+
+    return km if km.ndim else float(km)
+
+
+def km_to_chord(km):
+    """
+    Convert great-circle distances to chord lengths between unit vectors
+
+    Parameters
+    ----------
+    km : 'numpy.ndarray'|'float'
+        Great-circle distances in km, distances beyond half the
+        circumference are treated as the diameter
+
+    Returns
+    ---------
+    'numpy.ndarray'|'float'
+        Chord lengths
+    """
+    km = np.asarray(km, dtype=float)
+    angle = np.clip(km / EARTH_RADIUS, 0, np.pi)
+    chord = 2 * np.sin(angle / 2)
+
+    return chord if chord.ndim else float(chord)
+
+
+def haversine(lat_lon, other_lat_lon):
+    """
+    Great-circle distances between pairs of coordinates
+
+    Parameters
+    ----------
+    lat_lon : 'numpy.ndarray'
+        (n, 2) array of [latitude, longitude] in degrees
+    other_lat_lon : 'numpy.ndarray'
+        (n, 2) array of [latitude, longitude] in degrees, or a single
+        coordinate
+
+    Returns
+    ---------
+    'numpy.ndarray'
+        Distance between each pair in km
+    """
+    lat_lon = np.radians(np.asarray(lat_lon, dtype=float).reshape(-1, 2))
+    other = np.radians(np.asarray(other_lat_lon,
+                                  dtype=float).reshape(-1, 2))
+    d_lat = other[:, 0] - lat_lon[:, 0]
+    d_lon = other[:, 1] - lat_lon[:, 1]
+    a = (np.sin(d_lat / 2) ** 2
+         + np.cos(lat_lon[:, 0]) * np.cos(other[:, 0])
+         * np.sin(d_lon / 2) ** 2)
+
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
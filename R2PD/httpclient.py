@@ -0,0 +1,748 @@
+"""
+This module provides a minimal asyncio HTTP/1.1 client used to stream
+resource files from external data stores without blocking worker threads.
+Connections are kept alive and shared between requests through a
+ConnectionPool.
+"""
+import asyncio
+from collections import defaultdict
+import logging
+import ssl
+from urllib.parse import urljoin, urlsplit
+
+from R2PD.Timeout import wait_for
+from R2PD.version import __version__
+
+logger = logging.getLogger(__name__)
+
+
+class HTTPError(IOError):
+    """
+    Error for HTTP responses with an unsuccessful status code
+    """
+    def __init__(self, url, status, reason):
+        """
+        Initialize HTTPError
+
+        Parameters
+        ----------
+        url : 'str'
+            URL that was requested
+        status : 'int'
+            HTTP status code
+        reason : 'str'
+            HTTP reason phrase
+        """
+        self.url = url
+        self.status = status
+        self.reason = reason
+        msg = 'HTTP {s} {r} for {u}'.format(s=status, r=reason, u=url)
+        super(HTTPError, self).__init__(msg)
+
+
+class HTTPResponse(object):
+    """
+    Response to an HTTP request whose body is streamed from the connection
+    """
+    def __init__(self, method, url, status, reason, headers, connection):
+        """
+        Initialize HTTPResponse
+
+        Parameters
+        ----------
+        method : 'str'
+            HTTP method of the request
+        url : 'str'
+            URL that was requested
+        status : 'int'
+            HTTP status code
+        reason : 'str'
+            HTTP reason phrase
+        headers : 'dict'
+            Response headers with lower case names
+        connection : 'Connection'
+            Pooled connection the response is read from
+        """
+        self.method = method
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self._connection = connection
+        self._complete = False
+
+    def __repr__(self):
+        """
+        Print the status and URL of the response
+
+        Returns
+        ---------
+        'str'
+            status and URL of response
+        """
+        return '<{n} [{s}] {u}>'.format(n=self.__class__.__name__,
+                                        s=self.status, u=self.url)
+
+    @property
+    def content_length(self):
+        """
+        Length of the response body if provided by the server
+
+        Returns
+        ---------
+        'int'
+            Content-Length header value or None
+        """
+        length = self.headers.get('content-length')
+        if length is not None:
+            length = int(length)
+
+        return length
+
+    @property
+    def keep_alive(self):
+        """
+        Whether the connection can be reused once the body has been read
+
+        Returns
+        ---------
+        'bool'
+            True if the server did not ask to close the connection and the
+            body length is delimited
+        """
+        if 'close' in self.headers.get('connection', '').lower():
+            return False
+
+        return (self.method == 'HEAD' or self.status in (204, 304)
+                or self.content_length is not None
+                or 'chunked' in self.headers.get('transfer-encoding', ''))
+
+    def raise_for_status(self):
+        """
+        Raise HTTPError if response status is not successful
+        """
+        if self.status >= 400:
+            raise HTTPError(self.url, self.status, self.reason)
+
+    async def iter_chunks(self, chunk_size):
+        """
+        Asynchronously iterate over the response body
+
+        Parameters
+        ----------
+        chunk_size : 'int'
+            Maximum number of bytes to yield at a time
+
+        Yields
+        ---------
+        'bytes'
+            Chunk of response body
+        """
+        connection = self._connection
+        if self.method == 'HEAD' or self.status in (204, 304):
+            pass
+        elif 'chunked' in self.headers.get('transfer-encoding', ''):
+            while True:
+                line = await connection.readline()
+                size = int(line.split(b';')[0].strip(), 16)
+                if size == 0:
+                    # Discard trailers
+                    while (await connection.readline()) not in (b'\r\n', b''):
+                        pass
+                    break
+
+                while size > 0:
+                    data = await connection.readexactly(min(chunk_size, size))
+                    size -= len(data)
+                    yield data
+
+                await connection.readline()
+        elif self.content_length is not None:
+            remaining = self.content_length
+            while remaining > 0:
+                data = await connection.read(min(chunk_size, remaining))
+                if not data:
+                    msg = ('Connection closed with {} bytes remaining'
+                           .format(remaining))
+                    raise ConnectionError(msg)
+
+                remaining -= len(data)
+                yield data
+        else:
+            while True:
+                data = await connection.read(chunk_size)
+                if not data:
+                    break
+
+                yield data
+
+        self._complete = True
+
+    async def discard(self, limit):
+        """
+        Discard the response body and release the connection. Bodies of
+        known length up to limit are read so that the connection can be
+        reused, longer bodies are left unread and the connection closed.
+
+        Parameters
+        ----------
+        limit : 'int'
+            Maximum number of bytes to read
+        """
+        if self.method == 'HEAD' or self.status in (204, 304):
+            length = 0
+        else:
+            length = self.content_length
+
+        try:
+            if length is not None and length <= limit:
+                await self.read()
+        finally:
+            self.close()
+
+    async def read(self, chunk_size=2 ** 16):
+        """
+        Read the entire response body
+
+        Parameters
+        ----------
+        chunk_size : 'int'
+            Maximum number of bytes to read at a time
+
+        Returns
+        ---------
+        'bytes'
+            Response body
+        """
+        chunks = [chunk async for chunk in self.iter_chunks(chunk_size)]
+        return b''.join(chunks)
+
+    def close(self):
+        """
+        Release the connection back to its pool, closing it if the body was
+        not completely read or the server will not keep it alive
+        """
+        if self._connection is not None:
+            self._connection.release(reuse=self._complete and self.keep_alive)
+            self._connection = None
+
+
+class Connection(object):
+    """
+    Connection to a single host owned by a ConnectionPool
+    """
+    def __init__(self, pool, key, reader, writer):
+        """
+        Initialize Connection
+
+        Parameters
+        ----------
+        pool : 'ConnectionPool'
+            Pool the connection belongs to
+        key : 'tuple'
+            (scheme, host, port) of the connection
+        reader : 'asyncio.StreamReader'
+            Stream to read responses from
+        writer : 'asyncio.StreamWriter'
+            Stream to write requests to
+        """
+        self.pool = pool
+        self.key = key
+        self.reader = reader
+        self.writer = writer
+        self.requests = 0
+        self.read_timeout = pool.read_timeout
+        self.loop = asyncio.get_running_loop()
+
+    @property
+    def is_closed(self):
+        """
+        Whether the connection has been closed by either side
+
+        Returns
+        ---------
+        'bool'
+            True if connection can no longer be used
+        """
+        return self.writer.is_closing() or self.reader.at_eof()
+
+    def _wait(self, aw):
+        """
+        Await a read from the connection, bounded by read_timeout
+
+        Parameters
+        ----------
+        aw : 'awaitable'
+            Read from reader
+
+        Returns
+        ---------
+        'bytes'
+            Data read
+        """
+        msg = ('Read from {h}:{p} timed out after {t} seconds!'
+               .format(h=self.key[1], p=self.key[2], t=self.read_timeout))
+        return wait_for(aw, self.read_timeout, msg)
+
+    async def read(self, n=-1):
+        """
+        Read up to n bytes
+
+        Parameters
+        ----------
+        n : 'int'
+            Maximum number of bytes to read
+
+        Returns
+        ---------
+        'bytes'
+            Data read, empty at EOF
+        """
+        return await self._wait(self.reader.read(n))
+
+    async def readexactly(self, n):
+        """
+        Read exactly n bytes
+
+        Parameters
+        ----------
+        n : 'int'
+            Number of bytes to read
+
+        Returns
+        ---------
+        'bytes'
+            Data read
+        """
+        return await self._wait(self.reader.readexactly(n))
+
+    async def readline(self):
+        """
+        Read one line
+
+        Returns
+        ---------
+        'bytes'
+            Line including its terminator, empty at EOF
+        """
+        return await self._wait(self.reader.readline())
+
+    def release(self, reuse=True):
+        """
+        Return connection to its pool
+
+        Parameters
+        ----------
+        reuse : 'bool'
+            Whether the connection can be reused for another request
+        """
+        self.pool.release(self, reuse=reuse)
+
+    def close(self):
+        """
+        Close the connection
+        """
+        self.writer.close()
+
+
+async def open_connection(url):
+    """
+    Open a connection to the host of url
+
+    Parameters
+    ----------
+    url : 'str'
+        http or https URL
+
+    Returns
+    ---------
+    reader : 'asyncio.StreamReader'
+        Stream to read responses from
+    writer : 'asyncio.StreamWriter'
+        Stream to write requests to
+    """
+    scheme, host, port = connection_key(url)
+    context = ssl.create_default_context() if scheme == 'https' else None
+
+    return await asyncio.open_connection(host, port, ssl=context)
+
+
+def connection_key(url):
+    """
+    Extract the (scheme, host, port) connections to url are pooled under
+
+    Parameters
+    ----------
+    url : 'str'
+        http or https URL
+
+    Returns
+    ---------
+    'tuple'
+        (scheme, host, port)
+    """
+    parts = urlsplit(url)
+    if parts.scheme == 'https':
+        port = parts.port or 443
+    elif parts.scheme == 'http':
+        port = parts.port or 80
+    else:
+        raise ValueError('Unsupported URL scheme: {}'.format(url))
+
+    return parts.scheme, parts.hostname, port
+
+
+class ConnectionPool(object):
+    """
+    Pool of keep-alive HTTP connections shared by all download workers, with
+    a limit on the number of simultaneous connections to each host.
+    Redirect bodies up to MAX_DRAIN bytes are read to keep their connection
+    alive, the connections of longer bodies are closed instead.
+    Connections belong to the event loop they were opened on, the pool is
+    bound to the loop it was last used from and drops those of any other.
+    """
+    MAX_PER_HOST = 8
+    MAX_DRAIN = 2 ** 16
+
+    def __init__(self, max_per_host=None, keep_alive=True,
+                 connect_timeout=None, read_timeout=None):
+        """
+        Initialize ConnectionPool
+
+        Parameters
+        ----------
+        max_per_host : 'int'
+            Maximum number of open connections to each host
+        keep_alive : 'bool'
+            Whether connections are reused between requests
+        connect_timeout : 'float'
+            Seconds to wait for a new connection, None to wait indefinitely
+        read_timeout : 'float'
+            Seconds to wait for each read from a connection, None to wait
+            indefinitely
+        """
+        if max_per_host is None:
+            max_per_host = self.MAX_PER_HOST
+
+        self._max_per_host = max_per_host
+        self._keep_alive = keep_alive
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._loop = None
+        self._slots = {}
+        self._idle = defaultdict(list)
+        self.opened = 0
+
+    def __repr__(self):
+        """
+        Print the type of pool and its per-host limit
+
+        Returns
+        ---------
+        'str'
+            type of pool and per-host limit
+        """
+        return '{n} with {m} connections per host'.format(
+            n=self.__class__.__name__, m=self._max_per_host)
+
+    async def __aenter__(self):
+        """
+        Enter method to allow use of async with
+        """
+        return self
+
+    async def __aexit__(self, type, value, traceback):
+        """
+        Close all idle connections on exit from async with
+        """
+        self.close()
+
+    async def acquire(self, url):
+        """
+        Acquire a connection to the host of url, waiting for a free slot if
+        the per-host limit has been reached
+
+        Parameters
+        ----------
+        url : 'str'
+            http or https URL
+
+        Returns
+        ---------
+        'Connection'
+            Idle connection if available, else a new connection
+        """
+        self._bind()
+        key = connection_key(url)
+        if key not in self._slots:
+            self._slots[key] = asyncio.Semaphore(self._max_per_host)
+
+        await self._slots[key].acquire()
+        try:
+            idle = self._idle[key]
+            while idle:
+                connection = idle.pop()
+                if not connection.is_closed:
+                    return connection
+
+                connection.close()
+
+            msg = ('Connection to {h}:{p} timed out after {t} seconds!'
+                   .format(h=key[1], p=key[2], t=self.connect_timeout))
+            reader, writer = await wait_for(open_connection(url),
+                                            self.connect_timeout, msg)
+        except BaseException:
+            self._slots[key].release()
+            raise
+
+        self.opened += 1
+        return Connection(self, key, reader, writer)
+
+    def _bind(self):
+        """
+        Bind the pool to the running event loop, dropping the connections
+        and per-host slots of the loop it was bound to, i.e. one that has
+        since been closed
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            if self._loop is not None:
+                logger.debug('Dropping connections of another event loop')
+
+            self._loop = loop
+            self._slots = {}
+            self._idle = defaultdict(list)
+
+    def release(self, connection, reuse=True):
+        """
+        Return connection to the pool
+
+        Parameters
+        ----------
+        connection : 'Connection'
+            Connection acquired from this pool
+        reuse : 'bool'
+            Whether the connection can be reused for another request
+        """
+        if connection.loop is not self._loop:
+            # Acquired before the pool was bound to another loop
+            connection.close()
+            return
+
+        if reuse and self._keep_alive and not connection.is_closed:
+            self._idle[connection.key].append(connection)
+        else:
+            connection.close()
+
+        self._slots[connection.key].release()
+
+    def close(self):
+        """
+        Close all idle connections
+        """
+        for idle in self._idle.values():
+            for connection in idle:
+                connection.close()
+
+        self._idle.clear()
+
+    async def _send(self, connection, method, url, headers):
+        """
+        Write request to connection and read the response status and headers
+
+        Parameters
+        ----------
+        connection : 'Connection'
+            Connection to send request on
+        method : 'str'
+            HTTP method, i.e. 'GET' or 'HEAD'
+        url : 'str'
+            http or https URL
+        headers : 'dict'
+            Additional request headers
+
+        Returns
+        ---------
+        'HTTPResponse'
+            Response with unread body
+        """
+        parts = urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        lines = ['{m} {p} HTTP/1.1'.format(m=method, p=path),
+                 'Host: {}'.format(parts.netloc),
+                 'User-Agent: R2PD/{}'.format(__version__),
+                 'Accept-Encoding: identity',
+                 'Connection: {}'.format('keep-alive' if self._keep_alive
+                                         else 'close')]
+        if headers is not None:
+            lines += ['{}: {}'.format(k, v) for k, v in headers.items()]
+
+        connection.writer.write(('\r\n'.join(lines) + '\r\n\r\n')
+                                .encode('latin-1'))
+        await connection.writer.drain()
+        connection.requests += 1
+
+        while True:
+            status, reason, response_headers = \
+                await self._read_head(connection, url)
+            # Interim responses, i.e. 100 Continue, precede the final one
+            if not 100 <= status < 200 or status == 101:
+                break
+
+            logger.debug('Skipping interim response {} from {}'
+                         .format(status, url))
+
+        return HTTPResponse(method, url, status, reason, response_headers,
+                            connection)
+
+    @staticmethod
+    async def _read_head(connection, url):
+        """
+        Read the status line and headers of a response
+
+        Parameters
+        ----------
+        connection : 'Connection'
+            Connection to read response from
+        url : 'str'
+            URL that was requested
+
+        Returns
+        ---------
+        status : 'int'
+            HTTP status code
+        reason : 'str'
+            HTTP reason phrase
+        headers : 'dict'
+            Response headers with lower case names
+        """
+        status_line = await connection.readline()
+        if not status_line:
+            raise ConnectionResetError('No response from {}'.format(url))
+
+        _, status, reason = (status_line.decode('latin-1').rstrip('\r\n')
+                             .split(' ', 2) + [''])[:3]
+        headers = {}
+        while True:
+            line = await connection.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+
+            name, value = line.decode('latin-1').split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+
+        return int(status), reason, headers
+
+    async def request(self, method, url, headers=None):
+        """
+        Send an HTTP request on a pooled connection
+
+        Parameters
+        ----------
+        method : 'str'
+            HTTP method, i.e. 'GET' or 'HEAD'
+        url : 'str'
+            http or https URL
+        headers : 'dict'
+            Additional request headers
+
+        Returns
+        ---------
+        'HTTPResponse'
+            Response with unread body, close it to release the connection
+        """
+        while True:
+            connection = await self.acquire(url)
+            reused = connection.requests > 0
+            try:
+                return await self._send(connection, method, url, headers)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                connection.release(reuse=False)
+                # The server may drop an idle keep-alive connection at any
+                # time, retry those requests on a new connection
+                if not reused:
+                    raise
+            except BaseException:
+                connection.release(reuse=False)
+                raise
+
+    async def follow(self, method, url, headers=None, max_redirects=5):
+        """
+        Send a request following any redirects
+
+        Parameters
+        ----------
+        method : 'str'
+            HTTP method, i.e. 'GET' or 'HEAD'
+        url : 'str'
+            http or https URL
+        headers : 'dict'
+            Additional request headers
+        max_redirects : 'int'
+            Maximum number of redirects to follow
+
+        Returns
+        ---------
+        'HTTPResponse'
+            Response with unread body, close it to release the connection
+        """
+        for _ in range(max_redirects + 1):
+            response = await self.request(method, url, headers=headers)
+            location = response.headers.get('location')
+            if response.status in (301, 302, 303, 307, 308) and location:
+                await response.discard(self.MAX_DRAIN)
+                url = urljoin(url, location)
+                logger.debug('Redirected to {}'.format(url))
+            else:
+                if response.status >= 400:
+                    response.close()
+                    response.raise_for_status()
+
+                return response
+
+        raise HTTPError(url, response.status, 'Too many redirects')
+
+    async def get(self, url, headers=None, max_redirects=5):
+        """
+        Send a GET request following any redirects
+
+        Parameters
+        ----------
+        url : 'str'
+            http or https URL
+        headers : 'dict'
+            Additional request headers
+        max_redirects : 'int'
+            Maximum number of redirects to follow
+
+        Returns
+        ---------
+        'HTTPResponse'
+            Response with unread body, close it to release the connection
+        """
+        return await self.follow('GET', url, headers=headers,
+                                 max_redirects=max_redirects)
+
+    async def head(self, url, headers=None, max_redirects=5):
+        """
+        Send a HEAD request following any redirects
+
+        Parameters
+        ----------
+        url : 'str'
+            http or https URL
+        headers : 'dict'
+            Additional request headers
+        max_redirects : 'int'
+            Maximum number of redirects to follow
+
+        Returns
+        ---------
+        'HTTPResponse'
+            Response without a body, close it to release the connection
+        """
+        return await self.follow('HEAD', url, headers=headers,
+                                 max_redirects=max_redirects)
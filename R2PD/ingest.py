@@ -0,0 +1,417 @@
+"""
+This module transcodes downloaded resource files into read-optimized
+sidecars. DR Power files store each time series as a compound dataset with
+byte-string timestamps, so every read decodes the timestamps again. A
+sidecar stores the same data as an int64 time index and one contiguous
+float dataset per column, chunked by year, so reading it needs no decoding.
+Files and sidecars can also be recompressed with HDF5 filters at ingest to
+fit more sites in the local cache.
+"""
+import logging
+import os
+
+import h5py
+import numpy as np
+import pandas as pds
+
+logger = logging.getLogger(__name__)
+
+SIDECAR_EXT = '.sidecar.h5'
+# Extent each chunk of a sidecar covers, requests are typically for a year
+CHUNK_EXTENT = pds.Timedelta(days=365)
+# Target size of each chunk of a recompressed resource file
+CHUNK_BYTES = 2 ** 20
+COMPRESSIONS = ('gzip', 'lzf')
+
+
+def get_sidecar_path(file_path):
+    """
+    Path of the sidecar of a resource file
+
+    Parameters
+    ----------
+    file_path : 'str'
+        Path to resource .hdf5 file
+
+    Returns
+    ---------
+    'str'
+        Path to sidecar, next to file_path
+    """
+    return os.path.splitext(file_path)[0] + SIDECAR_EXT
+
+
+def decode_time_series(data):
+    """
+    Convert a compound time series dataset into a DataFrame indexed by time
+
+    Parameters
+    ----------
+    data : 'numpy.ndarray'
+        Structured array with a byte-string 'Timestamp' or 'time' field
+
+    Returns
+    ---------
+    data : 'pandas.DataFrame'
+        Time series DataFrame
+    """
+    data = pds.DataFrame(data)
+    cols = list(data.columns)
+    if 'Timestamp' in cols:
+        index_col = 'Timestamp'
+    elif 'time' in cols:
+        index_col = 'time'
+    else:
+        raise RuntimeError('Cannot determine time-index column')
+
+    time_index = data[index_col].str.decode('utf-8')
+    data[index_col] = pds.to_datetime(time_index)
+    data = data.set_index(index_col)
+
+    return data
+
+
+def get_chunk_rows(time_index):
+    """
+    Number of records per chunk, so that each chunk covers CHUNK_EXTENT
+
+    Parameters
+    ----------
+    time_index : 'pandas.DatetimeIndex'
+        Time index of data
+
+    Returns
+    ---------
+    'int'
+        Records per chunk
+    """
+    if not len(time_index):
+        return 1
+
+    end = time_index[0] + CHUNK_EXTENT
+    return max(int(np.searchsorted(time_index.values, end.to_datetime64())),
+               1)
+
+
+def get_filters(compression=None, compression_opts=None, shuffle=False):
+    """
+    HDF5 filter arguments of h5py.Group.create_dataset
+
+    Parameters
+    ----------
+    compression : 'str'
+        'gzip' or 'lzf', None for no compression
+    compression_opts : 'int'
+        gzip level from 0 to 9
+    shuffle : 'bool'
+        Apply the byte shuffle filter before compressing
+
+    Returns
+    ---------
+    'dict'
+        compression, compression_opts and shuffle arguments
+    """
+    if compression is not None and compression not in COMPRESSIONS:
+        raise ValueError('compression must be one of {} or None, not {!r}'
+                         .format(COMPRESSIONS, compression))
+
+    if compression != 'gzip':
+        compression_opts = None
+
+    return {'compression': compression, 'compression_opts': compression_opts,
+            'shuffle': bool(shuffle)}
+
+
+def has_filters(ds, filters):
+    """
+    Check whether a dataset is stored with filters
+
+    Parameters
+    ----------
+    ds : 'h5py.Dataset'
+        Dataset
+    filters : 'dict'
+        Filter arguments from get_filters
+
+    Returns
+    ---------
+    'bool'
+        True if ds uses the compression and shuffle filters
+    """
+    if ds.compression != filters['compression'] or \
+            ds.shuffle != filters['shuffle']:
+        return False
+
+    return (filters['compression_opts'] is None
+            or ds.compression_opts == filters['compression_opts'])
+
+
+def recompress(file_path, **filters):
+    """
+    Rewrite the time series datasets of a resource file with new HDF5
+    filters, copying all other objects and attributes unchanged. The file
+    is replaced atomically and left untouched if its datasets already use
+    the filters. Only call this on files no other process has open, i.e.
+    on a download before it is moved into the cache.
+
+    Parameters
+    ----------
+    file_path : 'str'
+        Path to resource .hdf5 file
+    **filters
+        compression, compression_opts and shuffle, see get_filters
+
+    Returns
+    ---------
+    'bool'
+        True if the file was rewritten
+    """
+    filters = get_filters(**filters)
+    with h5py.File(file_path, 'r') as h5_file:
+        datasets = [name for name, ds in h5_file.items()
+                    if isinstance(ds, h5py.Dataset) and ds.shape]
+        if all(has_filters(h5_file[name], filters) for name in datasets):
+            return False
+
+    tmp_path = '{}.{}.tmp'.format(file_path, os.getpid())
+    try:
+        with h5py.File(file_path, 'r') as src, \
+                h5py.File(tmp_path, 'w') as dst:
+            for key, value in src.attrs.items():
+                dst.attrs[key] = value
+
+            for name, obj in src.items():
+                if name not in datasets:
+                    src.copy(obj, dst, name=name)
+                    continue
+
+                chunk_rows = max(min(CHUNK_BYTES // obj.dtype.itemsize,
+                                     obj.shape[0]), 1)
+                ds = dst.create_dataset(name, data=obj[...],
+                                        chunks=(chunk_rows, ) + obj.shape[1:],
+                                        **filters)
+                for key, value in obj.attrs.items():
+                    ds.attrs[key] = value
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+        raise
+
+    before = os.path.getsize(file_path)
+    os.replace(tmp_path, file_path)
+    logger.debug('Recompressed {} from {} to {} bytes'
+                 .format(file_path, before, os.path.getsize(file_path)))
+
+    return True
+
+
+def write_sidecar(file_path, data_type, sidecar_path=None, **filters):
+    """
+    Write the sidecar of a resource file, replacing any existing sidecar
+
+    Parameters
+    ----------
+    file_path : 'str'
+        Path to resource .hdf5 file
+    data_type : 'str'
+        Dataset to transcode, i.e. 'power_data'
+    sidecar_path : 'str'
+        Path to write sidecar to, default is next to file_path
+    **filters
+        compression, compression_opts and shuffle of sidecar datasets, see
+        get_filters
+
+    Returns
+    ---------
+    sidecar_path : 'str'
+        Path to sidecar
+    """
+    with h5py.File(file_path, 'r') as h5_file:
+        data = decode_time_series(h5_file[data_type][...])
+
+    filters = get_filters(**filters)
+    stat = os.stat(file_path)
+    if sidecar_path is None:
+        sidecar_path = get_sidecar_path(file_path)
+
+    tmp_path = '{}.{}.tmp'.format(sidecar_path, os.getpid())
+    chunk_rows = min(get_chunk_rows(data.index), len(data)) or None
+    chunks = (chunk_rows, ) if chunk_rows else None
+    if chunks is None:
+        # Filters require a chunked dataset
+        filters = {}
+
+    with h5py.File(tmp_path, 'w') as h5_file:
+        group = h5_file.create_group(data_type)
+        group.attrs['index'] = data.index.name
+        group.attrs['columns'] = [str(col) for col in data.columns]
+        # Timestamps are stored as ns whatever the resolution of the index
+        time_ns = data.index.values.astype('datetime64[ns]').view('i8')
+        group.create_dataset('time', data=time_ns, chunks=chunks, **filters)
+        for col in data.columns:
+            values = np.ascontiguousarray(data[col].values)
+            group.create_dataset(str(col), data=values, chunks=chunks,
+                                 **filters)
+
+        h5_file.attrs['source_size'] = stat.st_size
+        h5_file.attrs['source_mtime'] = stat.st_mtime
+
+    os.replace(tmp_path, sidecar_path)
+
+    return sidecar_path
+
+
+def is_current(file_path, h5_file):
+    """
+    Check that an open sidecar was written from the current version of its
+    resource file
+
+    Parameters
+    ----------
+    file_path : 'str'
+        Path to resource .hdf5 file
+    h5_file : 'h5py.File'
+        Open sidecar
+
+    Returns
+    ---------
+    'bool'
+        True if the size and modification time of file_path match those it
+        had when the sidecar was written
+    """
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return False
+
+    return (h5_file.attrs.get('source_size') == stat.st_size
+            and h5_file.attrs.get('source_mtime') == stat.st_mtime)
+
+
+def read_sidecar(file_path, data_type):
+    """
+    Read a dataset from the sidecar of a resource file
+
+    Parameters
+    ----------
+    file_path : 'str'
+        Path to resource .hdf5 file
+    data_type : 'str'
+        Dataset to read, i.e. 'power_data'
+
+    Returns
+    ---------
+    data : 'pandas.DataFrame'
+        Time series DataFrame of dataset, None if there is no current
+        sidecar containing it
+    """
+    sidecar_path = get_sidecar_path(file_path)
+    if not os.path.exists(sidecar_path):
+        return None
+
+    try:
+        with h5py.File(sidecar_path, 'r') as h5_file:
+            if data_type not in h5_file or not is_current(file_path,
+                                                          h5_file):
+                return None
+
+            group = h5_file[data_type]
+            time_index = pds.DatetimeIndex(
+                group['time'][...].view('datetime64[ns]'),
+                name=group.attrs['index'])
+            columns = list(group.attrs['columns'])
+            data = pds.DataFrame({col: group[col][...] for col in columns},
+                                 index=time_index, columns=columns)
+    except (OSError, KeyError) as ex:
+        logger.warning('Ignoring unreadable sidecar {}: {}'
+                       .format(sidecar_path, ex))
+        return None
+
+    return data
+
+
+def read_time_series(file_path, data_type):
+    """
+    Read a dataset of a resource file, from its sidecar if one is current
+
+    Parameters
+    ----------
+    file_path : 'str'
+        Path to resource .hdf5 file
+    data_type : 'str'
+        Dataset to read, i.e. 'power_data'
+
+    Returns
+    ---------
+    data : 'pandas.DataFrame'
+        Time series DataFrame of dataset
+    """
+    data = read_sidecar(file_path, data_type)
+    if data is None:
+        with h5py.File(file_path, 'r') as h5_file:
+            data = decode_time_series(h5_file[data_type][...])
+
+    return data
+
+
+def ingest(file_path, sidecar=True, compression=None, compression_opts=None,
+           shuffle=False, dst=None):
+    """
+    Prepare a downloaded resource file for the local cache: recompress it
+    if compression is set and write its sidecar unless it is current. Run
+    on the downloaded file before it is moved into the cache, so that no
+    other process sees it change.
+
+    Parameters
+    ----------
+    file_path : 'str'
+        Path to resource .hdf5 file, named
+        '{dataset}_{resource_type}_{site_id}.hdf5' unless dst is given
+    sidecar : 'bool'
+        Write a read-optimized sidecar
+    compression : 'str'
+        'gzip' or 'lzf' to recompress the file and its sidecar, None to
+        leave the file as downloaded and the sidecar uncompressed
+    compression_opts : 'int'
+        gzip level from 0 to 9
+    shuffle : 'bool'
+        Apply the byte shuffle filter before compressing
+    dst : 'str'
+        Path file_path will be moved to in the cache, which names the
+        sidecar. Moving a file keeps the size and modification time its
+        sidecar was written from. Default is file_path.
+
+    Returns
+    ---------
+    'bool'
+        True if the file or its sidecar was written
+    """
+    written = False
+    filters = get_filters(compression=compression,
+                          compression_opts=compression_opts,
+                          shuffle=shuffle if compression else False)
+    if compression is not None:
+        written = recompress(file_path, **filters)
+
+    if not sidecar:
+        return written
+
+    if dst is None:
+        dst = file_path
+
+    name = os.path.splitext(os.path.basename(dst))[0]
+    data_type = '{}_data'.format(name.split('_')[1])
+    sidecar_path = get_sidecar_path(dst)
+    if os.path.exists(sidecar_path):
+        try:
+            with h5py.File(sidecar_path, 'r') as h5_file:
+                if data_type in h5_file and is_current(file_path, h5_file):
+                    return written
+        except OSError:
+            pass
+
+    write_sidecar(file_path, data_type, sidecar_path=sidecar_path, **filters)
+    logger.debug('Wrote sidecar of {}'.format(dst))
+
+    return True
@@ -5,13 +5,222 @@ the external and internal store as well as processing the data using a queue.
 import numpy as np
 import pandas as pds
 from scipy.spatial import cKDTree
+from R2PD.allocation import AllocationMatrix
+from R2PD.geodesy import chord_to_km, km_to_chord, to_unit_vectors
 from R2PD.powerdata import NodeCollection
+from R2PD.siteindex import SiteIndex
 
 
-def nearest_power_nodes(node_collection, resource_meta):
+def get_site_arrays(resource_meta):
+    """
+    Extract the arrays of resource node meta-data used to match nodes
+
+    Parameters
+    ----------
+    resource_meta : 'SiteIndex'|'pandas.DataFrame'
+        Index of resource node meta-data, or DataFrame of:
+            [site_id(index), latitude, longitude, (capacity)]
+
+    Returns
+    ---------
+    site_ids : 'numpy.ndarray'
+        Site id of each resource node
+    xyz : 'numpy.ndarray'
+        (n, 3) array of the unit vector of each resource node
+    capacity : 'numpy.ndarray'
+        Capacity of each resource node, None if resource_meta has none
+    """
+    if isinstance(resource_meta, SiteIndex):
+        return (np.asarray(resource_meta.site_ids), resource_meta.xyz,
+                np.array(resource_meta['capacity'], dtype=float))
+
+    site_ids = resource_meta.index.values
+    xyz = to_unit_vectors(resource_meta[['latitude', 'longitude']].values)
+    capacity = None
+    if 'capacity' in resource_meta:
+        capacity = resource_meta['capacity'].values.astype(float)
+
+    return site_ids, xyz, capacity
+
+
+def get_site_tree(resource_meta, xyz):
+    """
+    KD-tree of all resource nodes, the tree saved with a SiteIndex or one
+    built from xyz
+
+    Parameters
+    ----------
+    resource_meta : 'SiteIndex'|'pandas.DataFrame'
+        Index of resource node meta-data, or DataFrame of:
+            [site_id(index), latitude, longitude, (capacity)]
+    xyz : 'numpy.ndarray'
+        (n, 3) array of the unit vector of each resource node
+
+    Returns
+    ---------
+    'scipy.spatial.cKDTree'
+        Tree of xyz
+    """
+    if isinstance(resource_meta, SiteIndex):
+        return resource_meta.tree
+
+    return cKDTree(xyz)
+
+
+def query_nearest(tree, lat_lon, k=1, max_distance=None):
+    """
+    Find the resource nodes nearest to coordinates along the surface of the
+    Earth
+
+    Parameters
+    ----------
+    tree : 'scipy.spatial.cKDTree'
+        Tree of the unit vectors of resource nodes
+    lat_lon : 'numpy.ndarray'
+        (n, 2) array of [latitude, longitude] to query
+    k : 'int'
+        Number of nearest resource nodes to find
+    max_distance : 'float'
+        Only return resource nodes within max_distance km, None for no
+        limit
+
+    Returns
+    ---------
+    dist : 'numpy.ndarray'
+        Great-circle distance in km to each resource node found, inf where
+        there are fewer than k within max_distance
+    pos : 'numpy.ndarray'
+        Position in tree of each resource node found, tree.n where there
+        are fewer than k within max_distance
+    """
+    upper_bound = np.inf
+    if max_distance is not None:
+        upper_bound = km_to_chord(max_distance)
+
+    chord, pos = tree.query(to_unit_vectors(lat_lon), k=k,
+                            distance_upper_bound=upper_bound)
+
+    return chord_to_km(chord), pos
+
+
+def allocate_capacity(tree, r_capacity, node_lat_lon, node_capacity,
+                      candidates=32):
+    """
+    Greedily allocate the capacity of resource nodes to requested nodes.
+    Each round, every requested node with capacity left to fill finds its
+    nearest resource node with capacity remaining, and each such resource
+    node is applied to the nearest of the requested nodes that found it,
+    ties going to the first requested node. Rounds repeat until the
+    capacity of every requested node is filled.
+
+    Nearest resource nodes are looked up in batches of candidates from the
+    tree of all resource nodes, skipping exhausted ones, and a node's batch
+    is only extended once all its candidates are exhausted.
+
+    Parameters
+    ----------
+    tree : 'scipy.spatial.cKDTree'
+        Tree of the unit vectors of all resource nodes
+    r_capacity : 'numpy.ndarray'
+        Capacity of each resource node, in tree order
+    node_lat_lon : 'numpy.ndarray'
+        (n, 2) array of [latitude, longitude] of each requested node
+    node_capacity : 'numpy.ndarray'
+        Capacity to fill for each requested node
+    candidates : 'int'
+        Number of nearest resource nodes initially looked up for each
+        requested node
+
+    Returns
+    ---------
+    nodes : 'numpy.ndarray'
+        Position of requested node of each allocation
+    rows : 'numpy.ndarray'
+        Position in tree of resource node of each allocation
+    fracs : 'numpy.ndarray'
+        Fraction of resource node of each allocation
+    """
+    r_capacity = np.asarray(r_capacity, dtype=float)
+    r_cap = r_capacity.copy()
+    node_lat_lon = np.asarray(node_lat_lon, dtype=float).reshape(-1, 2)
+    need = np.asarray(node_capacity, dtype=float).copy()
+    n_sites = len(r_cap)
+    k = min(candidates, n_sites)
+
+    # Candidate resource nodes of each requested node, nearest first
+    cand_pos = np.full((len(need), k), n_sites, dtype=np.int64)
+    cand_dist = np.full((len(need), k), np.inf)
+    cand_k = np.zeros(len(need), dtype=np.int64)
+    # Sentinel row so that missing candidates are never available
+    avail = np.append(r_cap > 0, False)
+
+    allocations = []
+    while True:
+        left = np.flatnonzero(need > 0)
+        if not len(left):
+            break
+
+        if not avail.any():
+            raise RuntimeError('Resource capacity is exhausted with {:.1f} '
+                               'MW left to fill for {} nodes'
+                               .format(need[left].sum(), len(left)))
+
+        # Extend the candidates of nodes whose candidates are all exhausted
+        stale = left[~avail[cand_pos[left]].any(axis=1)]
+        while len(stale):
+            batch_k = np.maximum(cand_k[stale] * 2, k)
+            new_k = min(int(batch_k.max()), n_sites)
+            if new_k > cand_pos.shape[1]:
+                pad = new_k - cand_pos.shape[1]
+                cand_pos = np.pad(cand_pos, ((0, 0), (0, pad)),
+                                  constant_values=n_sites)
+                cand_dist = np.pad(cand_dist, ((0, 0), (0, pad)),
+                                   constant_values=np.inf)
+
+            dist, pos = query_nearest(tree, node_lat_lon[stale], k=new_k)
+            cand_pos[stale, :new_k] = pos.reshape(len(stale), -1)
+            cand_dist[stale, :new_k] = dist.reshape(len(stale), -1)
+            cand_k[stale] = new_k
+            stale = stale[~avail[cand_pos[stale]].any(axis=1)]
+            stale = stale[cand_k[stale] < n_sites]
+
+        # Nearest available resource node of each node left
+        first = np.argmax(avail[cand_pos[left]], axis=1)
+        pos = cand_pos[left, first]
+        dist = cand_dist[left, first]
+
+        # Nearest node of each resource node, ties to the first node
+        order = np.lexsort((left, dist, pos))
+        pos = pos[order]
+        keep = np.concatenate(([True], pos[1:] != pos[:-1]))
+        pos = pos[keep]
+        n_pos = left[order][keep]
+
+        # Apply each resource node to its nearest node
+        cap = r_cap[pos]
+        node_cap = need[n_pos]
+        filled = node_cap > cap
+        fracs = np.where(filled, cap, node_cap) / r_capacity[pos]
+        r_cap[pos] = np.where(filled, 0, cap + -1 * node_cap)
+        need[n_pos] = np.where(filled, node_cap + -1 * cap, 0)
+        avail[pos] = r_cap[pos] > 0
+        allocations.append((n_pos, pos, fracs))
+
+    if not allocations:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, np.array([], dtype=float)
+
+    nodes, rows, fracs = (np.concatenate(arrays)
+                          for arrays in zip(*allocations))
+
+    return nodes, rows, fracs
+
+
+def allocate_power_nodes(node_collection, resource_meta):
     """
     Fill requested power nodes in node_collection with resource sites in
-    resource_meta
+    resource_meta, returning the matching both per node and as a sparse
+    matrix
 
     Parameters
     ----------
@@ -19,14 +228,17 @@ def nearest_power_nodes(node_collection, resource_meta):
         DataFrame of requested nodes:
             [node_id(index), latitude, longitude, capacity]
         or NodeCollection instance
-    resource_meta : 'pandas.DataFrame'
-        DataFrame with resource node meta-data:
+    resource_meta : 'SiteIndex'|'pandas.DataFrame'
+        Index of resource node meta-data, or DataFrame of:
             [site_id(index), latitude, longitude, capacity]
 
     Returns
     ---------
     nodes : 'pandas.DataFrame'
         Requested nodes with site_ids and fractions of resource for each node
+    allocation : 'AllocationMatrix'
+        Sparse nodes by sites matrix of the fraction of each site applied to
+        each node
     """
     if isinstance(node_collection, NodeCollection):
         node_data = node_collection.node_data
@@ -35,80 +247,56 @@ def nearest_power_nodes(node_collection, resource_meta):
 
     # Create and populate DataFrame from requested list of nodes
     nodes = pds.DataFrame(columns=['latitude', 'longitude', 'capacity',
-                                   'site_id', 'site_fracs', 'r_cap'],
+                                   'site_id', 'site_fracs'],
                           index=node_data.index)
 
     nodes.loc[:, ['latitude', 'longitude', 'capacity']] = node_data.values
-    nodes.loc[:, 'r_cap'] = node_data['capacity (MW)']
 
-    r_nodes = resource_meta[['longitude', 'latitude', 'capacity']].copy()
-    # Add placeholder for remaining capacity available at resource node
-    r_nodes['r_cap'] = r_nodes['capacity']
+    site_ids, xyz, r_capacity = get_site_arrays(resource_meta)
+    tree = get_site_tree(resource_meta, xyz)
+    node_lat_lon = nodes[['latitude', 'longitude']].values
+    n_pos, rows, fracs = allocate_capacity(tree, r_capacity, node_lat_lon,
+                                           node_data['capacity (MW)'].values)
+    allocation = AllocationMatrix.from_allocations(node_data.index.values,
+                                                   n_pos, site_ids[rows],
+                                                   fracs)
 
-    while True:
-        # Extract resource nodes w/ remaining capacity
-        r_left = r_nodes[r_nodes['r_cap'] > 0]
-        r_index = r_left.index
-        try:
-            lat_lon = r_left[['latitude', 'longitude']].to_numpy()
-        except:
-            # To support pandas versions < 0.24.0
-            lat_lon = r_left[['latitude', 'longitude']].values
-        # Create cKDTree of [lat, lon] for resource nodes
-        # w/ available capacity
-        tree = cKDTree(lat_lon)
-
-        # Extract nodes that still have capacity to be filled
-        nodes_left = nodes[nodes['r_cap'] > 0]
-        n_index = nodes_left.index
-        try:
-            node_lat_lon = nodes_left[['latitude', 'longitude']].to_numpy()
-        except:
-            # To support pandas versions < 0.24.0
-            node_lat_lon = nodes_left[['latitude', 'longitude']].values
-
-        # Find first nearest resource node to each requested node
-        dist, pos = tree.query(node_lat_lon, k=1)
-        node_pairs = pds.DataFrame({'pos': pos, 'dist': dist})
-        # Find the nearest pair of resource nodes and requested nodes
-        node_pairs = node_pairs.groupby('pos')['dist'].idxmin()
-
-        # Apply resource node to nearest requested node
-        for i, n in node_pairs.iteritems():
-            r_i = r_index[i]
-            n_i = n_index[n]
-            resource = r_nodes.loc[r_i].copy()
-            file_id = resource.name
-            cap = resource['r_cap']
-            node = nodes.loc[n_i].copy()
-
-            # Determine fract of resource node to apply to requested node
-            if node['r_cap'] > cap:
-                frac = cap / resource['capacity']
-                resource['r_cap'] = 0
-                node['r_cap'] += -1 * cap
-            else:
-                frac = node['r_cap'] / resource['capacity']
-                resource['r_cap'] += -1 * node['r_cap']
-                node['r_cap'] = 0
-
-            if np.all(pds.isnull(node['site_id'])):
-                node['site_id'] = [file_id]
-                node['site_fracs'] = [frac]
-            else:
-                node['site_id'] += [file_id]
-                node['site_fracs'] += [frac]
-
-            r_nodes.loc[r_i] = resource
-            nodes.loc[n_i] = node
-
-        # Continue nearest neighbor search and resource distribution
-        # until capacity is filled for all requested nodes
-        if np.sum(nodes['r_cap'] > 0) == 0:
-            break
+    # Collect the allocations of each node in the order they were made
+    order = np.argsort(n_pos, kind='stable')
+    n_pos = n_pos[order]
+    splits = np.flatnonzero(np.diff(n_pos)) + 1
+    allocated = n_pos[np.concatenate(([0], splits))] if len(n_pos) else []
+    node_sites = np.split(site_ids[rows[order]], splits)
+    node_fracs = np.split(fracs[order], splits)
+    for n, sites, site_fracs in zip(allocated, node_sites, node_fracs):
+        nodes.iat[n, 3] = list(sites)
+        nodes.iat[n, 4] = list(site_fracs)
 
-    return nodes[['latitude', 'longitude', 'capacity', 'site_id',
-                  'site_fracs']]
+    return nodes, allocation
+
+
+def nearest_power_nodes(node_collection, resource_meta):
+    """
+    Fill requested power nodes in node_collection with resource sites in
+    resource_meta
+
+    Parameters
+    ----------
+    node_collection : 'pandas.DataFrame'|'GeneratorNodeCollection'
+        DataFrame of requested nodes:
+            [node_id(index), latitude, longitude, capacity]
+        or NodeCollection instance
+    resource_meta : 'SiteIndex'|'pandas.DataFrame'
+        Index of resource node meta-data, or DataFrame of:
+            [site_id(index), latitude, longitude, capacity]
+
+    Returns
+    ---------
+    nodes : 'pandas.DataFrame'
+        Requested nodes with site_ids and fractions of resource for each node
+    """
+    nodes, _ = allocate_power_nodes(node_collection, resource_meta)
+    return nodes
 
 
 def nearest_met_nodes(node_collection, resource_meta):
@@ -122,8 +310,8 @@ def nearest_met_nodes(node_collection, resource_meta):
         DataFrame of requested nodes:
             [node_id(index), latitude, longitude]
         or NodeCollection instance
-    resource_meta : 'pandas.DataFrame'
-        DataFrame with resource node meta-data:
+    resource_meta : 'SiteIndex'|'pandas.DataFrame'
+        Index of resource node meta-data, or DataFrame of:
             [site_id(index), latitude, longitude]
 
     Returns
@@ -142,15 +330,15 @@ def nearest_met_nodes(node_collection, resource_meta):
 
     nodes.loc[:, ['latitude', 'longitude']] = node_data.values
 
-    # Extract resource nodes lat, lon
-    lat_lon = resource_meta.as_matrix(['latitude', 'longitude'])
-    # Create cKDTree of [lat, lon] for resource nodes w/ available capacity
-    tree = cKDTree(lat_lon)
+    # Extract resource nodes site_id, unit vectors
+    site_ids, xyz, _ = get_site_arrays(resource_meta)
+    # Load or create cKDTree of unit vectors for resource nodes
+    tree = get_site_tree(resource_meta, xyz)
 
     # Extract requested lat, lon
-    node_lat_lon = nodes.as_matrix(['latitude', 'longitude'])
+    node_lat_lon = nodes[['latitude', 'longitude']].values.astype(float)
     # Find first nearest resource node to each requested node
-    _, site_id = tree.query(node_lat_lon, k=1)
-    nodes['site_id'] = site_id
+    _, pos = query_nearest(tree, node_lat_lon)
+    nodes['site_id'] = site_ids[pos]
 
     return nodes[['latitude', 'longitude', 'site_id']]
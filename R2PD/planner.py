@@ -0,0 +1,500 @@
+"""
+This module plans downloads before any data moves: file sizes are looked
+up with concurrent HEAD requests, memoized on disk, so that the total
+download size and duration can be estimated and files can be scheduled
+largest-first.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+
+import pandas as pds
+
+from R2PD import httpclient
+from R2PD.cachelock import CacheLock
+from R2PD.downloader import EventLoopThread
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadPlan(object):
+    """
+    Ordered list of downloads with their sizes and an estimate of the time
+    needed to download them
+    """
+    def __init__(self, items, throughput):
+        """
+        Initialize DownloadPlan
+
+        Parameters
+        ----------
+        items : 'list'
+            List of (key, src, dst, size, estimated) tuples where estimated
+            is True if size is an average rather than the size on the server
+        throughput : 'float'
+            Expected download throughput in bytes/sec
+        """
+        # Largest files first so the longest downloads do not start last
+        self._items = sorted(items, key=lambda item: item[3], reverse=True)
+        self.throughput = throughput
+
+    def __len__(self):
+        """
+        Return number of downloads in plan
+
+        Returns
+        ---------
+        'int'
+            Number of downloads
+        """
+        return len(self._items)
+
+    def __repr__(self):
+        """
+        Print the number of files, size and duration of the plan
+
+        Returns
+        ---------
+        'str'
+            type of plan, number of files, size and estimated duration
+        """
+        return '{n} of {f} files, {s:.2f}GB in ~{d:.0f}s'.format(
+            n=self.__class__.__name__, f=len(self), s=self.size,
+            d=self.duration)
+
+    @property
+    def downloads(self):
+        """
+        Downloads in the order they should be started
+
+        Returns
+        ---------
+        'list'
+            List of (key, src, dst) tuples, largest first
+        """
+        return [(key, src, dst) for key, src, dst, _, _ in self._items]
+
+    @property
+    def total_bytes(self):
+        """
+        Total size of all downloads
+
+        Returns
+        ---------
+        'int'
+            Total bytes to download
+        """
+        return int(sum(item[3] for item in self._items))
+
+    @property
+    def size(self):
+        """
+        Total size of all downloads in GB
+
+        Returns
+        ---------
+        'float'
+            Total GB to download
+        """
+        return self.total_bytes / 1e9
+
+    @property
+    def estimated(self):
+        """
+        Keys of downloads whose size could not be looked up
+
+        Returns
+        ---------
+        'list'
+            Keys of downloads with average sizes
+        """
+        return [item[0] for item in self._items if item[4]]
+
+    @property
+    def duration(self):
+        """
+        Estimated time to complete all downloads
+
+        Returns
+        ---------
+        'float'
+            Seconds to download total_bytes at throughput
+        """
+        return self.total_bytes / self.throughput
+
+    def to_frame(self):
+        """
+        Convert plan to a DataFrame
+
+        Returns
+        ---------
+        'pandas.DataFrame'
+            Table of [key(index), bytes, estimated, src, dst] in download
+            order
+        """
+        rows = [(key, size, estimated, src, dst)
+                for key, src, dst, size, estimated in self._items]
+        plan = pds.DataFrame(rows, columns=['key', 'bytes', 'estimated',
+                                            'src', 'dst'])
+
+        return plan.set_index('key')
+
+    def subset(self, keys):
+        """
+        Plan of some of the downloads, i.e. those to retry
+
+        Parameters
+        ----------
+        keys : 'list'
+            Keys of downloads to keep
+
+        Returns
+        ---------
+        'DownloadPlan'
+            Plan of downloads whose key is in keys, in the same order
+        """
+        keys = set(keys)
+        return DownloadPlan([item for item in self._items if item[0] in keys],
+                            self.throughput)
+
+
+class DownloadPlanner(object):
+    """
+    Looks up the size of remote files with concurrent HEAD requests and
+    plans downloads from them. Sizes and the throughput of previous
+    downloads are memoized in a JSON file shared by all processes using the
+    same cache, which is only updated while its lock is held. Lookups
+    reuse the pooled connections of earlier lookups until close is called.
+    """
+    # Seconds before a memoized size is looked up again
+    MEMO_TTL = 30 * 24 * 3600
+    # Throughput in bytes/sec assumed until downloads have been measured
+    DEFAULT_THROUGHPUT = 1e7
+    # Weight of the latest measurement in the memoized throughput
+    SMOOTHING = 0.5
+
+    def __init__(self, memo_path=None, concurrency=None, bandwidth=None,
+                 connect_timeout=None, read_timeout=None, lock_factory=None):
+        """
+        Initialize DownloadPlanner
+
+        Parameters
+        ----------
+        memo_path : 'str'
+            Path to JSON file in which sizes are memoized, None to only
+            memoize them in memory
+        concurrency : 'int'
+            Number of concurrent HEAD requests, default is
+            ConnectionPool.MAX_PER_HOST
+        bandwidth : 'float'
+            Bandwidth limit in bytes/sec capping the estimated throughput
+        connect_timeout : 'float'
+            Seconds to wait for a connection
+        read_timeout : 'float'
+            Seconds to wait for each response
+        lock_factory : 'function'
+            Function called as lock_factory(memo_path) returning a lock
+            shared by all processes, default is a CacheLock next to
+            memo_path
+        """
+        if concurrency is None:
+            concurrency = httpclient.ConnectionPool.MAX_PER_HOST
+
+        self._memo_path = memo_path
+        self._concurrency = concurrency
+        self._bandwidth = bandwidth
+        self._lock_factory = lock_factory
+        self._lock = threading.Lock()
+        self._memo = self._read_memo()
+        self._pool = httpclient.ConnectionPool(
+            max_per_host=concurrency, connect_timeout=connect_timeout,
+            read_timeout=read_timeout)
+        self._runner = EventLoopThread(name='R2PD-planner')
+        self._finalizer = weakref.finalize(self, self._runner.close,
+                                           self._pool.close)
+
+    def __repr__(self):
+        """
+        Print the type of planner and its memo file
+
+        Returns
+        ---------
+        'str'
+            type of planner and path to memo file
+        """
+        return '{n} memoized in {p}'.format(n=self.__class__.__name__,
+                                            p=self._memo_path)
+
+    def close(self):
+        """
+        Close the pooled connections and stop the event loop of the planner
+        """
+        self._finalizer()
+
+    def _read_memo(self):
+        """
+        Read memoized sizes and throughput from memo_path
+
+        Returns
+        ---------
+        'dict'
+            Memo saved in memo_path, empty if there is none
+        """
+        memo = {'sizes': {}, 'throughput': None}
+        if self._memo_path is not None and os.path.exists(self._memo_path):
+            try:
+                with open(self._memo_path) as f:
+                    saved = json.load(f)
+            except ValueError:
+                logger.warning('Ignoring corrupt memo {}'
+                               .format(self._memo_path))
+            else:
+                memo['sizes'].update(saved.get('sizes', {}))
+                memo['throughput'] = saved.get('throughput')
+
+        return memo
+
+    @staticmethod
+    def _merge_memo(memo, other):
+        """
+        Merge other into memo, keeping the latest size of each file
+
+        Parameters
+        ----------
+        memo : 'dict'
+            Memo updated in place
+        other : 'dict'
+            Memo merged into memo, whose throughput replaces that of memo
+            unless it is None
+        """
+        sizes = memo['sizes']
+        for url, entry in other['sizes'].items():
+            if url not in sizes or sizes[url]['time'] <= entry['time']:
+                sizes[url] = entry
+
+        if other['throughput'] is not None:
+            memo['throughput'] = other['throughput']
+
+    def _memo_lock(self):
+        """
+        Lock on memo_path shared by all processes
+
+        Returns
+        ---------
+        'CacheLock'
+            Unacquired lock on memo_path
+        """
+        if self._lock_factory is not None:
+            return self._lock_factory(self._memo_path)
+
+        memo_dir, memo_name = os.path.split(os.path.abspath(self._memo_path))
+        return CacheLock(memo_dir, memo_name)
+
+    def _save_memo(self):
+        """
+        Write memo to memo_path, merging sizes memoized by other processes
+        while holding the lock on memo_path. Must be called without the
+        lock of this planner held, so that other threads are not blocked
+        while waiting for other processes.
+        """
+        if self._memo_path is None:
+            return
+
+        with self._lock:
+            memo = {'sizes': dict(self._memo['sizes']),
+                    'throughput': self._memo['throughput']}
+
+        with self._memo_lock():
+            saved = self._read_memo()
+            self._merge_memo(saved, memo)
+            tmp_path = '{}.{}.{}.tmp'.format(self._memo_path, os.getpid(),
+                                             threading.get_ident())
+            with open(tmp_path, 'w') as f:
+                json.dump(saved, f)
+
+            os.replace(tmp_path, self._memo_path)
+
+        with self._lock:
+            # Keep any throughput recorded by another thread meanwhile
+            throughput = self._memo['throughput']
+            self._merge_memo(self._memo, saved)
+            if throughput is not None:
+                self._memo['throughput'] = throughput
+
+    @property
+    def throughput(self):
+        """
+        Expected download throughput
+
+        Returns
+        ---------
+        'float'
+            Throughput in bytes/sec measured by previous downloads, or
+            DEFAULT_THROUGHPUT, capped by bandwidth
+        """
+        throughput = self._memo['throughput'] or self.DEFAULT_THROUGHPUT
+        if self._bandwidth:
+            throughput = min(throughput, self._bandwidth)
+
+        return throughput
+
+    async def _head(self, pool, semaphore, url):
+        """
+        Look up the size of url
+
+        Parameters
+        ----------
+        pool : 'ConnectionPool'
+            Pool of connections shared by all requests
+        semaphore : 'asyncio.Semaphore'
+            Semaphore bounding the number of concurrent requests
+        url : 'str'
+            URL of file
+
+        Returns
+        ---------
+        'int'
+            Content-Length of url, None if it could not be determined
+        """
+        async with semaphore:
+            try:
+                response = await pool.head(url)
+            except Exception as ex:
+                logger.debug('Unable to look up size of {}: {}'
+                             .format(url, ex))
+                return None
+
+            try:
+                await response.read()
+            finally:
+                response.close()
+
+            return response.content_length
+
+    async def head_all(self, urls):
+        """
+        Look up the size of all urls concurrently
+
+        Parameters
+        ----------
+        urls : 'list'
+            URLs of files
+
+        Returns
+        ---------
+        'dict'
+            Size of each url, None if it could not be determined
+        """
+        semaphore = asyncio.Semaphore(self._concurrency)
+        sizes = await asyncio.gather(*[self._head(self._pool, semaphore, url)
+                                       for url in urls])
+
+        return dict(zip(urls, sizes))
+
+    def get_sizes(self, urls):
+        """
+        Get the size of each url from the memo, looking up any that are
+        missing or expired
+
+        Parameters
+        ----------
+        urls : 'list'
+            URLs of files
+
+        Returns
+        ---------
+        'dict'
+            Size of each url, None if it could not be determined
+        """
+        now = time.time()
+        sizes = {}
+        with self._lock:
+            for url in urls:
+                entry = self._memo['sizes'].get(url)
+                if entry is not None and now - entry['time'] < self.MEMO_TTL:
+                    sizes[url] = entry['size']
+
+        missing = [url for url in urls if url not in sizes]
+        if missing:
+            logger.debug('Looking up size of {} of {} files'
+                         .format(len(missing), len(urls)))
+            looked_up = self._runner.run(self.head_all(missing))
+            with self._lock:
+                fetched = False
+                for url, size in looked_up.items():
+                    sizes[url] = size
+                    if size is not None:
+                        self._memo['sizes'][url] = {'size': size, 'time': now}
+                        fetched = True
+
+            if fetched:
+                self._save_memo()
+
+        return sizes
+
+    def plan(self, downloads, default_size=0):
+        """
+        Plan downloads from the size of each file on the server
+
+        Parameters
+        ----------
+        downloads : 'list'
+            List of (key, src, dst) tuples
+        default_size : 'float'
+            Size in bytes assumed for files whose size cannot be looked up
+
+        Returns
+        ---------
+        'DownloadPlan'
+            Plan of downloads, largest first
+        """
+        sizes = self.get_sizes([src for _, src, _ in downloads])
+        items = []
+        for key, src, dst in downloads:
+            size = sizes[src]
+            if size is None:
+                items.append((key, src, dst, default_size, True))
+            else:
+                items.append((key, src, dst, size, False))
+
+        plan = DownloadPlan(items, self.throughput)
+        logger.debug(plan)
+
+        return plan
+
+    def record(self, report, elapsed):
+        """
+        Memoize the sizes of completed downloads and the throughput they
+        achieved, saving the memo only if anything was downloaded
+
+        Parameters
+        ----------
+        report : 'DownloadReport'
+            Report of completed downloads
+        elapsed : 'float'
+            Seconds taken by the downloads
+        """
+        if not report.bytes:
+            return
+
+        now = time.time()
+        with self._lock:
+            for result in report:
+                if result.success and not result.cached and result.src:
+                    self._memo['sizes'][result.src] = {'size': result.size,
+                                                       'time': now}
+
+            if elapsed > 0:
+                throughput = report.bytes / elapsed
+                if self._memo['throughput'] is not None:
+                    throughput = (self.SMOOTHING * throughput
+                                  + (1 - self.SMOOTHING)
+                                  * self._memo['throughput'])
+
+                self._memo['throughput'] = throughput
+
+        self._save_memo()
@@ -17,7 +17,9 @@ power system modelers. Functionalities needed include:
 import inspect
 import logging
 import os
+import numpy as np
 import pandas as pds
+from R2PD.allocation import AllocationMatrix
 from R2PD.library import DefaultTimeseriesShaper, DefaultForecastShaper
 
 logger = logging.getLogger(__name__)
@@ -129,7 +131,7 @@ class GeneratorNode(Node):
         self._resource = resource
         self._fcst = forecasts
 
-    def get_power(self, temporal_params, shaper=None):
+    def get_power(self, temporal_params, shaper=None, power_data=None):
         """
         Extracts and processes power data for Node
 
@@ -139,9 +141,14 @@ class GeneratorNode(Node):
             Requiements for timeseries output
         shaper : 'TimeseriesShaper'|'function'
             Method to convert Resource data into required output
+        power_data : 'pandas.DataFrame'
+            Power data of the resource already aggregated with the rest of
+            a NodeCollection, None to extract it from the resource
         """
         self._require_resource()
-        power_data = self._resource.power_data
+        if power_data is None:
+            power_data = self._resource.power_data
+
         if temporal_params is None:
             self.power = power_data
         else:
@@ -525,9 +532,63 @@ class GeneratorNodeCollection(NodeCollection):
         shaper : 'TimeseriesShaper'|'function'
             Method to convert Resource data into required output
         """
+        for store, nodes in self._consolidated_batches('power'):
+            if store is None:
+                for node in nodes:
+                    node.get_power(temporal_params, shaper=shaper)
+
+                continue
+
+            # Aggregate the whole batch with one sparse matrix product
+            resources = [node._resource for node in nodes]
+            allocation = AllocationMatrix.from_lists(
+                np.arange(len(nodes)), [r.site_ids for r in resources],
+                [r.fracs for r in resources])
+            agg = store.aggregate_nodes(allocation)
+            for i, node in enumerate(nodes):
+                power_data = pds.DataFrame({col: agg[col][i]
+                                            for col in store.columns},
+                                           columns=store.columns)
+                node.get_power(temporal_params, shaper=shaper,
+                               power_data=power_data)
+
+    def _consolidated_batches(self, resource_type):
+        """
+        Iterate over nodes in batches whose sites are read from a
+        consolidated store together, followed by the nodes whose sites are
+        not all in the store
+
+        Parameters
+        ----------
+        resource_type : 'str'
+            power or fcst
+
+        Yields
+        ------
+        store : 'ConsolidatedStore'
+            Store containing all sites of the batch, None for the nodes
+            whose sites are not all in a store
+        nodes : 'list'
+            Batch of nodes
+        """
+        stores = {}
+        other = []
         for node in self.nodes:
-            # logger.debug("Node {}".format(node.id))
-            node.get_power(temporal_params, shaper=shaper)
+            resource = getattr(node, '_resource', None)
+            get_store = getattr(resource, 'get_store', None)
+            store = get_store(resource_type) if get_store else None
+            if store is None:
+                other.append(node)
+            else:
+                stores.setdefault(id(store), (store, []))[1].append(node)
+
+        for store, nodes in stores.values():
+            site_lists = [node._resource.site_ids for node in nodes]
+            for batch in store.read_batches(site_lists):
+                yield store, [nodes[i] for i in batch]
+
+        if other:
+            yield None, other
 
     def get_forecasts(self, forecast_params, shaper=None):
         """
@@ -1,7 +1,11 @@
+import os
+
 import click
 import h5py
 import pandas as pds
 
+from R2PD.cachelayout import CacheLayout
+
 
 def extract_h5(h5_path):
     with h5py.File(h5_path, 'r') as f:
@@ -39,5 +43,27 @@ def extract_hdf5(h5_path):
     click.echo('{} converted to {}'.format(h5_path, out_file))
 
 
+@cli.command()
+@click.argument('cache_root', type=click.Path(exists=True))
+@click.argument('dataset', type=click.Choice(['wind', 'solar']))
+@click.argument('resource_type')
+@click.argument('site_id', type=int)
+def extract_site(cache_root, dataset, resource_type, site_id):
+    """
+    Convert the cached file of a site to .csv, finding it in CACHE_ROOT
+    whether the cache is flat or sharded
+    """
+    layout = CacheLayout.load(cache_root)
+    h5_path = layout.get_path(cache_root, dataset, resource_type, site_id)
+    if not os.path.exists(h5_path):
+        raise click.ClickException('{} not found in {}'
+                                   .format(os.path.basename(h5_path),
+                                           cache_root))
+
+    extract_h5(h5_path)
+    out_file = h5_path.replace('.hdf5', '.csv')
+    click.echo('{} converted to {}'.format(h5_path, out_file))
+
+
 if __name__ == '__main__':
     cli()
@@ -3,9 +3,10 @@ This module provides an API to the raw resource data and meta-data.
 """
 import logging
 import os
-import h5py
 import pandas as pds
 
+from R2PD.ingest import read_time_series
+
 logger = logging.getLogger(__name__)
 
 
@@ -23,8 +24,9 @@ class Resource(object):
         ----------
         loc_meta : 'pandas.Series'
             meta data for resource location
-        root_path : 'str'
-            path to internal repository
+        root_path : 'str'|'list'
+            path to internal repository, or list of cache tier directories
+            searched in order for each resource file
         frac : 'float'
             fraction of site's capacity to be used
             Is None for weather nodes
@@ -32,13 +34,16 @@ class Resource(object):
         self._id = int(loc_meta.name)
         self._meta = loc_meta
         self._frac = frac
-        self._root_path = root_path
+        if isinstance(root_path, str):
+            root_path = [root_path]
+
+        self._root_path = list(root_path)
 
         if self.DATASET is not None:
             self._file_name = '{d}_*_{s}.hdf5'.format(d=self.DATASET,
                                                       s=self._id)
 
-        self._file_path = os.path.join(self._root_path, self._file_name)
+        self._file_path = os.path.join(self._root_path[0], self._file_name)
 
     def __repr__(self):
         """
@@ -103,9 +108,32 @@ class Resource(object):
 
         return cap
 
+    def get_file_path(self, resource_type):
+        """
+        Path of the resource file in the first tier containing it
+
+        Parameters
+        ----------
+        resource_type : 'str'
+            power or met or fcst
+
+        Returns
+        ---------
+        'str'
+            Path to resource file, in the first tier if no tier contains it
+        """
+        file_name = self._file_name.replace('*', resource_type)
+        for root_path in self._root_path:
+            file_path = os.path.join(root_path, file_name)
+            if os.path.exists(file_path):
+                return file_path
+
+        return os.path.join(self._root_path[0], file_name)
+
     def extract_data(self, data_type):
         """
-        Abstract method to extract time series data from resource .hdf5 file
+        Abstract method to extract time series data from resource .hdf5 file,
+        or from its read-optimized sidecar if one is current
 
         Parameters
         ----------
@@ -117,27 +145,14 @@ class Resource(object):
         data : 'pandas.DataFrame'
             Time series DataFrame of resource data
         """
-        file_path = self._file_path.replace('*', data_type.split('_')[0])
+        file_path = self.get_file_path(data_type.split('_')[0])
         try:
-            with h5py.File(file_path, 'r') as h5_file:
-                data = h5_file[data_type][...]
+            # Sidecars written at ingest need no timestamp decoding
+            data = read_time_series(file_path, data_type)
         except:
             logger.error(f"Unable to extract data from {file_path}")
             raise
 
-        data = pds.DataFrame(data)
-        cols = list(data.columns)
-        if 'Timestamp' in cols:
-            index_col = 'Timestamp'
-        elif 'time' in cols:
-            index_col = 'time'
-        else:
-            raise RuntimeError('Cannot determine time-index column')
-
-        time_index = data[index_col].str.decode('utf-8')
-        data[index_col] = pds.to_datetime(time_index)
-        data = data.set_index(index_col)
-
         return data
 
     @property
@@ -248,15 +263,19 @@ class ResourceList(object):
     """
     Handles the aggregation of power and forecast data
     """
-    def __init__(self, resources):
+    def __init__(self, resources, stores=None):
         """
         Initialize ResourceList instance
         Parameters
         ----------
         resources : 'list'
             List of Resource objects
+        stores : 'dict'
+            ConsolidatedStore of each resource type, used instead of the
+            per-site files when they contain all sites
         """
         self._resources = resources
+        self._stores = stores if stores is not None else {}
 
     def __len__(self):
         """
@@ -280,6 +299,72 @@ class ResourceList(object):
         """
         return '{} with {} sites'.format(self.__class__.__name__, len(self))
 
+    @property
+    def site_ids(self):
+        """
+        Site ids of resources
+
+        Returns
+        ---------
+        'list'
+            Site id of each resource
+        """
+        return [resource.site_id for resource in self._resources]
+
+    @property
+    def fracs(self):
+        """
+        Fraction of each site used
+
+        Returns
+        ---------
+        'list'
+            Fraction of each resource, 1 where none is set
+        """
+        return [1 if resource._frac is None else resource._frac
+                for resource in self._resources]
+
+    def get_store(self, resource_type):
+        """
+        Consolidated store containing all sites of resource_type
+
+        Parameters
+        ----------
+        resource_type : 'str'
+            power or fcst or fcst-prob
+
+        Returns
+        ---------
+        'ConsolidatedStore'
+            Store containing every site, None if there is none
+        """
+        store = self._stores.get(resource_type)
+        if store is not None and store.contains_all(self.site_ids):
+            return store
+
+        return None
+
+    def _aggregate(self, resource_type):
+        """
+        Aggregate data of all sites from the consolidated store
+
+        Parameters
+        ----------
+        resource_type : 'str'
+            power or fcst or fcst-prob
+
+        Returns
+        ---------
+        'pandas.DataFrame'
+            Time series DataFrame of aggragated data, None if no store
+            contains all sites
+        """
+        store = self.get_store(resource_type)
+        if store is None:
+            return None
+
+        return store.aggregate(self.site_ids, fracs=self.fracs)
+
     @property
     def locations(self):
         """
@@ -324,6 +409,10 @@ class ResourceList(object):
         power_data : 'pandas.DataFrame'
             Time series DataFrame of aggragated power data
         """
+        power_data = self._aggregate('power')
+        if power_data is not None:
+            return power_data
+
         power_data = self._resources[0].power_data
         if len(self) > 1:
             for resource in self._resources[1:]:
@@ -341,6 +430,10 @@ class ResourceList(object):
         fcst_data : 'pandas.DataFrame'
             Time series DataFrame of aggragated forecast data
         """
+        fcst_data = self._aggregate('fcst')
+        if fcst_data is not None:
+            return fcst_data
+
         fcst_data = self._resources[0].forecast_data
         if len(self) > 1:
             for resource in self._resources[1:]:
@@ -359,6 +452,10 @@ class ResourceList(object):
         fcst_prob : 'pandas.DataFrame'
             Time series DataFrame of aggragated forecast probabilities
         """
+        fcst_prob = self._aggregate('fcst-prob')
+        if fcst_prob is not None:
+            return fcst_prob
+
         fcst_prob = self._resources[0].forecast_probabilities
         if len(self) > 1:
             for resource in self._resources[1:]:
@@ -0,0 +1,514 @@
+"""
+This module provides the retry policy and circuit breaker wrapped around
+downloads from external data stores, so that transient server errors are
+retried with exponential backoff and a failing store is not hammered with
+requests that are bound to fail.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+
+from R2PD.httpclient import HTTPError
+from R2PD import Timeout
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(IOError):
+    """
+    Error for requests rejected by an open CircuitBreaker
+    """
+    pass
+
+
+class RetryPolicy(object):
+    """
+    Retries transient failures, i.e. HTTP 5xx responses, connection resets
+    and timeouts, with exponentially increasing and randomly jittered delays
+    """
+    # HTTP statuses other than 5xx worth retrying
+    RETRY_STATUSES = (408, 429)
+
+    def __init__(self, attempts=3, backoff=0.5, max_backoff=30, jitter=1.0):
+        """
+        Initialize RetryPolicy
+
+        Parameters
+        ----------
+        attempts : 'int'
+            Maximum number of attempts of each download, 1 disables retries
+        backoff : 'float'
+            Delay in seconds before the first retry, doubled for each
+            subsequent retry
+        max_backoff : 'float'
+            Maximum delay in seconds between retries
+        jitter : 'float'
+            Fraction of each delay that is randomized, so that downloads
+            failing together do not retry together
+        """
+        if attempts < 1:
+            raise ValueError('attempts must be at least 1, not {}'
+                             .format(attempts))
+
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+
+    def __repr__(self):
+        """
+        Print the type of policy and its number of attempts
+
+        Returns
+        ---------
+        'str'
+            type of policy and attempts
+        """
+        return '{n} with {a} attempts'.format(n=self.__class__.__name__,
+                                              a=self.attempts)
+
+    @classmethod
+    def is_transient(cls, error):
+        """
+        Whether error is a transient failure of the external store
+
+        Parameters
+        ----------
+        error : 'Exception'
+            Error raised by a download
+
+        Returns
+        ---------
+        'bool'
+            True for HTTP 5xx, 408 and 429 responses, connection errors and
+            timeouts
+        """
+        if isinstance(error, HTTPError):
+            return (error.status >= 500
+                    or error.status in cls.RETRY_STATUSES)
+
+        return isinstance(error, (ConnectionError, TimeoutError,
+                                  asyncio.IncompleteReadError))
+
+    def should_retry(self, error, attempt):
+        """
+        Whether a download that failed with error should be attempted again
+
+        Parameters
+        ----------
+        error : 'Exception'
+            Error raised by the download
+        attempt : 'int'
+            Number of attempts made so far
+
+        Returns
+        ---------
+        'bool'
+            True if the error is transient and attempts remain
+        """
+        return attempt < self.attempts and self.is_transient(error)
+
+    def delay(self, attempt):
+        """
+        Delay before the next attempt
+
+        Parameters
+        ----------
+        attempt : 'int'
+            Number of attempts made so far
+
+        Returns
+        ---------
+        'float'
+            Seconds to wait
+        """
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        return delay * (1 - self.jitter * random.random())
+
+    def _record(self, breaker, error, deadline):
+        """
+        Record the failure of an attempt with breaker
+
+        Parameters
+        ----------
+        breaker : 'CircuitBreaker'
+            Circuit breaker of the external store, None for no breaker
+        error : 'Exception'
+            Error raised by the attempt
+        deadline : 'Deadline'
+            Deadline of the request, None for no deadline
+
+        Returns
+        ---------
+        'Exception'
+            Error to report, TimeoutError if the attempt was stopped by the
+            deadline, which is not a failure of the external store
+        """
+        if deadline is not None and deadline.expired:
+            return Timeout.TimeoutError('Deadline of {} seconds exceeded!'
+                                        .format(deadline.sec))
+
+        # Only failures of the external store count against it
+        if breaker is not None:
+            breaker.record(not self.is_transient(error))
+
+        return error
+
+    def call(self, func, breaker=None, deadline=None, name=None):
+        """
+        Call func until it succeeds or fails with an error that should not
+        be retried, waiting for breaker to let each attempt through
+
+        Parameters
+        ----------
+        func : 'function'
+            Function making the request, called without arguments
+        breaker : 'CircuitBreaker'
+            Circuit breaker of the external store, None for no breaker
+        deadline : 'Deadline'
+            Deadline after which no further attempts are made, None for no
+            deadline
+        name : 'str'
+            Name of the request for log messages
+
+        Returns
+        ---------
+        'tuple'
+            (result of func or None, error of the last attempt or None,
+            number of attempts)
+        """
+        timeout = None
+        attempt = 0
+        while True:
+            try:
+                if deadline is not None:
+                    deadline.check()
+                    timeout = deadline.remaining
+
+                if breaker is not None and not breaker.wait(timeout):
+                    continue
+            except (CircuitOpenError, TimeoutError) as ex:
+                return None, ex, attempt
+
+            attempt += 1
+            try:
+                result = func()
+            except Exception as ex:
+                error = self._record(breaker, ex, deadline)
+                if error is not ex or not self.should_retry(ex, attempt):
+                    return None, error, attempt
+
+                delay = self.delay(attempt)
+                logger.debug('Retrying {} in {:.2f}s after attempt {}: {}'
+                             .format(name, delay, attempt, ex))
+                if deadline is not None:
+                    delay = deadline.timeout(delay)
+
+                time.sleep(delay)
+                continue
+
+            if breaker is not None:
+                breaker.record(True)
+
+            return result, None, attempt
+
+    async def call_async(self, func, breaker=None, name=None):
+        """
+        Await func until it succeeds or fails with an error that should not
+        be retried, waiting for breaker to let each attempt through.
+        Deadlines are enforced by cancelling the calling task.
+
+        Parameters
+        ----------
+        func : 'function'
+            Coroutine function making the request, called without arguments
+        breaker : 'CircuitBreaker'
+            Circuit breaker of the external store, None for no breaker
+        name : 'str'
+            Name of the request for log messages
+
+        Returns
+        ---------
+        'tuple'
+            (result of func or None, error of the last attempt or None,
+            number of attempts)
+        """
+        attempt = 0
+        while True:
+            if breaker is not None:
+                try:
+                    await breaker.wait_async()
+                except CircuitOpenError as ex:
+                    return None, ex, attempt
+
+            attempt += 1
+            try:
+                result = await func()
+            except Exception as ex:
+                self._record(breaker, ex, None)
+                if not self.should_retry(ex, attempt):
+                    return None, ex, attempt
+
+                delay = self.delay(attempt)
+                logger.debug('Retrying {} in {:.2f}s after attempt {}: {}'
+                             .format(name, delay, attempt, ex))
+                await asyncio.sleep(delay)
+                continue
+
+            if breaker is not None:
+                breaker.record(True)
+
+            return result, None, attempt
+
+
+class CircuitBreaker(object):
+    """
+    Tracks the outcome of recent requests to an external store. Once the
+    fraction of failures in the window exceeds failure_rate the circuit
+    opens and requests are rejected for reset_timeout seconds, after which
+    a single trial request is let through (half-open) while other requests
+    wait. Its success closes the circuit and its failure opens it again.
+    Requests waiting for the trial are woken when it reports back.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_rate=0.5, window=20, min_requests=10,
+                 reset_timeout=30):
+        """
+        Initialize CircuitBreaker
+
+        Parameters
+        ----------
+        failure_rate : 'float'
+            Fraction of failed requests in the window that opens the circuit
+        window : 'int'
+            Number of most recent requests considered
+        min_requests : 'int'
+            Minimum number of requests in the window before it can open
+        reset_timeout : 'float'
+            Seconds the circuit stays open before a trial request
+        """
+        self.failure_rate = failure_rate
+        self.window = window
+        self.min_requests = min_requests
+        self.reset_timeout = reset_timeout
+
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        # (event loop, future) of coroutines waiting for the trial request
+        self._waiters = []
+        self._state = self.CLOSED
+        self._outcomes = []
+        self._opened_at = None
+        self._trial_at = None
+        self.opened = 0
+        self.rejected = 0
+
+    def __repr__(self):
+        """
+        Print the type of breaker and its state
+
+        Returns
+        ---------
+        'str'
+            type of breaker and state
+        """
+        return '{n} {s}'.format(n=self.__class__.__name__, s=self.state)
+
+    @property
+    def state(self):
+        """
+        State of the circuit
+
+        Returns
+        ---------
+        'str'
+            'closed', 'open' or 'half-open'
+        """
+        with self._lock:
+            self._update_state()
+            return self._state
+
+    def _update_state(self):
+        """
+        Move an open circuit to half-open once reset_timeout has passed
+        """
+        if (self._state == self.OPEN
+                and time.monotonic() - self._opened_at >= self.reset_timeout):
+            self._state = self.HALF_OPEN
+            self._trial_at = None
+            logger.info('Circuit half-open, trying a request')
+
+    def _admit(self):
+        """
+        Admit a request if it may be sent, with the lock held
+
+        Returns
+        ---------
+        'float'
+            0 if the circuit is closed or this is the trial request of a
+            half-open circuit, otherwise seconds until the trial request in
+            flight is replaced
+        """
+        self._update_state()
+        if self._state == self.CLOSED:
+            return 0
+        elif self._state == self.HALF_OPEN:
+            now = time.monotonic()
+            # A trial that never reports back, i.e. was cancelled, is
+            # replaced after reset_timeout
+            if (self._trial_at is None
+                    or now - self._trial_at >= self.reset_timeout):
+                self._trial_at = now
+                return 0
+
+            return self._trial_at + self.reset_timeout - now
+
+        self.rejected += 1
+        raise CircuitOpenError('Circuit open after more than {:.0%} of '
+                               'recent requests failed'
+                               .format(self.failure_rate))
+
+    def check(self):
+        """
+        Check whether a request may be sent
+
+        Returns
+        ---------
+        'bool'
+            True if the circuit is closed or this is the trial request of a
+            half-open circuit, False if the trial request is in flight
+        """
+        with self._lock:
+            return self._admit() == 0
+
+    def wait(self, timeout=None):
+        """
+        Block until a request may be sent, sleeping while the trial request
+        of a half-open circuit is in flight until it reports back or is
+        replaced
+
+        Parameters
+        ----------
+        timeout : 'float'
+            Seconds to wait, None to wait indefinitely
+
+        Returns
+        ---------
+        'bool'
+            True if the request may be sent, False if timeout passed first
+        """
+        end = None if timeout is None else time.monotonic() + timeout
+        with self._changed:
+            while True:
+                delay = self._admit()
+                if not delay:
+                    return True
+
+                if end is not None:
+                    if time.monotonic() >= end:
+                        return False
+
+                    delay = min(delay, end - time.monotonic())
+
+                self._changed.wait(delay)
+
+    async def wait_async(self):
+        """
+        Wait without blocking the event loop until a request may be sent,
+        sleeping while the trial request of a half-open circuit is in flight
+        until it reports back or is replaced
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                delay = self._admit()
+                if not delay:
+                    return
+
+                waiter = (loop, loop.create_future())
+                self._waiters.append(waiter)
+
+            try:
+                await asyncio.wait([waiter[1]], timeout=delay)
+            finally:
+                with self._lock:
+                    if waiter in self._waiters:
+                        self._waiters.remove(waiter)
+
+    def _wake(self):
+        """
+        Wake the requests waiting for the trial request, with the lock held
+        """
+        self._changed.notify_all()
+        for loop, future in self._waiters:
+            try:
+                loop.call_soon_threadsafe(_set_done, future)
+            except RuntimeError:
+                # The waiting event loop has been closed
+                pass
+
+        self._waiters = []
+
+    def record(self, success):
+        """
+        Record the outcome of a request
+
+        Parameters
+        ----------
+        success : 'bool'
+            Whether the request succeeded
+        """
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                if success:
+                    self._close()
+                else:
+                    self._open()
+
+                return
+
+            self._outcomes.append(success)
+            del self._outcomes[:-self.window]
+            failures = self._outcomes.count(False)
+            if (self._state == self.CLOSED
+                    and len(self._outcomes) >= self.min_requests
+                    and failures / len(self._outcomes) > self.failure_rate):
+                self._open()
+
+    def _open(self):
+        """
+        Open the circuit
+        """
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self.opened += 1
+        self._wake()
+        logger.warning('Circuit opened, rejecting requests for {}s'
+                       .format(self.reset_timeout))
+
+    def _close(self):
+        """
+        Close the circuit and forget previous outcomes
+        """
+        self._state = self.CLOSED
+        self._outcomes = []
+        self._wake()
+        logger.info('Circuit closed')
+
+
+def _set_done(future):
+    """
+    Complete future unless it is already done, i.e. cancelled
+
+    Parameters
+    ----------
+    future : 'asyncio.Future'
+        Future of a coroutine waiting for a CircuitBreaker
+    """
+    if not future.done():
+        future.set_result(None)
@@ -0,0 +1,457 @@
+"""
+This module provides a binary index of resource site meta data. Parsing the
+site meta .csv files takes longer than most of the work done by a
+short-lived worker, so each .csv is converted once into one .npy array per
+column, keyed by the hash of the .csv, and every process memory-maps those
+arrays so that they share the same pages. The KD-tree of the unit vectors
+of the sites, used to find the sites nearest to nodes, is saved next to
+those arrays with the hash of the .csv it was built from, so it is built
+once per version of the .csv rather than in every process.
+"""
+import hashlib
+import logging
+import os
+import pickle
+import shutil
+
+import numpy as np
+import pandas as pds
+from scipy.spatial import cKDTree
+
+from R2PD.geodesy import to_unit_vectors
+
+logger = logging.getLogger(__name__)
+
+
+class SiteIndex(object):
+    """
+    Columnar site_id, latitude, longitude and capacity arrays of the
+    resource sites of a dataset, sorted by site_id, with a site_id to row
+    map that is a subtraction when site ids are consecutive and a binary
+    search otherwise, and the unit vectors of all sites with their KD-tree.
+    """
+    COLUMNS = ('site_id', 'latitude', 'longitude', 'capacity')
+    INDEX_EXT = '.siteindex'
+    TREE_FILE = 'kdtree.pkl'
+    # Bytes of the .csv hashed at a time
+    HASH_BLOCK = 2 ** 20
+    # KD-trees loaded or built in this process, by hash of the .csv
+    _trees = {}
+
+    def __init__(self, arrays, csv_hash=None, path=None):
+        """
+        Initialize SiteIndex
+
+        Parameters
+        ----------
+        arrays : 'dict'
+            Array of each column in COLUMNS, sorted by site_id
+        csv_hash : 'str'
+            Hash of the .csv the arrays were built from
+        path : 'str'
+            Path to index directory the arrays are memory-mapped from, None
+            if they are in memory
+        """
+        self._arrays = arrays
+        self.hash = csv_hash
+        self.path = path
+        self._xyz = None
+        self._tree = None
+        site_ids = arrays['site_id']
+        # Consecutive site ids map to rows by subtracting the first site id
+        self._offset = None
+        if len(site_ids) and \
+                site_ids[-1] - site_ids[0] == len(site_ids) - 1:
+            self._offset = int(site_ids[0])
+
+    def __repr__(self):
+        """
+        Print the type of index and its number of sites
+
+        Returns
+        ---------
+        'str'
+            type of index and number of sites
+        """
+        return '{n} of {s} sites'.format(n=self.__class__.__name__,
+                                         s=len(self))
+
+    def __len__(self):
+        """
+        Return number of sites in index
+
+        Returns
+        ---------
+        'int'
+            Number of sites
+        """
+        return len(self._arrays['site_id'])
+
+    def __contains__(self, site_id):
+        """
+        Check whether a site is in the index
+
+        Parameters
+        ----------
+        site_id : 'int'
+            Site id number
+
+        Returns
+        ---------
+        'bool'
+            True if site is in index
+        """
+        try:
+            self.get_rows([site_id])
+        except KeyError:
+            return False
+
+        return True
+
+    def __getitem__(self, column):
+        """
+        Extract a column
+
+        Parameters
+        ----------
+        column : 'str'
+            Column in COLUMNS
+
+        Returns
+        ---------
+        'numpy.ndarray'
+            Values of column in site_id order, memory-mapped read-only
+        """
+        return self._arrays[column]
+
+    @property
+    def site_ids(self):
+        """
+        Site ids in row order
+
+        Returns
+        ---------
+        'numpy.ndarray'
+            Sorted site ids
+        """
+        return self._arrays['site_id']
+
+    @property
+    def lat_lon(self):
+        """
+        Coordinates of all sites
+
+        Returns
+        ---------
+        'numpy.ndarray'
+            (n_sites, 2) array of [latitude, longitude]
+        """
+        return np.column_stack((self._arrays['latitude'],
+                                self._arrays['longitude']))
+
+    @property
+    def xyz(self):
+        """
+        Unit vectors of all sites, computed on first use
+
+        Returns
+        ---------
+        'numpy.ndarray'
+            (n_sites, 3) array of [x, y, z] on the unit sphere
+        """
+        if self._xyz is None:
+            self._xyz = to_unit_vectors(self.lat_lon)
+
+        return self._xyz
+
+    @property
+    def tree(self):
+        """
+        KD-tree of the unit vectors of all sites, loaded on first use and
+        shared by the indices of the same .csv in this process
+
+        Returns
+        ---------
+        'scipy.spatial.cKDTree'
+            Tree of xyz, positions in the tree are rows of the index
+        """
+        if self._tree is None:
+            tree = self._trees.get(self.hash)
+            if tree is None or tree.n != len(self):
+                tree = self.load_tree()
+                if self.hash is not None:
+                    self._trees[self.hash] = tree
+
+            self._tree = tree
+
+        return self._tree
+
+    def load_tree(self):
+        """
+        Load the KD-tree saved in the index directory, building and saving
+        it if there is none or it was built from another version of the
+        .csv
+
+        Returns
+        ---------
+        tree : 'scipy.spatial.cKDTree'
+            Tree of xyz
+        """
+        if self.path is None:
+            return cKDTree(self.xyz)
+
+        tree_path = os.path.join(self.path, self.TREE_FILE)
+        if os.path.exists(tree_path):
+            try:
+                with open(tree_path, 'rb') as f:
+                    saved = pickle.load(f)
+            except Exception as ex:
+                logger.warning('Rebuilding unreadable KD-tree {}: {}'
+                               .format(tree_path, ex))
+            else:
+                tree = saved.get('tree') if isinstance(saved, dict) else None
+                if (tree is not None and saved.get('hash') == self.hash
+                        and tree.n == len(self)):
+                    return tree
+
+                logger.debug('Rebuilding stale KD-tree {}'.format(tree_path))
+
+        tree = cKDTree(self.xyz)
+        tmp_path = '{}.{}.tmp'.format(tree_path, os.getpid())
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump({'hash': self.hash, 'tree': tree}, f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+
+            os.replace(tmp_path, tree_path)
+        except OSError as ex:
+            logger.warning('Unable to save KD-tree {}: {}'
+                           .format(tree_path, ex))
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        return tree
+
+    def get_rows(self, site_ids):
+        """
+        Rows of sites
+
+        Parameters
+        ----------
+        site_ids : 'list'|'numpy.ndarray'
+            Site id numbers
+
+        Returns
+        ---------
+        rows : 'numpy.ndarray'
+            Row of each site
+        """
+        site_ids = np.asarray(site_ids, dtype=np.int64)
+        if self._offset is not None:
+            rows = site_ids - self._offset
+        else:
+            rows = np.searchsorted(self.site_ids, site_ids)
+
+        valid = (rows >= 0) & (rows < len(self))
+        valid[valid] = self.site_ids[rows[valid]] == site_ids[valid]
+        if not np.all(valid):
+            raise KeyError('Sites {} are not in {}'
+                           .format(site_ids[~valid].tolist(), self))
+
+        return rows
+
+    def get_site(self, site_id):
+        """
+        Meta data of a site
+
+        Parameters
+        ----------
+        site_id : 'int'
+            Site id number
+
+        Returns
+        ---------
+        'pandas.Series'
+            latitude, longitude and capacity of site, named by site_id
+        """
+        row = self.get_rows([site_id])[0]
+        return pds.Series({col: self._arrays[col][row]
+                           for col in self.COLUMNS[1:]}, name=int(site_id))
+
+    def to_frame(self, site_ids=None):
+        """
+        Convert index, or the rows of some sites, to a DataFrame
+
+        Parameters
+        ----------
+        site_ids : 'list'
+            Site id numbers, None for all sites
+
+        Returns
+        ---------
+        'pandas.DataFrame'
+            DataFrame of [site_id(index), latitude, longitude, capacity]
+        """
+        if site_ids is None:
+            rows = slice(None)
+        else:
+            rows = self.get_rows(site_ids)
+
+        meta = pds.DataFrame({col: self._arrays[col][rows]
+                              for col in self.COLUMNS})
+        return meta.set_index('site_id')
+
+    @classmethod
+    def hash_file(cls, csv_path):
+        """
+        Hash the contents of a .csv
+
+        Parameters
+        ----------
+        csv_path : 'str'
+            Path to .csv
+
+        Returns
+        ---------
+        'str'
+            SHA-1 hex digest of file
+        """
+        sha = hashlib.sha1()
+        with open(csv_path, 'rb') as f:
+            for block in iter(lambda: f.read(cls.HASH_BLOCK), b''):
+                sha.update(block)
+
+        return sha.hexdigest()
+
+    @classmethod
+    def get_index_path(cls, csv_path, csv_hash, index_dir=None):
+        """
+        Path of the index of a .csv
+
+        Parameters
+        ----------
+        csv_path : 'str'
+            Path to .csv
+        csv_hash : 'str'
+            Hash of .csv
+        index_dir : 'str'
+            Directory holding indices, default is that of the .csv
+
+        Returns
+        ---------
+        'str'
+            '{index_dir}/{csv name}.{hash}.siteindex'
+        """
+        if index_dir is None:
+            index_dir = os.path.dirname(os.path.abspath(csv_path))
+
+        name = os.path.splitext(os.path.basename(csv_path))[0]
+        return os.path.join(index_dir, '{}.{}{}'.format(name, csv_hash[:16],
+                                                        cls.INDEX_EXT))
+
+    @classmethod
+    def read_csv(cls, csv_path):
+        """
+        Parse the columns of a site meta .csv
+
+        Parameters
+        ----------
+        csv_path : 'str'
+            Path to .csv with site_id, latitude, longitude and capacity
+            columns
+
+        Returns
+        ---------
+        arrays : 'dict'
+            Array of each column in COLUMNS, sorted by site_id
+        """
+        meta = pds.read_csv(csv_path)
+        missing = [col for col in cls.COLUMNS if col not in meta]
+        if missing:
+            raise ValueError('{} is missing columns {}'
+                             .format(csv_path, missing))
+
+        meta = meta.sort_values('site_id')
+        arrays = {'site_id': meta['site_id'].values.astype(np.int64)}
+        for col in cls.COLUMNS[1:]:
+            arrays[col] = meta[col].values.astype(np.float64)
+
+        return arrays
+
+    @classmethod
+    def build(cls, csv_path, index_path):
+        """
+        Write the index of a .csv, replacing the indices of older versions
+        of it
+
+        Parameters
+        ----------
+        csv_path : 'str'
+            Path to .csv
+        index_path : 'str'
+            Path of index directory to write
+        """
+        arrays = cls.read_csv(csv_path)
+        tmp_path = '{}.{}.tmp'.format(index_path, os.getpid())
+        os.makedirs(tmp_path, exist_ok=True)
+        for col, values in arrays.items():
+            np.save(os.path.join(tmp_path, '{}.npy'.format(col)), values)
+
+        try:
+            os.rename(tmp_path, index_path)
+        except OSError:
+            # Built concurrently by another process
+            shutil.rmtree(tmp_path)
+            if not os.path.isdir(index_path):
+                raise
+
+        index_dir, index_name = os.path.split(index_path)
+        prefix = index_name.split('.')[0] + '.'
+        for entry in os.scandir(index_dir):
+            if (entry.name.startswith(prefix)
+                    and entry.name.endswith(cls.INDEX_EXT)
+                    and entry.path != index_path):
+                logger.debug('Removing stale site index {}'
+                             .format(entry.path))
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+        logger.info('Built site index of {} sites for {}'
+                    .format(len(arrays['site_id']), csv_path))
+
+    @classmethod
+    def load(cls, csv_path, index_dir=None):
+        """
+        Memory-map the index of a .csv, building it first if the .csv has
+        changed. If the index cannot be written the .csv is parsed into
+        memory instead.
+
+        Parameters
+        ----------
+        csv_path : 'str'
+            Path to .csv
+        index_dir : 'str'
+            Directory holding indices, default is that of the .csv
+
+        Returns
+        ---------
+        'SiteIndex'
+            Index of sites in .csv
+        """
+        csv_hash = cls.hash_file(csv_path)
+        index_path = cls.get_index_path(csv_path, csv_hash,
+                                        index_dir=index_dir)
+        if not os.path.isdir(index_path):
+            try:
+                cls.build(csv_path, index_path)
+            except OSError as ex:
+                logger.warning('Unable to write site index {}, parsing {} '
+                               'in memory: {}'
+                               .format(index_path, csv_path, ex))
+                return cls(cls.read_csv(csv_path), csv_hash=csv_hash)
+
+        arrays = {col: np.load(os.path.join(index_path,
+                                            '{}.npy'.format(col)),
+                               mmap_mode='r')
+                  for col in cls.COLUMNS}
+
+        return cls(arrays, csv_hash=csv_hash, path=index_path)
@@ -0,0 +1,139 @@
+"""
+Benchmark the read time versus disk space tradeoff of recompressing cached
+resource files at ingest. Each file is ingested into a temporary cache with
+each compression setting, with and without a sidecar, and read back through
+Resource.extract_data.
+
+By default the power and fcst test files are used along with a synthetic
+met file, real DR Power files can be benchmarked instead:
+
+    python dev/bench_compression.py --files wind_met_10.hdf5 --reads 5
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import h5py
+import numpy as np
+import pandas as pds
+
+from R2PD import ingest
+from R2PD.resourcedata import Resource
+
+TEST_DIR = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.realpath(__file__))), 'tests')
+SETTINGS = [('as downloaded', {}),
+            ('gzip 4', {'compression': 'gzip', 'compression_opts': 4}),
+            ('gzip 4 + shuffle', {'compression': 'gzip',
+                                  'compression_opts': 4, 'shuffle': True}),
+            ('gzip 9 + shuffle', {'compression': 'gzip',
+                                  'compression_opts': 9, 'shuffle': True}),
+            ('lzf', {'compression': 'lzf'}),
+            ('lzf + shuffle', {'compression': 'lzf', 'shuffle': True})]
+
+
+def write_met(file_path, records=631296):
+    """
+    Write a synthetic 5-minute met file shaped like DR Power wind met data
+    """
+    time_index = pds.date_range('2007-01-01', periods=records, freq='5min')
+    hours = np.arange(records) / 12
+    rng = np.random.default_rng(0)
+    columns = {'wind_speed': 7 + 3 * np.sin(hours / 24 * 2 * np.pi),
+               'wind_direction': (180 + 90 * np.sin(hours / 240)) % 360,
+               'temperature': 285 + 10 * np.sin(hours / 24 * 2 * np.pi),
+               'pressure': 101325 + 500 * np.sin(hours / 120),
+               'density': 1.2 + 0.05 * np.sin(hours / 24 * 2 * np.pi)}
+    dtype = [('time', 'S20')] + [(col, '<f4') for col in columns]
+    data = np.empty(records, dtype=dtype)
+    time_str = time_index.strftime('%Y-%m-%d %H:%M:%S').values
+    data['time'] = time_str.astype('S20')
+    for col, values in columns.items():
+        noise = rng.normal(scale=0.01 * np.abs(values).mean(), size=records)
+        data[col] = np.round(values + noise, 2)
+
+    with h5py.File(file_path, 'w') as h5_file:
+        h5_file.create_dataset('met_data', data=data, chunks=(1233, ),
+                               compression='gzip')
+
+
+def time_reads(file_path, reads):
+    """
+    Median seconds to read file_path through Resource.extract_data
+    """
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    dataset, resource_type, site_id = name.split('_')
+    meta = pds.Series({'latitude': 0, 'longitude': 0, 'capacity': 1},
+                      name=int(site_id))
+    resource = type('BenchResource', (Resource, ), {'DATASET': dataset})(
+        meta, os.path.dirname(file_path))
+    times = []
+    for _ in range(reads):
+        start = time.perf_counter()
+        resource.extract_data('{}_data'.format(resource_type))
+        times.append(time.perf_counter() - start)
+
+    return np.median(times)
+
+
+def run(files, reads):
+    """
+    Run benchmark and print disk size and read time of each setting
+    """
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        rows = []
+        for src in files:
+            for setting, filters in SETTINGS:
+                for sidecar in (False, True):
+                    dst = os.path.join(tmp_dir, os.path.basename(src))
+                    shutil.copyfile(src, dst)
+                    ingest.ingest(dst, sidecar=sidecar, **filters)
+                    size = os.path.getsize(dst)
+                    sidecar_path = ingest.get_sidecar_path(dst)
+                    if os.path.exists(sidecar_path):
+                        size += os.path.getsize(sidecar_path)
+
+                    rows.append((os.path.basename(src), setting, sidecar,
+                                 size / 1e6, time_reads(dst, reads)))
+                    os.remove(dst)
+                    if os.path.exists(sidecar_path):
+                        os.remove(sidecar_path)
+
+        results = pds.DataFrame(rows, columns=['file', 'setting', 'sidecar',
+                                               'MB', 'read_sec'])
+        with pds.option_context('display.width', 120,
+                                'display.float_format', '{:.3f}'.format):
+            print(results.set_index(['file', 'setting', 'sidecar']))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', nargs='*', default=None,
+                        help="""Resource files named
+                        {dataset}_{resource_type}_{site_id}.hdf5, default
+                        is the power and fcst test files and a synthetic met
+                        file""")
+    parser.add_argument('--reads', type=int, default=3,
+                        help='Reads of each file, the median is reported')
+    args = parser.parse_args()
+
+    files = args.files
+    met_dir = None
+    if not files:
+        met_dir = tempfile.mkdtemp()
+        met_path = os.path.join(met_dir, 'wind_met_0.hdf5')
+        write_met(met_path)
+        files = [os.path.join(TEST_DIR, 'wind', 'wind_power_0.hdf5'),
+                 met_path,
+                 os.path.join(TEST_DIR, 'wind', 'wind_fcst_0.hdf5')]
+
+    try:
+        run(files, args.reads)
+    finally:
+        if met_dir is not None:
+            shutil.rmtree(met_dir)
@@ -0,0 +1,117 @@
+"""
+Benchmark download throughput (files/sec) of the asyncio download engine
+against a local HTTP stand-in for DR Power, with and without keep-alive
+connection pooling.
+
+A per-connection delay can be added to the stand-in to emulate the TCP+TLS
+handshake round trips of a remote server:
+
+    python dev/bench_downloads.py --files 2000 --size 100000 --delay 0.02
+"""
+import argparse
+import functools
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from R2PD.downloader import AsyncDownloader
+
+
+class StandInHandler(SimpleHTTPRequestHandler):
+    """
+    HTTP/1.1 file server that sleeps for connect_delay on each new connection
+    """
+    protocol_version = 'HTTP/1.1'
+    connect_delay = 0
+
+    def setup(self):
+        time.sleep(self.connect_delay)
+        super(StandInHandler, self).setup()
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(root, connect_delay=0):
+    """
+    Start local HTTP stand-in serving root in a background thread
+
+    Parameters
+    ----------
+    root : 'str'
+        Directory to serve
+    connect_delay : 'float'
+        Seconds to sleep on each new connection
+
+    Returns
+    ---------
+    server : 'ThreadingHTTPServer'
+        Running server
+    """
+    handler = type('Handler', (StandInHandler, ),
+                   {'connect_delay': connect_delay})
+    handler = functools.partial(handler, directory=root)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    return server
+
+
+def run(files, size, concurrency, connections_per_host, delay):
+    """
+    Run benchmark and print files/sec for each configuration
+    """
+    src_dir = tempfile.mkdtemp()
+    dst_dir = tempfile.mkdtemp()
+    try:
+        payload = os.urandom(size)
+        for i in range(files):
+            with open(os.path.join(src_dir, 'wind_fcst_{}.hdf5'.format(i)),
+                      'wb') as f:
+                f.write(payload)
+
+        server = start_server(src_dir, connect_delay=delay)
+        url = 'http://127.0.0.1:{}'.format(server.server_port)
+        downloads = [(i, '{}/wind_fcst_{}.hdf5'.format(url, i),
+                      os.path.join(dst_dir, 'wind_fcst_{}.hdf5'.format(i)))
+                     for i in range(files)]
+
+        print('{} files of {} bytes, concurrency {}, {} connections/host, '
+              '{}s connect delay'.format(files, size, concurrency,
+                                         connections_per_host, delay))
+        for keep_alive in (False, True):
+            downloader = AsyncDownloader(
+                concurrency=concurrency,
+                connections_per_host=connections_per_host,
+                keep_alive=keep_alive)
+            start = time.monotonic()
+            report = downloader.download(downloads)
+            elapsed = time.monotonic() - start
+            report.raise_for_failures()
+            print('keep_alive={!s:5} {:8.1f} files/sec {:8.1f} MB/sec'
+                  .format(keep_alive, files / elapsed,
+                          report.bytes / elapsed / 1e6))
+
+        server.shutdown()
+    finally:
+        shutil.rmtree(src_dir)
+        shutil.rmtree(dst_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=500)
+    parser.add_argument('--size', type=int, default=100000,
+                        help='File size in bytes')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--connections_per_host', type=int, default=8)
+    parser.add_argument('--delay', type=float, default=0.01,
+                        help='Seconds of emulated handshake per connection')
+    args = parser.parse_args()
+    run(args.files, args.size, args.concurrency, args.connections_per_host,
+        args.delay)
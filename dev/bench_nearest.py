@@ -0,0 +1,111 @@
+"""
+Benchmark nearest resource site search on (latitude, longitude) degrees,
+as done before, against search on unit vectors of the sites. For each
+number of query nodes the time to build the tree and query it is reported,
+along with how often the search on degrees picks a site that is not the
+geodesically nearest one and by how many km it misses. The unit vector
+results are checked against a brute force haversine search of a sample of
+the query nodes.
+
+Sites and nodes are synthetic, spread over the contiguous US and Alaska:
+
+    python dev/bench_nearest.py --sites 126691 --nodes 1000 10000 100000
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pds
+from scipy.spatial import cKDTree
+
+from R2PD.geodesy import haversine
+from R2PD.nearestnodes import query_nearest
+from R2PD.siteindex import SiteIndex
+
+# (latitude range, longitude range, share of points) of each region
+REGIONS = [((25, 49), (-125, -67), 0.9),
+           ((55, 71), (-170, -130), 0.1)]
+# Query nodes checked against a brute force search
+SAMPLE = 500
+
+
+def random_lat_lon(n, rng):
+    """
+    Random coordinates spread over REGIONS
+    """
+    lat_lon = []
+    for lat, lon, share in REGIONS:
+        m = int(round(n * share))
+        lat_lon.append(np.column_stack((rng.uniform(*lat, m),
+                                        rng.uniform(*lon, m))))
+
+    return np.concatenate(lat_lon)[:n]
+
+
+def brute_force(site_lat_lon, node_lat_lon):
+    """
+    Great-circle distance in km to the nearest site of each node
+    """
+    return np.array([haversine(site_lat_lon, node).min()
+                     for node in node_lat_lon])
+
+
+def run(n_sites, n_nodes, seed=0):
+    """
+    Run benchmark and print timings and accuracy for each number of nodes
+    """
+    rng = np.random.default_rng(seed)
+    site_lat_lon = random_lat_lon(n_sites, rng)
+    index = SiteIndex({'site_id': np.arange(n_sites),
+                       'latitude': site_lat_lon[:, 0],
+                       'longitude': site_lat_lon[:, 1],
+                       'capacity': np.ones(n_sites)})
+    rows = []
+    for n in n_nodes:
+        node_lat_lon = random_lat_lon(n, rng)
+
+        start = time.perf_counter()
+        _, deg_pos = cKDTree(site_lat_lon).query(node_lat_lon, k=1)
+        deg_sec = time.perf_counter() - start
+
+        index._xyz = None
+        index._tree = None
+        start = time.perf_counter()
+        km, pos = query_nearest(index.tree, node_lat_lon)
+        xyz_sec = time.perf_counter() - start
+
+        start = time.perf_counter()
+        query_nearest(index.tree, node_lat_lon)
+        query_sec = time.perf_counter() - start
+
+        deg_km = haversine(site_lat_lon[deg_pos], node_lat_lon)
+        missed = deg_km - km
+        sample = rng.choice(n, min(SAMPLE, n), replace=False)
+        error = np.abs(km[sample]
+                       - brute_force(site_lat_lon, node_lat_lon[sample]))
+
+        rows.append((n, deg_sec, xyz_sec, query_sec,
+                     np.mean(deg_pos != pos) * 100, missed.max(),
+                     error.max()))
+
+    results = pds.DataFrame(rows, columns=['nodes', 'degrees_sec',
+                                           'unit_vectors_sec', 'query_sec',
+                                           'degrees_wrong_%',
+                                           'degrees_max_miss_km',
+                                           'brute_force_max_err_km'])
+    with pds.option_context('display.width', 160,
+                            'display.max_columns', None,
+                            'display.float_format', '{:.4f}'.format):
+        print(results.set_index('nodes'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sites', type=int, default=126691,
+                        help='Number of resource sites')
+    parser.add_argument('--nodes', type=int, nargs='*',
+                        default=[1000, 10000, 100000],
+                        help='Numbers of query nodes')
+    args = parser.parse_args()
+
+    run(args.sites, args.nodes)
@@ -57,6 +57,7 @@ setup(
     package_dir={"R2PD": "R2PD"},
     entry_points={
         "console_scripts": ["R2PD=R2PD.cli:main",
+                            "R2PD-cache=R2PD.cli:cache",
                             "R2PD-lite=R2PD.r2pd_lite:cli"],
         "shapers": [
             "timeseries=R2PD.library.shapers:DefaultTimeseriesShaper",
@@ -84,7 +85,8 @@ setup(
         "Programming Language :: Python :: 3.6",
     ],
     test_suite="tests",
-    install_requires=["click", "future", "pandas", "numpy", "h5py", "scipy"],
+    install_requires=["click", "filelock", "future", "pandas", "numpy", "h5py",
+                      "scipy"],
     extras_require={
         "test": test_requires,
         "dev": test_requires + ["pypandoc", "pre-commit"],
@@ -0,0 +1,82 @@
+"""
+Local HTTP stand-in for DR Power shared by the download tests
+"""
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+import os
+import re
+import threading
+import time
+
+import pytest
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+WIND_FILE = os.path.join(TEST_DIR, 'wind', 'wind_power_0.hdf5')
+
+
+class StandInHandler(SimpleHTTPRequestHandler):
+    """
+    Serves tests/wind/wind_power_0.hdf5 for every wind power site and
+    records the method, path and headers of each request
+    """
+    protocol_version = 'HTTP/1.1'
+    # Seconds each GET is delayed by, so that requests overlap
+    delay = 0
+    # Replaced for each server by the server fixture
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def translate_path(self, path):
+        if re.match(r'/wind/\d+/wind_power_\d+\.hdf5$', path):
+            return WIND_FILE
+
+        return os.devnull
+
+    def send_head(self):
+        self.requests.append((self.command, self.path, dict(self.headers)))
+        if self.command == 'GET' and self.delay:
+            time.sleep(self.delay)
+
+        return super(StandInHandler, self).send_head()
+
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    ThreadingHTTPServer accepting the connections of several processes at
+    once, connections beyond the listen backlog are only retried after
+    seconds
+    """
+    daemon_threads = True
+    request_queue_size = 128
+
+    @property
+    def url(self):
+        """
+        Root URL of the server
+        """
+        return 'http://127.0.0.1:{}'.format(self.server_port)
+
+    @property
+    def requests(self):
+        """
+        Requests recorded by the handler
+        """
+        return self.RequestHandlerClass.requests
+
+
+@pytest.fixture
+def server(request):
+    """
+    StandInServer running in a thread. Tests can choose another handler by
+    parametrizing server indirectly with its class, and change the class
+    attributes of server.RequestHandlerClass without affecting other tests.
+    """
+    handler = getattr(request, 'param', StandInHandler)
+    handler = type(handler.__name__, (handler,), {'requests': []})
+    srv = StandInServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
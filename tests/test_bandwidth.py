@@ -0,0 +1,95 @@
+"""
+Test pacing of downloads by the token-bucket bandwidth limiter against a
+local HTTP stand-in for DR Power
+"""
+import os
+import threading
+import time
+
+import pytest
+
+from conftest import WIND_FILE
+from R2PD.bandwidth import TokenBucket
+from R2PD.datastore import DRPower, InternalDataStore
+
+
+def test_bucket_pacing():
+    """
+    Threads sharing a bucket are paced to its rate once the burst is spent
+    """
+    rate, burst, chunk = 1e6, 1e5, 10000
+    total = 5e5
+    bucket = TokenBucket(rate, burst=burst)
+
+    def consume():
+        for _ in range(int(total / 4 / chunk)):
+            bucket.consume(chunk)
+
+    workers = [threading.Thread(target=consume) for _ in range(4)]
+    start = time.monotonic()
+    for worker in workers:
+        worker.start()
+
+    for worker in workers:
+        worker.join()
+
+    elapsed = time.monotonic() - start
+    expected = (total - burst) / rate
+    assert expected * 0.9 <= elapsed < expected + 0.5
+
+
+def test_bucket_burst():
+    """
+    Consumption within the burst does not wait
+    """
+    bucket = TokenBucket(1e3, burst=1e5)
+    start = time.monotonic()
+    for _ in range(10):
+        bucket.consume(1e4)
+
+    assert time.monotonic() - start < 0.1
+
+    with pytest.raises(ValueError):
+        TokenBucket(0)
+
+
+def test_shared_bucket_keeps_its_rate(monkeypatch, caplog):
+    """
+    The shared bucket is only reconfigured explicitly
+    """
+    monkeypatch.setattr(TokenBucket, '_global', None)
+    assert TokenBucket.shared() is None
+
+    bucket = TokenBucket.shared(1e6)
+    assert TokenBucket.shared() is bucket
+    assert TokenBucket.shared(1e6, burst=1e6) is bucket
+    assert not caplog.records
+
+    assert TokenBucket.shared(2e6) is bucket
+    assert 'Ignoring bandwidth' in caplog.text
+    assert bucket.reserve(2e6) == pytest.approx(1, rel=0.01)
+
+    TokenBucket.shared().configure(2e6)
+    assert bucket.reserve(0) == pytest.approx(0.5, rel=0.01)
+
+
+def test_download_pacing(server, tmpdir, monkeypatch):
+    """
+    DRPower downloads share the configured bandwidth budget
+    """
+    monkeypatch.setattr(TokenBucket, '_global', None)
+    bandwidth, burst = 6e6, 1e6
+    cache = InternalDataStore(str(tmpdir), size=None)
+    repo = DRPower(local_cache=cache, threads=2, bandwidth=int(bandwidth),
+                   burst=int(burst))
+    repo.DATA_ROOT = server.url
+
+    start = time.monotonic()
+    report = repo.download_resource_data('wind', [0, 1], 'power')
+    elapsed = time.monotonic() - start
+    report.raise_for_failures()
+
+    total = 2 * os.path.getsize(WIND_FILE)
+    assert report.bytes == total
+    expected = (total - burst) / bandwidth
+    assert expected * 0.9 <= elapsed < expected + 1
@@ -0,0 +1,86 @@
+"""
+Test the SQLite cache index
+"""
+import os
+
+import pytest
+
+from R2PD.cacheindex import CacheIndex
+
+
+@pytest.fixture
+def index(tmpdir):
+    index = CacheIndex(os.path.join(str(tmpdir), 'index.sqlite'))
+    yield index
+    index.close()
+
+
+def add(index, site_id, size=100, mtime=1.0):
+    """
+    Index a wind power file for site_id
+    """
+    index.add('wind', 'power', site_id,
+              'wind_power_{}.hdf5'.format(site_id), size, mtime)
+
+
+def test_version_ignores_accesses(index):
+    add(index, 0)
+    version = index.version
+
+    index.touch('wind', 'power', [0])
+    index.set_valid('wind', 'power', 0, 100, 1.0)
+    index.pin('wind', 'power', [0])
+    index.unpin()
+    assert index.version == version
+
+    # Removing a file that is not indexed changes nothing
+    index.remove('wind', 'power', 1)
+    assert index.version == version
+
+    add(index, 0, size=200)
+    assert index.version > version
+
+    # Other connections see changes made through this one
+    other = CacheIndex(index._path)
+    version = other.version
+    index.remove('wind', 'power', 0)
+    assert other.version > version
+    other.close()
+
+
+def candidates(index, policy):
+    """
+    Site ids of eviction candidates in eviction order
+    """
+    return [row[2] for row in index.eviction_candidates(policy)]
+
+
+def test_eviction_order(index):
+    for site_id in range(4):
+        add(index, site_id, mtime=10.0 + site_id)
+
+    # Site 3 is accessed most often but least recently, site 0 never
+    for when in (20, 21, 22):
+        index.touch('wind', 'power', [3], when=when)
+
+    index.touch('wind', 'power', [1], when=25)
+    index.touch('wind', 'power', [2], when=30)
+    assert candidates(index, 'lru') == [0, 3, 1, 2]
+    # Ties in frequency are broken by recency
+    assert candidates(index, 'lfu') == [0, 1, 2, 3]
+
+    with pytest.raises(ValueError):
+        index.eviction_candidates('fifo')
+
+
+def test_pinned_files_are_not_candidates(index):
+    for site_id in range(3):
+        add(index, site_id)
+
+    # Files can be pinned before they are cached
+    index.pin('wind', 'power', [1, 5])
+    assert candidates(index, 'lru') == [0, 2]
+    assert sorted(index.pins()['site_id']) == [1, 5]
+
+    assert index.unpin(site_ids=[1]) == 1
+    assert candidates(index, 'lru') == [0, 1, 2]
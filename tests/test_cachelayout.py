@@ -0,0 +1,132 @@
+"""
+Test migration of a flat cache to a sharded layout, using empty placeholder
+resource files
+"""
+import os
+
+import pytest
+
+from R2PD import cachelayout
+from R2PD.cachelayout import CacheLayout
+from R2PD.datastore import InternalDataStore
+from R2PD.ingest import get_sidecar_path
+
+FILES = ['wind_power_0.hdf5', 'wind_power_5.hdf5', 'wind_met_12.hdf5',
+         'wind_power_25.hdf5', 'solar_power_3.hdf5']
+
+
+def touch(path):
+    """
+    Create empty file at path
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'w').close()
+
+
+@pytest.fixture
+def cache_root(tmpdir):
+    """
+    Flat cache of placeholder files, with a sidecar and an unrecognized file
+    """
+    cache_root = str(tmpdir)
+    for name in FILES:
+        touch(os.path.join(cache_root, name.split('_')[0], name))
+
+    touch(get_sidecar_path(os.path.join(cache_root, 'wind',
+                                        'wind_power_5.hdf5')))
+    touch(os.path.join(cache_root, 'wind', 'notes.hdf5'))
+
+    return cache_root
+
+
+def layout_files(cache_root):
+    """
+    Paths of all files in the dataset directories relative to cache_root
+    """
+    files = []
+    for dataset in CacheLayout.DATASETS:
+        for dir_path, _, names in os.walk(os.path.join(cache_root, dataset)):
+            files += [os.path.relpath(os.path.join(dir_path, name),
+                                      cache_root) for name in names]
+
+    return sorted(files)
+
+
+SHARDED = sorted([os.path.join('wind', '0000', 'wind_power_0.hdf5'),
+                  os.path.join('wind', '0000', 'wind_power_5.hdf5'),
+                  get_sidecar_path(os.path.join('wind', '0000',
+                                                'wind_power_5.hdf5')),
+                  os.path.join('wind', '0001', 'wind_met_12.hdf5'),
+                  os.path.join('wind', '0002', 'wind_power_25.hdf5'),
+                  os.path.join('wind', 'notes.hdf5'),
+                  os.path.join('solar', '0000', 'solar_power_3.hdf5')])
+
+
+def test_migrate_flat_to_sharded(cache_root):
+    flat = layout_files(cache_root)
+    layout = CacheLayout(shard_size=10)
+    assert layout.migrate(cache_root,
+                          InternalDataStore.parse_file_name) == len(FILES)
+    assert layout_files(cache_root) == SHARDED
+    assert CacheLayout.load(cache_root) == layout
+
+    # Migrating again has nothing to move
+    assert layout.migrate(cache_root, InternalDataStore.parse_file_name) == 0
+
+    # Migrating back removes the empty shards
+    assert CacheLayout().migrate(cache_root,
+                                 InternalDataStore.parse_file_name) == \
+        len(FILES)
+    assert layout_files(cache_root) == flat
+    assert os.listdir(os.path.join(cache_root, 'solar')) == \
+        ['solar_power_3.hdf5']
+    assert not CacheLayout.load(cache_root).sharded
+
+
+def test_interrupted_migration_resumes(cache_root, monkeypatch):
+    replace = os.replace
+    calls = []
+
+    def interrupt(src, dst):
+        calls.append(src)
+        if len(calls) > 2:
+            raise KeyboardInterrupt
+
+        replace(src, dst)
+
+    layout = CacheLayout(shard_size=10)
+    monkeypatch.setattr(cachelayout.os, 'replace', interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        layout.migrate(cache_root, InternalDataStore.parse_file_name)
+
+    monkeypatch.undo()
+    # The layout is only recorded once all files have been moved
+    assert not os.path.exists(os.path.join(cache_root,
+                                           CacheLayout.LAYOUT_FILE))
+
+    moved = layout.migrate(cache_root, InternalDataStore.parse_file_name)
+    assert 0 < moved < len(FILES)
+    assert layout_files(cache_root) == SHARDED
+    assert CacheLayout.load(cache_root) == layout
+
+
+def test_migrated_cache_is_reindexed(cache_root):
+    # Empty files are not indexed
+    for name in FILES:
+        with open(os.path.join(cache_root, name.split('_')[0], name),
+                  'wb') as f:
+            f.write(b'0')
+
+    cache = InternalDataStore(cache_root, size=None, validate=False)
+    assert not cache._layout.sharded
+    assert len(cache.get_cache_meta('wind')) == 4
+
+    assert cache.migrate(shard_size=10) == len(FILES)
+    path = cache.get_file_path('wind', 'met', 12)
+    assert path == os.path.join(cache_root, 'wind', '0001',
+                                'wind_met_12.hdf5')
+    assert cache._index.get('wind', 'met', 12)['path'] == path
+
+    # Other processes open the cache in its recorded layout
+    other = InternalDataStore(cache_root, size=None, validate=False)
+    assert other.get_file_path('wind', 'met', 12) == path
@@ -0,0 +1,63 @@
+"""
+Test that cache locks exclude each other across processes while cleaning
+up after themselves
+"""
+import gc
+import multiprocessing
+import os
+
+from R2PD.cachelock import CacheLock
+
+
+def increment(lock_root, counter_path, times):
+    """
+    Increment the counter in counter_path, holding a new lock each time
+    """
+    for _ in range(times):
+        with CacheLock(lock_root, 'counter'):
+            with open(counter_path) as f:
+                count = int(f.read())
+
+            with open(counter_path, 'w') as f:
+                f.write(str(count + 1))
+
+
+def test_locks_are_removed_on_release(tmpdir):
+    lock_root = str(tmpdir)
+    lock = CacheLock(lock_root, 'wind_power_0.hdf5')
+    other = CacheLock(lock_root, 'wind_power_0.hdf5')
+    with lock:
+        assert os.listdir(lock_root) == ['wind_power_0.hdf5.lock']
+        assert not other.try_acquire()
+
+    assert os.listdir(lock_root) == []
+    assert other.try_acquire()
+    other.release()
+
+    path = os.path.join(lock_root, 'wind_power_0.hdf5.lock')
+    assert path in CacheLock._thread_locks
+    del lock, other
+    gc.collect()
+    assert path not in CacheLock._thread_locks
+
+
+def test_removed_locks_still_exclude(tmpdir):
+    lock_root = str(tmpdir)
+    counter_path = os.path.join(lock_root, 'counter')
+    with open(counter_path, 'w') as f:
+        f.write('0')
+
+    processes = [multiprocessing.Process(target=increment,
+                                         args=(lock_root, counter_path, 50))
+                 for _ in range(4)]
+    for process in processes:
+        process.start()
+
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+    with open(counter_path) as f:
+        assert int(f.read()) == 200
+
+    assert os.listdir(lock_root) == ['counter']
@@ -0,0 +1,123 @@
+"""
+Test the AIMD concurrency controller against a fake clock
+"""
+import threading
+
+import pytest
+
+from R2PD import concurrency
+from R2PD.concurrency import ConcurrencyController
+
+
+class FakeClock(object):
+    """
+    Stand-in for the time module whose clock only moves when advanced
+    """
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def advance(self, sec):
+        self.now += sec
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(concurrency, 'time', clock)
+    return clock
+
+
+def run_window(controller, clock, errors=0, latency=0.1,
+               throughput=10 ** 7):
+    """
+    Record one window of requests over a second at throughput bytes/sec,
+    the first errors of them failed, and return the reason of the
+    adjustment
+    """
+    start = clock.now
+    count = 2 * controller.limit
+    for i in range(count):
+        clock.now = start + controller.WINDOW * (i + 1) / count
+        controller.record(throughput / count, latency, i >= errors)
+
+    return controller.history[-1]['reason']
+
+
+def test_additive_increase_up_to_max(clock):
+    controller = ConcurrencyController(min_limit=1, max_limit=4, initial=2)
+    limits = []
+    for _ in range(4):
+        assert run_window(controller, clock) == 'throughput'
+        limits.append(controller.limit)
+
+    assert limits == [3, 4, 4, 4]
+
+    # No adjustment before the window is complete
+    controller.record(10 ** 6, 0.1, False)
+    assert len(controller.history) == 4
+
+
+def test_multiplicative_decrease_on_errors_down_to_min(clock):
+    controller = ConcurrencyController(min_limit=2, max_limit=16,
+                                       initial=16)
+    limits = []
+    for _ in range(4):
+        assert run_window(controller, clock, errors=controller.limit) == \
+            'error rate'
+        limits.append(controller.limit)
+
+    assert limits == [8, 4, 2, 2]
+
+
+def test_multiplicative_decrease_on_latency(clock):
+    controller = ConcurrencyController(min_limit=1, max_limit=16,
+                                       initial=8)
+    run_window(controller, clock, latency=0.1)
+    assert controller.limit == 9
+
+    # Latency more than doubles without any gain in throughput
+    run_window(controller, clock, latency=0.5)
+    assert controller.history[-1]['reason'] == 'latency'
+    assert controller.limit == 4
+
+    # A drop in throughput decreases the limit whatever the latency
+    run_window(controller, clock, latency=0.1, throughput=10 ** 6)
+    assert controller.history[-1]['reason'] == 'throughput drop'
+    assert controller.limit == 2
+
+
+def test_fixed_limit_is_not_adjusted(clock):
+    controller = ConcurrencyController(min_limit=3, max_limit=3)
+    assert not controller.adaptive
+    for _ in range(10):
+        clock.advance(1)
+        controller.record(10 ** 6, 10, False)
+
+    assert controller.limit == 3
+    assert not controller.history
+
+
+def test_records_from_threads_are_counted(clock):
+    controller = ConcurrencyController(min_limit=1, max_limit=100,
+                                       initial=100)
+
+    def record():
+        for _ in range(1000):
+            controller.record(1, 0.1, True)
+
+    threads = [threading.Thread(target=record) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    # The clock has not moved, so the window is still open
+    assert controller._window_count == 8000
+    assert controller._window_bytes == 8000
@@ -0,0 +1,136 @@
+"""
+Test reads of cached sites from a consolidated time by site store against
+reads of their per-site files
+"""
+import os
+import shutil
+
+import h5py
+import numpy as np
+import pandas as pds
+import pytest
+
+from R2PD.allocation import AllocationMatrix
+from R2PD.consolidate import ConsolidatedStore
+from R2PD.datastore import InternalDataStore
+from R2PD.powerdata import GeneratorNodeCollection, WindGeneratorNode
+from R2PD.resourcedata import ResourceList, WindResource
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+WIND_FILE = os.path.join(TEST_DIR, 'wind', 'wind_power_0.hdf5')
+SITES = [0, 1, 2, 3]
+
+
+def add_site(cache, site_id):
+    """
+    Copy the test wind power file into cache as site_id
+    """
+    dst = cache.get_file_path('wind', 'power', site_id)
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    shutil.copyfile(WIND_FILE, dst)
+    cache.add_files([dst])
+
+    return dst
+
+
+@pytest.fixture
+def cache(tmpdir):
+    cache = InternalDataStore(str(tmpdir), size=None)
+    for site_id in SITES:
+        add_site(cache, site_id)
+
+    cache.consolidate('wind', 'power')
+
+    return cache
+
+
+def test_quarantined_sites_are_stale(cache):
+    store = cache.get_consolidated('wind')['power']
+    assert store.contains_all(SITES)
+
+    cache.quarantine(cache.get_file_path('wind', 'power', 1))
+    assert not store.contains_all(SITES)
+    assert store.contains_all([0, 2, 3])
+
+    # Other processes see the change through the cache index
+    other = InternalDataStore(cache._cache_root, size=None)
+    assert not other.get_consolidated('wind')['power'].contains_all([1])
+
+
+def test_replaced_sites_are_stale(cache):
+    path = add_site(cache, 2)
+    os.utime(path, (1, 1))
+    cache.add_files([path])
+
+    store = cache.get_consolidated('wind')['power']
+    assert not store.contains_all([2])
+    assert store.contains_all([0, 1, 3])
+
+    cache.consolidate('wind', 'power')
+    assert cache.get_consolidated('wind')['power'].contains_all(SITES)
+
+
+def get_power(cache, stores):
+    """
+    Power of two nodes sharing site 1, read with or without stores
+    """
+    allocations = {10: ([0, 1], [1.0, 0.25]), 11: ([1, 2, 3],
+                                                     [0.75, 0.5, 1.0])}
+    nodes = GeneratorNodeCollection([WindGeneratorNode(node_id, 40, -100,
+                                                       capacity=10)
+                                     for node_id in allocations])
+    resources = []
+    for site_ids, fracs in allocations.values():
+        sites = [WindResource(pds.Series({'latitude': 40, 'longitude': -100,
+                                          'capacity': 16}, name=site_id),
+                              cache.get_roots('wind', site_id), frac=frac)
+                 for site_id, frac in zip(site_ids, fracs)]
+        resources.append(ResourceList(sites, stores=stores))
+
+    nodes.assign_resource(resources)
+    nodes.get_power(None)
+
+    return [node.power for node in nodes.nodes]
+
+
+def test_consolidated_power_matches_files(cache):
+    stores = cache.get_consolidated('wind')
+    assert stores['power'].dtypes == {'power': np.dtype('float32')}
+
+    expected = get_power(cache, {})
+    for power, file_power in zip(get_power(cache, stores), expected):
+        assert list(power.dtypes) == list(file_power.dtypes)
+        assert power.index.equals(file_power.index)
+        np.testing.assert_allclose(power.values, file_power.values,
+                                   rtol=1e-6)
+
+
+def test_weighted_integer_sums_are_not_truncated(tmpdir):
+    data = np.zeros(4, dtype=[('time', 'S20'), ('power', '<f4'),
+                              ('turbines', '<i4')])
+    data['time'] = [str(time).encode() for time
+                    in pds.date_range('2007-01-01', periods=4, freq='5min')]
+    file_paths = {}
+    for site_id in [0, 1]:
+        data['power'] = np.arange(4) + site_id
+        data['turbines'] = 2 * site_id + 1
+        file_paths[site_id] = os.path.join(str(tmpdir),
+                                           'wind_power_{}.hdf5'
+                                           .format(site_id))
+        with h5py.File(file_paths[site_id], 'w') as h5_file:
+            h5_file['power_data'] = data
+
+    store = ConsolidatedStore.build(os.path.join(str(tmpdir), 'store.h5'),
+                                    file_paths, 'power_data')
+    assert store.dtypes['turbines'] == np.dtype('int32')
+
+    agg = store.aggregate([0, 1], fracs=[0.5, 0.25])
+    assert agg['power'].dtype == np.dtype('float32')
+    assert agg['turbines'].dtype == np.dtype('float64')
+    np.testing.assert_array_equal(agg['turbines'], 1.25)
+    np.testing.assert_allclose(agg['power'], 0.75 * np.arange(4) + 0.25)
+
+    allocation = AllocationMatrix.from_lists([10], [[0, 1]], [[0.5, 0.25]])
+    agg = store.aggregate_nodes(allocation)
+    assert agg['power'][10].dtype == np.dtype('float32')
+    np.testing.assert_array_equal(agg['turbines'][10], 1.25)
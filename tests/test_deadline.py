@@ -0,0 +1,78 @@
+"""
+Test that downloads running when the deadline of a batch expires stop, and
+that the batch reports the sites downloaded before it
+"""
+import os
+import threading
+import time
+
+import pytest
+
+from R2PD.datastore import ExternalDataStore, InternalDataStore
+from R2PD.Timeout import Deadline, TimeoutError
+
+SITES = list(range(6))
+SLOW_SITES = [2, 3]
+
+
+class StandInStore(ExternalDataStore):
+    """
+    External store whose downloads of SLOW_SITES run until the deadline, as
+    downloads that cooperate with it do, and whose other downloads are
+    immediate
+    """
+    def __init__(self, local_cache, threads=None):
+        super(StandInStore, self).__init__(local_cache=local_cache,
+                                           threads=threads)
+        self.lock = threading.Lock()
+        self.started = []
+        self.running = 0
+
+    def download_resource(self, dataset, site_id, resource_type,
+                          deadline=None):
+        with self.lock:
+            self.started.append(site_id)
+            self.running += 1
+
+        try:
+            if site_id in SLOW_SITES:
+                while not deadline.expired:
+                    time.sleep(0.01)
+
+                raise TimeoutError('Deadline of {} seconds exceeded!'
+                                   .format(deadline.sec))
+
+            dst = self._local_cache.get_file_path(dataset, resource_type,
+                                                  site_id)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            with open(dst, 'wb') as f:
+                f.write(b'0')
+        finally:
+            with self.lock:
+                self.running -= 1
+
+
+@pytest.mark.parametrize('threads, started', [(None, [0, 1, 2]),
+                                              (2, [0, 1, 2, 3])])
+def test_deadline_reports_partial_download(tmpdir, threads, started):
+    cache = InternalDataStore(str(tmpdir), size=None, validate=False)
+    store = StandInStore(cache, threads=threads)
+
+    start = time.monotonic()
+    report = store.download_resource_data('wind', SITES, 'power',
+                                          deadline=Deadline(0.5))
+    assert time.monotonic() - start < 5
+
+    # Running downloads stopped at the deadline, later ones never started
+    assert store.running == 0
+    assert sorted(store.started) == started
+    assert sorted(report.succeeded) == [0, 1]
+    assert sorted(report.failed) == [2, 3, 4, 5]
+    for result in report:
+        if not result.success:
+            assert isinstance(result.error, TimeoutError)
+            assert not os.path.exists(result.dst)
+
+    # Abandoned downloads do not count against the external store
+    assert store._breaker._outcomes == [True, True]
+    assert cache._index.get('wind', 'power', 1) is not None
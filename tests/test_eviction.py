@@ -0,0 +1,88 @@
+"""
+Test eviction of cached files once the local cache is full, and that
+pinned files are never evicted
+"""
+import os
+
+import pytest
+
+from R2PD.datastore import InternalDataStore
+
+FILE_SIZE = 10 ** 6
+SITES = list(range(5))
+
+
+def cached_sites(cache):
+    """
+    Site ids of the wind power files left in cache
+    """
+    entries = cache._index.entries('wind')
+    sites = sorted(entries['site_id'])
+    for site_id in SITES:
+        path = cache.get_file_path('wind', 'power', site_id)
+        assert os.path.exists(path) == (site_id in sites)
+
+    return sites
+
+
+@pytest.fixture
+def cache(tmpdir):
+    """
+    Cache of 5.5MB holding five placeholder files of 1MB, accessed in the
+    order of their site ids, site 4 most often
+    """
+    cache = InternalDataStore(str(tmpdir), size=5.5 * FILE_SIZE / 1e9,
+                              validate=False)
+    paths = []
+    for site_id in SITES:
+        path = cache.get_file_path('wind', 'power', site_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.truncate(FILE_SIZE)
+
+        paths.append(path)
+
+    cache.add_files(paths)
+    for when, site_id in enumerate(SITES):
+        for _ in range(1 + site_id // 4):
+            cache._index.touch('wind', 'power', [site_id], when=when + 1)
+
+    return cache
+
+
+def test_lru_frees_the_download_size(cache):
+    cache.test_cache_size(2 * FILE_SIZE / 1e9)
+    assert cached_sites(cache) == [2, 3, 4]
+    assert cache.cache_size[0] == pytest.approx(3 * FILE_SIZE / 1e9)
+
+
+def test_lfu_evicts_least_frequently_used(cache):
+    cache._eviction = 'lfu'
+    cache._index.touch('wind', 'power', [0], when=10)
+    cache.test_cache_size(2 * FILE_SIZE / 1e9)
+    assert cached_sites(cache) == [0, 3, 4]
+
+
+def test_pinned_files_are_kept(cache):
+    cache.pin_sites('wind', 'power', [0])
+    with cache.pin([cache.get_file_path('wind', 'power', 1)]):
+        cache.test_cache_size(2 * FILE_SIZE / 1e9)
+
+    assert cached_sites(cache) == [0, 1, 4]
+
+    # Pins are shared with other processes through the index
+    other = InternalDataStore(cache._cache_root, size=cache._size,
+                              validate=False)
+    other.pin_sites('wind', 'power', [4])
+    with pytest.raises(RuntimeError):
+        other.test_cache_size(4 * FILE_SIZE / 1e9)
+
+    assert cached_sites(cache) == [0, 4]
+
+
+def test_no_eviction_raises(cache):
+    cache._eviction = None
+    with pytest.raises(RuntimeError):
+        cache.test_cache_size(FILE_SIZE / 1e9)
+
+    assert cached_sites(cache) == SITES
@@ -0,0 +1,161 @@
+"""
+Test the asyncio HTTP client against a local HTTP server: chunked bodies,
+interim responses, keep-alive connection reuse, redirects and timeouts
+"""
+import asyncio
+from http.server import BaseHTTPRequestHandler
+import re
+import time
+
+import pytest
+
+from R2PD.httpclient import ConnectionPool, HTTPError
+from R2PD.Timeout import TimeoutError
+
+DATA = bytes(range(256)) * 40
+
+
+class HTTPHandler(BaseHTTPRequestHandler):
+    """
+    Serves DATA in several ways depending on the path, and records the
+    method, path and headers of each request
+    """
+    protocol_version = 'HTTP/1.1'
+    # Length of the body of redirects
+    redirect_body = 0
+    # Seconds /slow is delayed by
+    delay = 1
+
+    def log_message(self, *args):
+        pass
+
+    def send_data(self, data, chunk_size=None):
+        self.send_response(200)
+        if chunk_size is None:
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for start in range(0, len(data), chunk_size):
+                chunk = data[start:start + chunk_size]
+                self.wfile.write('{:x};ext=1\r\n'.format(len(chunk))
+                                 .encode('ascii') + chunk + b'\r\n')
+
+            self.wfile.write(b'0\r\nX-Trailer: 1\r\n\r\n')
+
+    def do_GET(self):
+        self.requests.append((self.command, self.path, dict(self.headers)))
+        redirect = re.match(r'/redirect/(\d+)$', self.path)
+        if self.path == '/file':
+            self.send_data(DATA)
+        elif self.path == '/chunked':
+            self.send_data(DATA, chunk_size=1000)
+        elif self.path == '/continue':
+            self.send_response_only(100)
+            self.end_headers()
+            self.send_data(DATA)
+        elif self.path == '/slow':
+            time.sleep(self.delay)
+            self.send_data(DATA)
+        elif redirect is not None:
+            hops = int(redirect.group(1))
+            self.send_response(302)
+            self.send_header('Location', '/redirect/{}'.format(hops - 1)
+                             if hops > 1 else '/file')
+            self.send_header('Content-Length', str(self.redirect_body))
+            self.end_headers()
+            self.wfile.write(b'x' * self.redirect_body)
+        else:
+            self.send_error(404)
+
+
+http_server = pytest.mark.parametrize('server', [HTTPHandler],
+                                      indirect=True)
+
+
+async def get_all(pool, urls, **kwargs):
+    """
+    GET each of urls in turn, reading their bodies
+    """
+    bodies = []
+    for url in urls:
+        response = await pool.get(url, **kwargs)
+        try:
+            bodies.append(await response.read(chunk_size=300))
+        finally:
+            response.close()
+
+    return bodies
+
+
+@http_server
+def test_connections_are_reused(server):
+    pool = ConnectionPool()
+    urls = [server.url + path for path in ['/file', '/chunked', '/file']]
+    assert asyncio.run(get_all(pool, urls)) == [DATA] * 3
+    assert len(server.requests) == 3
+    assert pool.opened == 1
+
+
+@http_server
+def test_connections_are_not_reused_without_keep_alive(server):
+    pool = ConnectionPool(keep_alive=False)
+    urls = [server.url + path for path in ['/file', '/chunked']]
+    assert asyncio.run(get_all(pool, urls)) == [DATA] * 2
+    assert pool.opened == 2
+
+
+@http_server
+def test_interim_response_is_skipped(server):
+    # Reading the interim response as the final one would wait for a body
+    pool = ConnectionPool(read_timeout=5)
+    urls = [server.url + '/continue', server.url + '/file']
+    assert asyncio.run(get_all(pool, urls)) == [DATA] * 2
+    assert pool.opened == 1
+
+
+@http_server
+def test_redirects_are_limited(server):
+    pool = ConnectionPool()
+    url = server.url + '/redirect/3'
+    assert asyncio.run(get_all(pool, [url], max_redirects=3)) == [DATA]
+    assert [path for _, path, _ in server.requests] == \
+        ['/redirect/3', '/redirect/2', '/redirect/1', '/file']
+
+    with pytest.raises(HTTPError, match='Too many redirects'):
+        asyncio.run(get_all(pool, [url], max_redirects=2))
+
+
+@http_server
+@pytest.mark.parametrize('redirect_body, opened', [(10, 1), (1000, 2)])
+def test_long_redirect_bodies_are_not_drained(server, redirect_body,
+                                              opened):
+    server.RequestHandlerClass.redirect_body = redirect_body
+    pool = ConnectionPool()
+    pool.MAX_DRAIN = 100
+    url = server.url + '/redirect/1'
+    assert asyncio.run(get_all(pool, [url])) == [DATA]
+    assert pool.opened == opened
+
+
+@http_server
+def test_read_timeout(server):
+    server.RequestHandlerClass.delay = 0.5
+    pool = ConnectionPool(read_timeout=0.1)
+    with pytest.raises(TimeoutError):
+        asyncio.run(get_all(pool, [server.url + '/slow']))
+
+    pool = ConnectionPool(read_timeout=5)
+    assert asyncio.run(get_all(pool, [server.url + '/slow'])) == [DATA]
+
+
+def test_connect_timeout(monkeypatch):
+    async def never_connect(url):
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr('R2PD.httpclient.open_connection', never_connect)
+    pool = ConnectionPool(connect_timeout=0.1)
+    with pytest.raises(TimeoutError, match='Connection to'):
+        asyncio.run(get_all(pool, ['http://127.0.0.1:1/file']))
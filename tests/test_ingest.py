@@ -0,0 +1,111 @@
+"""
+Test read-optimized sidecars and recompression of files as they are added
+to the cache
+"""
+import os
+import shutil
+
+import h5py
+import numpy as np
+import pandas as pds
+
+from conftest import WIND_FILE
+from R2PD import ingest
+from R2PD.datastore import DRPower, InternalDataStore
+
+
+def copy_wind_file(tmpdir):
+    """
+    Copy of tests/wind/wind_power_0.hdf5 in tmpdir
+    """
+    path = os.path.join(str(tmpdir), 'wind_power_0.hdf5')
+    shutil.copyfile(WIND_FILE, path)
+    return path
+
+
+def read_file(path):
+    """
+    Decoded power data of a resource file, read from the file itself
+    """
+    with h5py.File(path, 'r') as h5_file:
+        return ingest.decode_time_series(h5_file['power_data'][...])
+
+
+def assert_same_data(left, right):
+    """
+    Check DataFrames hold the same data, whatever the resolution of their
+    time indices
+    """
+    pds.testing.assert_frame_equal(left, right, check_index_type=False)
+
+
+def test_sidecar_round_trip(tmpdir):
+    path = copy_wind_file(tmpdir)
+    sidecar_path = ingest.write_sidecar(path, 'power_data',
+                                        compression='gzip')
+    assert sidecar_path == ingest.get_sidecar_path(path)
+
+    data = ingest.read_sidecar(path, 'power_data')
+    assert_same_data(data, read_file(path))
+    assert ingest.read_sidecar(path, 'met_data') is None
+
+    # A current sidecar is not written again
+    assert not ingest.ingest(path)
+
+    # Nor is a sidecar read once its file has changed
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert ingest.read_sidecar(path, 'power_data') is None
+    assert_same_data(ingest.read_time_series(path, 'power_data'), data)
+    assert ingest.ingest(path)
+
+
+def test_recompressed_file_reads_back_identically(tmpdir):
+    path = copy_wind_file(tmpdir)
+    cache = InternalDataStore(os.path.join(str(tmpdir), 'cache'), size=None,
+                              compression='lzf', shuffle=True)
+    dst = cache.get_file_path('wind', 'power', 0)
+    cache.validate_download(path, dst)
+
+    with h5py.File(WIND_FILE, 'r') as original, \
+            h5py.File(path, 'r') as recompressed:
+        assert original['power_data'].compression == 'gzip'
+        assert recompressed['power_data'].compression == 'lzf'
+        assert recompressed['power_data'].shuffle
+        assert np.array_equal(recompressed['power_data'][...],
+                              original['power_data'][...])
+        assert np.array_equal(recompressed['loc_data'][...],
+                              original['loc_data'][...])
+
+    # Files already using the filters are left as they are
+    assert not ingest.recompress(path, compression='lzf', shuffle=True)
+
+
+def test_failed_validation_leaves_no_sidecar(server, tmpdir, monkeypatch):
+    cache = InternalDataStore(str(tmpdir), size=None, sidecars=True,
+                              compression='lzf')
+    repo = DRPower(local_cache=cache)
+    repo.DATA_ROOT = server.url
+
+    validate_file = InternalDataStore.validate_file
+
+    def fail_recompressed(file_path, resource_type, size=None, **kwargs):
+        # Only the recompressed file is validated without a size
+        if size is None:
+            raise IOError('{} is corrupt'.format(file_path))
+
+        validate_file(file_path, resource_type, size=size, **kwargs)
+
+    monkeypatch.setattr(InternalDataStore, 'validate_file',
+                        staticmethod(fail_recompressed))
+    report = repo.download_resource_data('wind', [0], 'power')
+    assert report.failed == [0]
+
+    dst = cache.get_file_path('wind', 'power', 0)
+    assert os.listdir(os.path.dirname(dst)) == []
+
+    # The download succeeds once the recompressed file is valid
+    monkeypatch.undo()
+    report = repo.download_resource_data('wind', [0], 'power')
+    assert report.succeeded == [0]
+    assert_same_data(ingest.read_sidecar(dst, 'power_data'), read_file(dst))
@@ -0,0 +1,207 @@
+"""
+Regression test of the array based capacity allocation of
+nearest_power_nodes against the row by row allocation it replaced
+"""
+import numpy as np
+import pandas as pds
+import pytest
+from scipy.spatial import cKDTree
+
+from R2PD.allocation import AllocationMatrix
+from R2PD.nearestnodes import (allocate_capacity, allocate_power_nodes,
+                               get_site_arrays, get_site_tree,
+                               nearest_power_nodes, query_nearest)
+from R2PD.siteindex import SiteIndex
+
+# The row by row implementation relies on deprecated pandas behavior
+pytestmark = pytest.mark.filterwarnings('ignore::DeprecationWarning',
+                                        'ignore::FutureWarning')
+
+
+def legacy_nearest_power_nodes(node_data, resource_meta):
+    """
+    nearest_power_nodes before the allocation was done on arrays
+    """
+    # Create and populate DataFrame from requested list of nodes
+    nodes = pds.DataFrame(columns=['latitude', 'longitude', 'capacity',
+                                   'site_id', 'site_fracs', 'r_cap'],
+                          index=node_data.index)
+
+    nodes.loc[:, ['latitude', 'longitude', 'capacity']] = node_data.values
+    nodes.loc[:, 'r_cap'] = node_data['capacity (MW)']
+
+    site_ids, xyz, r_capacity = get_site_arrays(resource_meta)
+    # Remaining capacity available at each resource node, by row
+    r_cap = r_capacity.copy()
+
+    while True:
+        # Extract rows of resource nodes w/ remaining capacity
+        r_rows = np.flatnonzero(r_cap > 0)
+        if len(r_rows) == len(r_cap):
+            # Reuse the tree of all resource nodes until any is exhausted
+            tree = get_site_tree(resource_meta, xyz)
+        else:
+            # Create cKDTree of unit vectors for resource nodes
+            # w/ available capacity
+            tree = cKDTree(xyz[r_rows])
+
+        # Extract nodes that still have capacity to be filled
+        nodes_left = nodes[nodes['r_cap'] > 0]
+        n_index = nodes_left.index
+        node_lat_lon = nodes_left[['latitude', 'longitude']].values
+
+        # Find first nearest resource node to each requested node
+        dist, pos = query_nearest(tree, node_lat_lon)
+        node_pairs = pds.DataFrame({'pos': pos, 'dist': dist})
+        # Find the nearest pair of resource nodes and requested nodes
+        node_pairs = node_pairs.groupby('pos')['dist'].idxmin()
+
+        # Apply resource node to nearest requested node
+        for i, n in node_pairs.items():
+            r_i = r_rows[i]
+            n_i = n_index[n]
+            file_id = site_ids[r_i]
+            cap = r_cap[r_i]
+            node = nodes.loc[n_i].copy()
+
+            # Determine fract of resource node to apply to requested node
+            if node['r_cap'] > cap:
+                frac = cap / r_capacity[r_i]
+                r_cap[r_i] = 0
+                node['r_cap'] += -1 * cap
+            else:
+                frac = node['r_cap'] / r_capacity[r_i]
+                r_cap[r_i] += -1 * node['r_cap']
+                node['r_cap'] = 0
+
+            if np.all(pds.isnull(node['site_id'])):
+                node['site_id'] = [file_id]
+                node['site_fracs'] = [frac]
+            else:
+                node['site_id'] += [file_id]
+                node['site_fracs'] += [frac]
+
+            nodes.loc[n_i] = node
+
+        # Continue nearest neighbor search and resource distribution
+        # until capacity is filled for all requested nodes
+        if np.sum(nodes['r_cap'] > 0) == 0:
+            break
+
+    return nodes[['latitude', 'longitude', 'capacity', 'site_id',
+                  'site_fracs']]
+
+
+def make_sites(n, seed):
+    """
+    Random resource sites with non-consecutive ids, some without capacity
+    """
+    rng = np.random.default_rng(seed)
+    capacity = rng.uniform(1, 16, n)
+    capacity[rng.random(n) < 0.05] = 0
+    return SiteIndex({'site_id': np.sort(rng.choice(10 * n, n,
+                                                    replace=False)),
+                      'latitude': rng.uniform(25, 49, n),
+                      'longitude': rng.uniform(-125, -67, n),
+                      'capacity': capacity})
+
+
+def make_nodes(n, seed):
+    """
+    Random generator nodes, some without capacity
+    """
+    rng = np.random.default_rng(seed + 1)
+    capacity = rng.uniform(10, 300, n)
+    capacity[rng.random(n) < 0.05] = 0
+    return pds.DataFrame({'latitude': rng.uniform(30, 45, n),
+                          'longitude': rng.uniform(-120, -70, n),
+                          'capacity (MW)': capacity},
+                         index=pds.Index(np.arange(n) * 3, name='node_id'))
+
+
+def assert_same_allocations(expected, result):
+    """
+    Check that each node has the same sites and fractions in the same order
+    """
+    assert expected.columns.tolist() == result.columns.tolist()
+    assert expected.index.equals(result.index)
+    for col in ['site_id', 'site_fracs']:
+        for exp, res in zip(expected[col], result[col]):
+            if np.all(pds.isnull(exp)):
+                assert np.all(pds.isnull(res))
+            else:
+                assert list(exp) == list(res)
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+@pytest.mark.parametrize('as_frame', [False, True])
+def test_same_allocations(seed, as_frame):
+    """
+    Allocations match the row by row implementation exactly
+    """
+    resource_meta = make_sites(2000, seed)
+    if as_frame:
+        resource_meta = resource_meta.to_frame()
+
+    nodes = make_nodes(100, seed)
+    expected = legacy_nearest_power_nodes(nodes, resource_meta)
+    result = nearest_power_nodes(nodes, resource_meta)
+
+    assert_same_allocations(expected, result)
+
+
+def test_candidate_batches():
+    """
+    Extending candidate batches one site at a time gives the same
+    allocations as large batches
+    """
+    sites = make_sites(500, 3)
+    nodes = make_nodes(20, 3)
+    args = (sites.tree, sites['capacity'], nodes.values[:, :2],
+            nodes['capacity (MW)'].values)
+    expected = allocate_capacity(*args, candidates=500)
+    result = allocate_capacity(*args, candidates=1)
+    for exp, res in zip(expected, result):
+        assert np.array_equal(exp, res)
+
+
+def test_exhausted_capacity():
+    """
+    An error is raised rather than looping when there is not enough
+    resource capacity
+    """
+    sites = make_sites(20, 4)
+    nodes = make_nodes(10, 4)
+    with pytest.raises(RuntimeError):
+        nearest_power_nodes(nodes, sites)
+
+
+def test_allocation_matrix(tmp_path):
+    """
+    The allocation matrix matches the per node allocations, aggregates
+    like them and survives a save and load
+    """
+    sites = make_sites(2000, 0)
+    nodes, allocation = allocate_power_nodes(make_nodes(100, 0), sites)
+    expected = AllocationMatrix.from_lists(nodes.index.values,
+                                           nodes['site_id'],
+                                           nodes['site_fracs'])
+    assert np.array_equal(allocation.site_ids, expected.site_ids)
+    assert (allocation.weights != expected.weights).nnz == 0
+
+    path = str(tmp_path / 'allocation.npz')
+    allocation.save(path)
+    loaded = AllocationMatrix.load(path)
+    assert np.array_equal(loaded.node_ids, allocation.node_ids)
+    assert (loaded.weights != allocation.weights).nnz == 0
+
+    rng = np.random.default_rng(5)
+    data = pds.DataFrame(rng.random((24, len(sites))),
+                         columns=sites.site_ids)
+    agg = loaded.aggregate(data)
+    for node_id, site_ids, fracs in nodes[['site_id', 'site_fracs']] \
+            .itertuples():
+        if np.all(pds.isnull(site_ids)):
+            assert np.all(agg[node_id] == 0)
+        else:
+            assert np.allclose(agg[node_id], data[site_ids].values @ fracs)
@@ -0,0 +1,155 @@
+"""
+Test planning downloads from the sizes of files on a local stand-in for
+DR Power, and the memo of sizes and throughput shared between planners
+"""
+import os
+
+import pytest
+
+from conftest import TEST_DIR, StandInHandler
+from R2PD import planner
+from R2PD.downloader import DownloadReport, DownloadResult
+from R2PD.planner import DownloadPlanner
+
+FILES = ['wind/wind_fcst_0.hdf5', 'solar/solar_power_0.hdf5',
+         'wind/wind_power_0.hdf5', 'wind/wind_met_0.hdf5']
+DEFAULT_SIZE = 10 ** 6
+
+
+class FilesHandler(StandInHandler):
+    """
+    Serves the files in tests/ by their path, 404 for files that are missing
+    """
+    def translate_path(self, path):
+        return os.path.join(TEST_DIR, path.lstrip('/'))
+
+
+class FakeClock(object):
+    """
+    Stand-in for the time module whose clock only moves when advanced
+    """
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def advance(self, sec):
+        self.now += sec
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(planner, 'time', clock)
+    return clock
+
+
+def plan(planner, server):
+    """
+    Plan the download of FILES from server
+    """
+    downloads = [(name, '/'.join([server.url, name]), name)
+                 for name in FILES]
+    return planner.plan(downloads, default_size=DEFAULT_SIZE)
+
+
+def heads(server):
+    """
+    Number of HEAD requests made to server
+    """
+    return len([method for method, _, _ in server.requests
+                if method == 'HEAD'])
+
+
+files_server = pytest.mark.parametrize('server', [FilesHandler],
+                                       indirect=True)
+
+
+@files_server
+def test_plan_is_largest_first(server, tmpdir, clock):
+    memo_path = os.path.join(str(tmpdir), 'sizes.json')
+    download_plan = plan(DownloadPlanner(memo_path=memo_path), server)
+
+    sizes = {name: os.path.getsize(os.path.join(TEST_DIR, name))
+             for name in FILES[:3]}
+    sizes['wind/wind_met_0.hdf5'] = DEFAULT_SIZE
+    assert [key for key, _, _ in download_plan.downloads] == \
+        sorted(sizes, key=sizes.get, reverse=True)
+    assert download_plan.total_bytes == sum(sizes.values())
+
+    # The missing file could not be looked up and its size is estimated
+    assert download_plan.estimated == ['wind/wind_met_0.hdf5']
+    assert download_plan.duration == \
+        download_plan.total_bytes / DownloadPlanner.DEFAULT_THROUGHPUT
+
+
+@files_server
+def test_sizes_are_memoized_until_expired(server, tmpdir, clock):
+    memo_path = os.path.join(str(tmpdir), 'sizes.json')
+    plan(DownloadPlanner(memo_path=memo_path), server)
+    assert heads(server) == len(FILES)
+
+    # Only the size that could not be looked up is looked up again, also by
+    # other planners sharing the memo
+    clock.advance(DownloadPlanner.MEMO_TTL - 1)
+    other = DownloadPlanner(memo_path=memo_path)
+    assert plan(other, server).estimated == ['wind/wind_met_0.hdf5']
+    assert heads(server) == len(FILES) + 1
+
+    clock.advance(1)
+    plan(other, server)
+    assert heads(server) == 2 * len(FILES) + 1
+
+
+@files_server
+def test_duration_from_recorded_throughput(server, tmpdir, clock):
+    memo_path = os.path.join(str(tmpdir), 'sizes.json')
+    planner = DownloadPlanner(memo_path=memo_path)
+    download_plan = plan(planner, server)
+
+    report = DownloadReport([DownloadResult(key, src, dst, success=True,
+                                            size=10 ** 7)
+                             for key, src, dst in download_plan.downloads])
+    planner.record(report, 2)
+    assert planner.throughput == 2 * 10 ** 7
+    download_plan = plan(planner, server)
+    assert download_plan.duration == download_plan.total_bytes / 2e7
+
+    # Later measurements are smoothed, and shared through the memo
+    planner.record(report, 4)
+    assert planner.throughput == 1.5 * 10 ** 7
+    assert DownloadPlanner(memo_path=memo_path).throughput == 1.5 * 10 ** 7
+
+    # Recorded sizes replace estimates
+    download_plan = plan(planner, server)
+    assert not download_plan.estimated
+    assert download_plan.total_bytes == len(FILES) * 10 ** 7
+
+    # Bandwidth caps the expected throughput
+    assert DownloadPlanner(memo_path=memo_path,
+                           bandwidth=10 ** 6).throughput == 10 ** 6
+
+
+@files_server
+def test_memo_is_saved_outside_planner_lock(server, tmpdir):
+    memo_path = os.path.join(str(tmpdir), 'sizes.json')
+    saves = []
+
+    class MemoLock(object):
+        """
+        Lock on the memo recording whether the planner lock is held while
+        the memo is saved
+        """
+        def __enter__(self):
+            saves.append(planner._lock.locked())
+
+        def __exit__(self, type, value, traceback):
+            pass
+
+    planner = DownloadPlanner(memo_path=memo_path,
+                              lock_factory=lambda path: MemoLock())
+    key, src, dst = plan(planner, server).downloads[0]
+    result = DownloadResult(key, src, dst, success=True, size=10)
+    planner.record(DownloadReport([result]), 1)
+    assert saves == [False, False]
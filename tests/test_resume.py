@@ -0,0 +1,158 @@
+"""
+Test resuming journaled partial downloads with Range requests against a
+local HTTP server
+"""
+from http.server import BaseHTTPRequestHandler
+import os
+import re
+
+import pytest
+
+from R2PD.downloader import (AsyncDownloader, PartialDownload,
+                             parse_content_range)
+
+DATA = bytes(range(256)) * 400
+ETAG = '"v2"'
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """
+    Serves DATA, honoring Range and If-Range unless ranges is False, and
+    records the headers of each GET request
+    """
+    protocol_version = 'HTTP/1.1'
+    ranges = True
+
+    def log_message(self, *args):
+        pass
+
+    def send_data(self, status, start, end):
+        self.send_response(status)
+        self.send_header('ETag', ETAG)
+        self.send_header('Content-Length', str(end - start))
+        if status == 206:
+            self.send_header('Content-Range', 'bytes {}-{}/{}'
+                             .format(start, end - 1, len(DATA)))
+
+        self.end_headers()
+        if self.command == 'GET':
+            self.wfile.write(DATA[start:end])
+
+    def do_HEAD(self):
+        self.send_data(200, 0, len(DATA))
+
+    def do_GET(self):
+        self.requests.append(dict(self.headers))
+        match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+        if_range = self.headers.get('If-Range')
+        if (not self.ranges or match is None
+                or (if_range is not None and if_range != ETAG)):
+            self.send_data(200, 0, len(DATA))
+        else:
+            start = int(match.group(1))
+            end = int(match.group(2)) + 1 if match.group(2) else len(DATA)
+            self.send_data(206, start, min(end, len(DATA)))
+
+
+range_server = pytest.mark.parametrize('server', [RangeHandler],
+                                       indirect=True)
+
+
+def journal(src, dst, data, validator=ETAG):
+    """
+    Journal a partial download of src holding data at its start
+    """
+    part = PartialDownload(src, dst)
+    part.reset(size=len(DATA), validator=validator)
+    with open(part.path, 'r+b') as f:
+        f.write(data)
+
+    part.add_range(0, len(data))
+    part.save()
+
+    return part
+
+
+def download(src, dst):
+    """
+    Download src to dst, checking that only the complete file remains
+    """
+    downloader = AsyncDownloader()
+    try:
+        report = downloader.download([(dst, src, dst)])
+    finally:
+        downloader.close()
+
+    report.raise_for_failures()
+    with open(dst, 'rb') as f:
+        assert f.read() == DATA
+
+    assert os.listdir(os.path.dirname(dst)) == [os.path.basename(dst)]
+
+
+def test_parse_content_range():
+    assert parse_content_range('bytes 0-99/1000') == (0, 100, 1000)
+    assert parse_content_range('bytes 100-199/*') == (100, 200, None)
+    with pytest.raises(ValueError):
+        parse_content_range('bytes */1000')
+
+
+@range_server
+def test_partial_download_is_resumed(server, tmpdir):
+    src = server.url + '/file.hdf5'
+    dst = os.path.join(str(tmpdir), 'file.hdf5')
+    half = len(DATA) // 2
+    journal(src, dst, DATA[:half])
+    assert PartialDownload(src, dst).missing_ranges == [(half, len(DATA))]
+
+    download(src, dst)
+    headers, = server.requests
+    assert headers['Range'] == 'bytes={}-{}'.format(half, len(DATA) - 1)
+    assert headers['If-Range'] == ETAG
+
+
+@range_server
+def test_changed_file_is_downloaded_again(server, tmpdir):
+    src = server.url + '/file.hdf5'
+    dst = os.path.join(str(tmpdir), 'file.hdf5')
+    half = len(DATA) // 2
+    journal(src, dst, b'x' * half, validator='"v1"')
+
+    download(src, dst)
+    headers, = server.requests
+    assert headers['If-Range'] == '"v1"'
+
+
+@range_server
+def test_ignored_range_restarts_download(server, tmpdir):
+    server.RequestHandlerClass.ranges = False
+    src = server.url + '/file.hdf5'
+    dst = os.path.join(str(tmpdir), 'file.hdf5')
+    half = len(DATA) // 2
+    journal(src, dst, b'x' * half)
+
+    download(src, dst)
+    headers, = server.requests
+    assert headers['Range'] == 'bytes={}-{}'.format(half, len(DATA) - 1)
+
+
+@range_server
+def test_downloads_reuse_connections(server, tmpdir):
+    downloader = AsyncDownloader(connections_per_host=1)
+    try:
+        for name in ['file_0.hdf5', 'file_1.hdf5']:
+            dst = os.path.join(str(tmpdir), name)
+            report = downloader.download([(dst, server.url + '/' + name,
+                                           dst)])
+            report.raise_for_failures()
+
+        # Later downloads reuse the connection of earlier ones
+        assert len(server.requests) == 2
+        assert downloader._pool.opened == 1
+        thread = downloader._runner._thread
+    finally:
+        downloader.close()
+
+    # Closing stops the event loop, and closing again does nothing
+    assert not thread.is_alive()
+    downloader.close()
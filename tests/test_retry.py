@@ -0,0 +1,265 @@
+"""
+Test the retry policy and circuit breaker against a fake clock
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from R2PD import retry, Timeout
+from R2PD.httpclient import HTTPError
+from R2PD.retry import CircuitBreaker, CircuitOpenError, RetryPolicy
+from R2PD.Timeout import Deadline
+
+
+class FakeClock(object):
+    """
+    Stand-in for the time module whose clock only moves when advanced
+    """
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def advance(self, sec):
+        self.now += sec
+
+    def sleep(self, sec):
+        self.advance(sec)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(retry, 'time', clock)
+    monkeypatch.setattr(Timeout, 'time', clock)
+    return clock
+
+
+def error(status):
+    """
+    HTTPError with status
+    """
+    return HTTPError('http://127.0.0.1/file.hdf5', status, 'Error')
+
+
+def test_backoff_is_capped():
+    policy = RetryPolicy(attempts=10, backoff=0.5, max_backoff=3, jitter=0)
+    delays = [policy.delay(attempt) for attempt in range(1, 6)]
+    assert delays == [0.5, 1, 2, 3, 3]
+
+
+def test_jitter_shortens_delays(monkeypatch):
+    policy = RetryPolicy(backoff=2, jitter=0.5)
+    monkeypatch.setattr(retry.random, 'random', lambda: 1.0)
+    assert policy.delay(1) == 1
+    monkeypatch.setattr(retry.random, 'random', lambda: 0.0)
+    assert policy.delay(1) == 2
+
+
+def test_only_transient_errors_are_retried():
+    policy = RetryPolicy(attempts=3)
+    for status in (500, 502, 503, 504, 408, 429):
+        assert policy.should_retry(error(status), 1)
+
+    for status in (400, 401, 403, 404, 416):
+        assert not policy.should_retry(error(status), 1)
+
+    for ex in (ConnectionResetError(), TimeoutError(),
+               asyncio.IncompleteReadError(b'', 10)):
+        assert policy.should_retry(ex, 2)
+
+    assert not policy.should_retry(ValueError(), 1)
+    assert not policy.should_retry(error(503), 3)
+
+    with pytest.raises(ValueError):
+        RetryPolicy(attempts=0)
+
+
+def test_breaker_opens_on_failure_rate(clock):
+    breaker = CircuitBreaker(failure_rate=0.5, window=4, min_requests=4,
+                             reset_timeout=30)
+    for success in (False, False, True):
+        breaker.record(success)
+
+    # Too few requests to judge
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    # 2 of 4 failures is not more than failure_rate
+    breaker.record(True)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    # Oldest outcomes leave the window, 3 of 4 failures opens the circuit
+    breaker.record(False)
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.opened == 1
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+    assert breaker.rejected == 1
+
+
+def test_breaker_half_opens(clock):
+    breaker = CircuitBreaker(failure_rate=0.5, window=2, min_requests=2,
+                             reset_timeout=30)
+    breaker.record(False)
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    clock.advance(29)
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+    # A single trial request is let through once reset_timeout has passed
+    clock.advance(1)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.check()
+    assert not breaker.check()
+
+    # Its failure opens the circuit again
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.opened == 2
+
+    clock.advance(30)
+    assert breaker.check()
+    # A trial that never reports back is replaced
+    clock.advance(30)
+    assert breaker.check()
+
+    # Its success closes the circuit and forgets previous failures
+    breaker.record(True)
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record(False)
+    assert breaker.check()
+
+
+def failing(*errors):
+    """
+    Request raising errors in turn, then returning 'data'
+    """
+    errors = list(errors)
+
+    def request():
+        if errors:
+            raise errors.pop(0)
+
+        return 'data'
+
+    return request
+
+
+def test_call_retries_transient_errors(clock):
+    policy = RetryPolicy(attempts=3, backoff=1, jitter=0)
+    breaker = CircuitBreaker()
+    request = failing(error(503), ConnectionResetError())
+    assert policy.call(request, breaker=breaker) == ('data', None, 3)
+    assert clock.now == 1003
+    assert breaker._outcomes == [False, False, True]
+
+    # Errors of the request, not the store, are not retried
+    not_found = error(404)
+    assert policy.call(failing(not_found, not_found),
+                       breaker=breaker) == (None, not_found, 1)
+    assert breaker._outcomes[-1]
+
+
+def test_call_stops_at_deadline(clock):
+    policy = RetryPolicy(attempts=5, backoff=1, jitter=0)
+    breaker = CircuitBreaker()
+    request = failing(*[error(503)] * 5)
+    result, ex, attempts = policy.call(request, breaker=breaker,
+                                       deadline=Deadline(2.5))
+    # The second retry is cut short by the deadline
+    assert (result, attempts) == (None, 2)
+    assert isinstance(ex, Timeout.TimeoutError)
+    assert clock.now == 1002.5
+
+    # An attempt stopped by the deadline does not count against the store
+    def slow_request():
+        clock.advance(10)
+        raise error(503)
+
+    outcomes = list(breaker._outcomes)
+    _, ex, attempts = policy.call(slow_request, breaker=breaker,
+                                  deadline=Deadline(5))
+    assert isinstance(ex, Timeout.TimeoutError)
+    assert attempts == 1
+    assert breaker._outcomes == outcomes
+
+
+def test_call_async_retries_transient_errors():
+    policy = RetryPolicy(attempts=2, backoff=0.01, jitter=0)
+    breaker = CircuitBreaker()
+    request = failing(error(503))
+
+    async def fetch():
+        return request()
+
+    assert asyncio.run(policy.call_async(fetch, breaker=breaker)) == \
+        ('data', None, 2)
+    assert breaker._outcomes == [False, True]
+
+    breaker = CircuitBreaker(window=1, min_requests=1)
+    breaker.record(False)
+    result, ex, attempts = asyncio.run(policy.call_async(fetch,
+                                                         breaker=breaker))
+    assert isinstance(ex, CircuitOpenError)
+    assert attempts == 0
+
+
+def open_breaker(reset_timeout):
+    """
+    CircuitBreaker opened by a single failure
+    """
+    breaker = CircuitBreaker(window=1, min_requests=1,
+                             reset_timeout=reset_timeout)
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.OPEN
+    return breaker
+
+
+def test_wait_sleeps_until_trial_is_replaced():
+    breaker = open_breaker(0.2)
+    time.sleep(0.2)
+    assert breaker.check()
+    assert not breaker.wait(timeout=0.05)
+
+    start = time.monotonic()
+    assert breaker.wait()
+    assert 0.1 < time.monotonic() - start < 1
+
+
+def test_waiting_threads_wake_when_trial_succeeds(clock):
+    breaker = open_breaker(30)
+    clock.advance(30)
+    assert breaker.check()
+
+    waited = []
+    thread = threading.Thread(target=lambda: waited.append(breaker.wait()))
+    thread.start()
+    time.sleep(0.1)
+    assert not waited
+    breaker.record(True)
+    thread.join(5)
+    assert waited == [True]
+
+
+def test_waiting_coroutines_wake_when_trial_fails(clock):
+    breaker = open_breaker(30)
+    clock.advance(30)
+    assert breaker.check()
+
+    async def wait():
+        loop = asyncio.get_running_loop()
+        loop.call_later(0.05, breaker.record, False)
+        with pytest.raises(CircuitOpenError):
+            await breaker.wait_async()
+
+    asyncio.run(asyncio.wait_for(wait(), 5))
+    assert not breaker._waiters
@@ -0,0 +1,73 @@
+"""
+Stress test single-flight downloads into a cache shared by several
+processes, each downloading with several threads
+"""
+import collections
+import multiprocessing
+import os
+import threading
+
+import pytest
+
+from conftest import StandInHandler
+from R2PD.datastore import DRPower, InternalDataStore
+
+SITES = list(range(20))
+
+
+class SlowHandler(StandInHandler):
+    """
+    StandInHandler whose slow responses make overlapping requests likely
+    """
+    delay = 0.05
+
+
+def download(cache_root, url, threads=2):
+    """
+    Download all SITES into cache_root from several threads
+    """
+    cache = InternalDataStore(cache_root, size=None)
+    repo = DRPower(local_cache=cache, threads=4)
+    repo.DATA_ROOT = url
+
+    reports = []
+
+    def run():
+        reports.append(repo.download_resource_data('wind', SITES, 'power'))
+
+    workers = [threading.Thread(target=run) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+
+    for worker in workers:
+        worker.join()
+
+    for report in reports:
+        report.raise_for_failures()
+
+
+@pytest.mark.parametrize('server', [SlowHandler], indirect=True)
+def test_single_flight(server, tmpdir):
+    cache_root = str(tmpdir)
+    url = server.url
+    ctx = multiprocessing.get_context('spawn')
+    procs = [ctx.Process(target=download, args=(cache_root, url))
+             for _ in range(4)]
+    for proc in procs:
+        proc.start()
+
+    for proc in procs:
+        proc.join(120)
+        assert proc.exitcode == 0
+
+    counts = collections.Counter(path for method, path, _ in server.requests
+                                 if method == 'GET')
+    assert len(counts) == len(SITES)
+    assert max(counts.values()) == 1
+
+    cache = InternalDataStore(cache_root, size=None)
+    for site in SITES:
+        assert cache.check_cache('wind', site, resource_type='power')
+
+    wind_files = os.listdir(os.path.join(cache_root, 'wind'))
+    assert not [f for f in wind_files if f.endswith('.part')]
@@ -0,0 +1,86 @@
+"""
+Test that the KD-tree of a site index is saved with it and loaded by other
+processes
+"""
+import multiprocessing
+import os
+
+import numpy as np
+import pandas as pds
+
+from R2PD import siteindex
+from R2PD.siteindex import SiteIndex
+
+
+def write_meta(csv_path, n_sites, seed=0):
+    """
+    Write site meta of n_sites random sites to csv_path
+    """
+    rng = np.random.default_rng(seed)
+    pds.DataFrame({'site_id': np.arange(n_sites),
+                   'latitude': rng.uniform(25, 50, n_sites),
+                   'longitude': rng.uniform(-125, -65, n_sites),
+                   'capacity': np.ones(n_sites)}).to_csv(csv_path,
+                                                         index=False)
+
+
+def unbuildable(*args, **kwargs):
+    raise AssertionError('Built KD-tree instead of loading it')
+
+
+def query_without_building(csv_path, queue):
+    """
+    Query the tree of the index of csv_path, failing if it is built
+    """
+    siteindex.cKDTree = unbuildable
+    index = SiteIndex.load(csv_path)
+    queue.put(index.tree.query([index.xyz[3]])[1].tolist())
+
+
+def test_tree_is_loaded_by_other_processes(tmpdir, monkeypatch):
+    csv_path = os.path.join(str(tmpdir), 'wind_site_meta.csv')
+    write_meta(csv_path, 100)
+    monkeypatch.setattr(SiteIndex, '_trees', {})
+    index = SiteIndex.load(csv_path)
+    assert index.tree.n == 100
+    assert os.path.exists(os.path.join(index.path, SiteIndex.TREE_FILE))
+    assert not [name for name in os.listdir(index.path)
+                if name.endswith('.tmp')]
+
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=query_without_building,
+                       args=(csv_path, queue))
+    proc.start()
+    proc.join(60)
+    assert proc.exitcode == 0
+    assert queue.get(timeout=1) == [3]
+
+
+def test_tree_is_rebuilt_for_changed_meta(tmpdir, monkeypatch):
+    csv_path = os.path.join(str(tmpdir), 'wind_site_meta.csv')
+    write_meta(csv_path, 100)
+    monkeypatch.setattr(SiteIndex, '_trees', {})
+    index = SiteIndex.load(csv_path)
+    index.tree
+    with open(os.path.join(index.path, SiteIndex.TREE_FILE), 'rb') as f:
+        saved = f.read()
+
+    # A tree saved for another version of the .csv is not used
+    write_meta(csv_path, 50, seed=1)
+    changed = SiteIndex.load(csv_path)
+    assert changed.path != index.path
+    with open(os.path.join(changed.path, SiteIndex.TREE_FILE), 'wb') as f:
+        f.write(saved)
+
+    monkeypatch.setattr(SiteIndex, '_trees', {})
+    assert changed.tree.n == 50
+    assert np.allclose(changed.tree.data, changed.xyz)
+
+    # Nor is an unreadable one
+    with open(os.path.join(changed.path, SiteIndex.TREE_FILE), 'wb') as f:
+        f.write(b'corrupt')
+
+    monkeypatch.setattr(SiteIndex, '_trees', {})
+    changed = SiteIndex.load(csv_path)
+    assert changed.tree.n == 50
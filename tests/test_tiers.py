@@ -0,0 +1,134 @@
+"""
+Test searching read-only cache tiers for resource files and promoting them
+into the writable local cache
+"""
+import filecmp
+import os
+import shutil
+
+import pytest
+
+from conftest import WIND_FILE
+from R2PD.datastore import InternalDataStore
+
+FILE_SIZE = os.path.getsize(WIND_FILE)
+
+
+def add_file(tier, site_id, corrupt=False):
+    """
+    Add a wind power file for site_id to tier, a copy of
+    tests/wind/wind_power_0.hdf5 unless it is corrupt
+    """
+    path = os.path.join(tier, 'wind', 'wind_power_{}.hdf5'.format(site_id))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if corrupt:
+        with open(path, 'wb') as f:
+            f.write(b'0' * 100)
+    else:
+        shutil.copyfile(WIND_FILE, path)
+
+    return path
+
+
+def snapshot(root):
+    """
+    Size and modification time of every file under root
+    """
+    files = {}
+    for dir_path, _, names in os.walk(root):
+        for name in names:
+            stat = os.stat(os.path.join(dir_path, name))
+            files[os.path.relpath(os.path.join(dir_path, name), root)] = \
+                (stat.st_size, stat.st_mtime_ns)
+
+    return files
+
+
+@pytest.fixture
+def tiers(tmpdir):
+    """
+    Two read-only tiers: the first holds site 0 and a corrupt copy of site
+    1, the second sites 0, 1 and 2
+    """
+    first = os.path.join(str(tmpdir), 'first')
+    second = os.path.join(str(tmpdir), 'second')
+    add_file(first, 0)
+    add_file(first, 1, corrupt=True)
+    for site_id in range(3):
+        add_file(second, site_id)
+
+    return [first, second]
+
+
+def local_cache(tmpdir, tiers, size=None, eviction='lru'):
+    """
+    Local cache searching tiers
+    """
+    return InternalDataStore(os.path.join(str(tmpdir), 'local'), size=size,
+                             eviction=eviction, tiers=tiers)
+
+
+def test_tiers_are_searched_in_order(tmpdir, tiers):
+    before = [snapshot(tier) for tier in tiers]
+    cache = local_cache(tmpdir, tiers)
+    first, second = tiers
+
+    assert cache.find_tier_file('wind', 'power', 0) == \
+        os.path.join(first, 'wind', 'wind_power_0.hdf5')
+    # Corrupt files are skipped in favour of later tiers
+    assert cache.find_tier_file('wind', 'power', 1) == \
+        os.path.join(second, 'wind', 'wind_power_1.hdf5')
+    assert cache.find_tier_file('wind', 'power', 2) == \
+        os.path.join(second, 'wind', 'wind_power_2.hdf5')
+    assert cache.find_tier_file('wind', 'power', 3) is None
+    assert cache.check_cache('wind', 2, 'power')
+    assert not cache.check_cache('wind', 3, 'power')
+
+    # Files found in the tiers are neither indexed nor quarantined
+    assert not len(cache._index)
+    assert [snapshot(tier) for tier in tiers] == before
+
+    # Files added to a tier are found by later searches
+    add_file(second, 3)
+    assert cache.find_tier_file('wind', 'power', 3) == \
+        os.path.join(second, 'wind', 'wind_power_3.hdf5')
+
+
+def test_promotion_copies_into_local_cache(tmpdir, tiers):
+    before = [snapshot(tier) for tier in tiers]
+    cache = local_cache(tmpdir, tiers)
+
+    promoted = cache.promote('wind', 'power', [0, 1, 2, 3])
+    assert promoted == [cache.get_file_path('wind', 'power', site_id)
+                        for site_id in range(3)]
+    for site_id, path in enumerate(promoted):
+        assert path.startswith(os.path.join(str(tmpdir), 'local'))
+        assert filecmp.cmp(path, cache.find_tier_file('wind', 'power',
+                                                      site_id),
+                           shallow=False)
+        assert cache._index.get('wind', 'power', site_id)['path'] == path
+
+    # Files already in the local cache are not promoted again
+    assert cache.promote('wind', 'power', [0, 1, 2]) == []
+    assert [snapshot(tier) for tier in tiers] == before
+
+
+def test_tiers_are_never_evicted(tmpdir, tiers):
+    before = [snapshot(tier) for tier in tiers]
+    cache = local_cache(tmpdir, tiers, size=1.5 * FILE_SIZE / 1e9)
+
+    # Promoting each file evicts the local copy of the one before it
+    assert len(cache.promote('wind', 'power', [0, 1, 2])) == 3
+    assert list(cache._index.entries('wind')['site_id']) == [2]
+    assert cache.check_cache('wind', 0, 'power')
+    assert [snapshot(tier) for tier in tiers] == before
+
+
+def test_promotion_stops_once_local_cache_is_full(tmpdir, tiers):
+    before = [snapshot(tier) for tier in tiers]
+    cache = local_cache(tmpdir, tiers, size=1.5 * FILE_SIZE / 1e9,
+                        eviction=None)
+
+    assert cache.promote('wind', 'power', [0, 1, 2]) == \
+        [cache.get_file_path('wind', 'power', 0)]
+    assert [snapshot(tier) for tier in tiers] == before
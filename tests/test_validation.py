@@ -0,0 +1,81 @@
+"""
+Test validation of downloads before they are committed to the cache, and
+quarantine and download again of corrupt cached files
+"""
+import os
+import shutil
+
+import pytest
+
+from conftest import WIND_FILE
+from R2PD.datastore import DRPower, InternalDataStore
+
+
+def truncate(path, size):
+    """
+    Truncate file at path to size bytes
+    """
+    with open(path, 'r+b') as f:
+        f.truncate(size)
+
+
+def test_truncated_download_is_rejected(tmpdir):
+    cache = InternalDataStore(str(tmpdir), size=None)
+    dst = cache.get_file_path('wind', 'power', 0)
+    part = dst + '.part'
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    shutil.copyfile(WIND_FILE, part)
+    size = os.path.getsize(part)
+    cache.validate_download(part, dst, size=size)
+
+    truncate(part, size // 2)
+    with pytest.raises(IOError):
+        cache.validate_download(part, dst, size=size)
+
+    # Truncation is caught from the file alone when the size is unknown
+    with pytest.raises(IOError):
+        cache.validate_download(part, dst)
+
+
+def test_corrupt_file_is_quarantined_and_fetched_again(server, tmpdir):
+    cache_root = str(tmpdir)
+    cache = InternalDataStore(cache_root, size=None)
+    repo = DRPower(local_cache=cache)
+    repo.DATA_ROOT = server.url
+    report, hits = repo.cache_sites('wind', [0, 1], 'power')
+    assert len(report.succeeded) == 2 and not hits
+
+    path = cache.get_file_path('wind', 'power', 1)
+    truncate(path, os.path.getsize(path) // 2)
+
+    # A new process finds the corrupt file and quarantines it
+    cache = InternalDataStore(cache_root, size=None)
+    assert cache.check_cache('wind', 0, resource_type='power')
+    assert not cache.check_cache('wind', 1, resource_type='power')
+    assert not os.path.exists(path)
+    assert len(os.listdir(os.path.join(cache_root, 'quarantine'))) == 1
+
+    repo = DRPower(local_cache=cache)
+    repo.DATA_ROOT = server.url
+    report, hits = repo.cache_sites('wind', [0, 1], 'power')
+    assert report.succeeded == [1] and hits == 1
+    assert os.path.getsize(path) == os.path.getsize(WIND_FILE)
+    assert cache.check_cache('wind', 1, resource_type='power')
+
+
+def test_validation_is_shared_through_the_index(server, tmpdir,
+                                                monkeypatch):
+    cache_root = str(tmpdir)
+    cache = InternalDataStore(cache_root, size=None)
+    repo = DRPower(local_cache=cache)
+    repo.DATA_ROOT = server.url
+    repo.cache_sites('wind', [0], 'power')
+
+    def fail(*args, **kwargs):
+        raise AssertionError('Validated file again')
+
+    # Downloads are validated before they are committed
+    monkeypatch.setattr(InternalDataStore, 'validate_file',
+                        staticmethod(fail))
+    cache = InternalDataStore(cache_root, size=None)
+    assert cache.check_cache('wind', 0, resource_type='power')
@@ -0,0 +1,35 @@
+"""
+Test verification of the whole cache in worker processes and repair of the
+corrupt files it finds
+"""
+import os
+
+from conftest import WIND_FILE
+from R2PD.datastore import DRPower, InternalDataStore
+
+SITES = [0, 1, 2, 3]
+
+
+def test_verify_and_repair(server, tmpdir):
+    cache = InternalDataStore(str(tmpdir), size=None)
+    repo = DRPower(local_cache=cache)
+    repo.DATA_ROOT = server.url
+    report, _ = repo.cache_sites('wind', SITES, 'power')
+    assert sorted(report.succeeded) == SITES
+
+    path = cache.get_file_path('wind', 'power', 2)
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) // 2)
+
+    report = cache.verify(processes=2)
+    assert sorted(report['site_id']) == SITES
+    invalid = report.loc[~report['valid']]
+    assert list(invalid['site_id']) == [2]
+    assert invalid['error'].iloc[0]
+    assert report.loc[report['valid'], 'error'].isnull().all()
+
+    download_report = repo.repair_cache(report)
+    assert download_report.succeeded == [2]
+    assert len(os.listdir(os.path.join(str(tmpdir), 'quarantine'))) == 1
+    assert os.path.getsize(path) == os.path.getsize(WIND_FILE)
+    assert cache.verify(processes=2)['valid'].all()